@@ -0,0 +1,389 @@
+"""ASGI entry point, alongside wsgi:app.  Serves the same webhook routes with the handlers running as
+coroutines over one pooled async HTTP client, so a single process keeps hundreds of events waiting on
+Caspio and Stripe at the same time instead of one per sync worker.
+
+    uvicorn asgi:app --workers 3 --host 127.0.0.1 --port 8000
+
+Events are verified, deduplicated and written exactly like the Flask routes do, with the same payloads,
+logs, metrics and responses.  In webhookQueueMode events are only stored, and the work queue threads
+run the sync handlers.  The profiler only traces the Flask app.
+"""
+import json
+import time
+import asyncio
+from urllib.parse import parse_qs
+from functools import partial
+import stripe
+from main import (
+    app as flaskApp, config, caspioAPI, subscriptionCache, eventStore, workQueue,
+    invoiceLineItemMode, invoiceSubscriptionPayload, subscriptionUpdatedPayload, subscriptionDeletedPayload,
+    acceptEvent as enqueueEvent, WEBHOOK_ROUTES, SEAT_FIELDS, WRITE_MESSAGES, webhookRoutes, spoolPending, spoolWrite,
+    writeOutcome, queueDepth, adminToken, adminAuthorized, adminDeadLetters, start
+)
+from utils.Stripe_API import Stripe_API
+from utils.Async_HTTP_Session import Async_HTTP_Session
+from utils.Async_Caspio_API import Async_Caspio_API
+from utils.Async_Stripe_API import Async_Stripe_API
+from utils.Webhook_Route import Webhook_Route
+from utils.Metrics import metrics
+from utils.Log_Pipeline import fields
+
+logger = flaskApp.logger
+
+# One pooled client per worker process, shared by the Caspio and Stripe clients.
+http = Async_HTTP_Session(
+    maxConnections=int(config.get('asyncMaxConnections', 100)),
+    maxKeepalive=int(config.get('asyncMaxKeepalive', 20))
+)
+asyncCaspioAPI = Async_Caspio_API(caspioAPI=caspioAPI, http=http)
+asyncStripeAPIs = {}
+
+def getAsyncStripeAPI(secretKey: str) -> Async_Stripe_API:
+    """Returns the worker's Async_Stripe_API client for the secret key, creating it on first use.
+
+    Args:
+        secretKey (str): Stripe secret key of the account.
+
+    Returns:
+        Async_Stripe_API: Shared instance of the Async_Stripe_API class
+    """
+    if secretKey not in asyncStripeAPIs:
+        asyncStripeAPIs[secretKey] = Async_Stripe_API(secretKey=secretKey, subscriptionCache=subscriptionCache, http=http)
+    return asyncStripeAPIs[secretKey]
+
+async def getInvoiceSubscription(invoiceObject: dict, stripeAPI: Async_Stripe_API, endpoint: str, caspioAPI: Async_Caspio_API) -> dict:
+    """Quantity and status of the subscription billed by the invoice, see main.getInvoiceSubscription.
+
+    Args:
+        invoiceObject (dict): https://stripe.com/docs/api/invoices/object
+        stripeAPI (Async_Stripe_API): Instance of Async_Stripe_API class
+        endpoint (str): endpoint url of the Caspio table of the product
+        caspioAPI (Async_Caspio_API): Instance of Async_Caspio_API class
+
+    Returns:
+        dict: Subscription with at least 'quantity', and 'status' unless read from the invoice lines.
+    """
+    if invoiceLineItemMode:
+        subscriptionObject = Stripe_API.subscriptionFromInvoice(invoiceObject)
+        if subscriptionObject is not None and await knownCustomer(invoiceObject['customer'], endpoint, caspioAPI):
+            return subscriptionObject
+    return await stripeAPI.getSubscriptionObject(invoiceObject['subscription'])
+
+async def knownCustomer(customerID: str, endpoint: str, caspioAPI: Async_Caspio_API) -> bool:
+    """Whether the customer has a Caspio record, see main.knownCustomer.
+
+    Args:
+        customerID (str): Stripe CustomerID of the user.
+        endpoint (str): endpoint url of the Caspio table of the product
+        caspioAPI (Async_Caspio_API): Instance of Async_Caspio_API class
+
+    Returns:
+        bool: False when there is no record, or Caspio could not tell (down, spooling).
+    """
+    if await asyncio.to_thread(spoolPending):
+        return False
+    try:
+        return await caspioAPI.hasUser(customerID, endpoint)
+    except Exception:
+        return False
+
+async def writeCaspio(operation: str, endpoint: str, data: dict, caspioAPI: Async_Caspio_API, customerID: str = None, **messages) -> bool:
+    """Coroutine twin of main.writeCaspio.  The spool, dead letters and outcome bookkeeping lock files and SQLite,
+    so they run in a thread, off the event loop.
+
+    Args:
+        operation (str): "merge" (mergeUser) or "update" (updateUser)
+        endpoint (str): endpoint url of the Caspio table
+        data (dict): Key:Value information for user.
+        caspioAPI (Async_Caspio_API): Instance of Async_Caspio_API class
+        customerID (str, optional): CustomerID of the update, data['CustomerID'] for a merge.
+        **messages: Log messages of main.writeOutcome, see main.WRITE_MESSAGES.
+
+    Returns:
+        bool: True when Caspio was updated or the write was deferred (spool, dead letter).
+    """
+    if await asyncio.to_thread(spoolPending):
+        # Queue up behind the writes spooled while Caspio was down, so they keep their order.
+        return await asyncio.to_thread(spoolWrite, operation, endpoint, data, customerID=customerID)
+    try:
+        if operation == "merge":
+            response = await caspioAPI.mergeUser(data=data, endpoint=endpoint)
+        else:
+            response = await caspioAPI.updateUser(customerID=customerID, data=data, endpoint=endpoint)
+    except Exception as e:
+        return await asyncio.to_thread(writeOutcome, operation, endpoint, data, error=e, customerID=customerID, **messages)
+    return await asyncio.to_thread(writeOutcome, operation, endpoint, data, response=response, customerID=customerID, **messages)
+
+async def invoice_paid(invoiceObject: dict, endpoint: str, seatField: str, stripeAPI: Async_Stripe_API, caspioAPI: Async_Caspio_API) -> bool:
+    """invoice.paid handler, see main.invoice_paid.
+
+    Args:
+        invoiceObject (dict): https://stripe.com/docs/api/invoices/object
+        endpoint (str): endpoint url of the Caspio table of the product
+        seatField (str): Caspio column of the purchased quantity, "UnitsPurchased" or "Purchased_Seats"
+        stripeAPI (Async_Stripe_API): Instance of Async_Stripe_API class
+        caspioAPI (Async_Caspio_API): Instance of Async_Caspio_API class
+
+    Returns:
+        bool: True when Caspio was updated, there was nothing to update or the write was deferred (spool, dead letter).
+    """
+    if invoiceObject['amount_due'] > 0:
+        UserPayload = invoiceSubscriptionPayload(invoiceObject, await getInvoiceSubscription(invoiceObject, stripeAPI, endpoint, caspioAPI), seatField)
+        logger.info("invoice.paid", extra=fields("webhook", invoiceID=invoiceObject['id'], amountDue=invoiceObject['amount_due'], amountPaid=invoiceObject['amount_paid'], payload=UserPayload))
+        return await writeCaspio("merge", endpoint, UserPayload, caspioAPI, **WRITE_MESSAGES['invoice.paid'])
+    logger.info(f"Do Not Change {'Units' if seatField == 'UnitsPurchased' else 'Seats'} No Charge", extra=fields("webhook", invoiceID=invoiceObject['id']))
+    return True
+
+async def customer_subscription_deleted(subscriptionObject: dict, endpoint: str, caspioAPI: Async_Caspio_API) -> bool:
+    """customer.subscription.deleted handler, see main.customer_subscription_deleted.
+
+    Args:
+        subscriptionObject (dict): https://stripe.com/docs/api/subscriptions/object
+        endpoint (str): endpoint url of the Caspio table of the product
+        caspioAPI (Async_Caspio_API): Instance of Async_Caspio_API class
+
+    Returns:
+        bool: True when Caspio was updated, there was nothing to update or the write was deferred (spool, dead letter).
+    """
+    UserPayload = subscriptionDeletedPayload(subscriptionObject)
+    logger.info("customer.subscription.deleted", extra=fields("webhook", customerID=subscriptionObject['customer'], payload=UserPayload))
+    return await writeCaspio("update", endpoint, UserPayload, caspioAPI, customerID=subscriptionObject['customer'],
+                             **WRITE_MESSAGES['customer.subscription.deleted'])
+
+async def customer_subscription_updated(subscriptionObject: dict, endpoint: str, caspioAPI: Async_Caspio_API) -> bool:
+    """customer.subscription.updated handler, see main.customer_subscription_updated.
+
+    Args:
+        subscriptionObject (dict): https://stripe.com/docs/api/subscriptions/object
+        endpoint (str): endpoint url of the Caspio table of the product
+        caspioAPI (Async_Caspio_API): Instance of Async_Caspio_API class
+
+    Returns:
+        bool: True when Caspio was updated, there was nothing to update or the write was deferred (spool, dead letter).
+    """
+    UserPayload = subscriptionUpdatedPayload(subscriptionObject)
+    logger.info("customer.subscription.updated", extra=fields("webhook", customerID=subscriptionObject['customer'], payload=UserPayload))
+    return await writeCaspio("update", endpoint, UserPayload, caspioAPI, customerID=subscriptionObject['customer'],
+                             **WRITE_MESSAGES['customer.subscription.updated'])
+
+def buildAsyncRoute(route: Webhook_Route) -> Webhook_Route:
+    """The coroutine twin of a route of main.webhookRoutes: same table and verifier, async clients and handlers.
+
+    Args:
+        route (Webhook_Route): Route built by main.buildWebhookRoute
+
+    Returns:
+        Webhook_Route: Instance of the Webhook_Route class
+    """
+    endpoint = route.endpoint
+    stripeAPI = getAsyncStripeAPI(config[f"stripe{route.product}SecretKey{route.environment}"])
+    return Webhook_Route(
+        product=route.product,
+        environment=route.environment,
+        endpoint=endpoint,
+        stripeAPI=stripeAPI,
+        verifier=route.verifier,
+        handlers={
+            'invoice.paid': partial(invoice_paid, endpoint=endpoint, seatField=SEAT_FIELDS[route.product], stripeAPI=stripeAPI, caspioAPI=asyncCaspioAPI),
+            'customer.subscription.updated': partial(customer_subscription_updated, endpoint=endpoint, caspioAPI=asyncCaspioAPI),
+            'customer.subscription.deleted': partial(customer_subscription_deleted, endpoint=endpoint, caspioAPI=asyncCaspioAPI)
+        }
+    )
+
+# (product, environment): Webhook_Route with coroutine handlers.
+asyncRoutes = {key: buildAsyncRoute(route) for key, route in webhookRoutes.items()}
+# Webhook url: (product, environment), for the routes configured in the .env
+routePaths = {path: (product, environment) for path, (_, product, environment) in WEBHOOK_ROUTES.items() if (product, environment) in asyncRoutes}
+
+async def processEvent(event: dict, product: str, environment: str, endpoint: str = None) -> bool:
+    """Runs the coroutine handler for the Stripe event, see main.processEvent.  The event store and subscription
+    cache are SQLite, they are called in a thread.
+
+    Args:
+        event (dict): https://stripe.com/docs/api/events/object
+        product (str): "DispositionPro" or "TitlePro"
+        environment (str): "Prod" or "Dev"
+        endpoint (str, optional): endpoint url of the Caspio table, the route's by default.
+
+    Returns:
+        bool: True when the event was applied, or had already been applied.  False when it failed or another
+            worker is still processing it.
+    """
+    handler = asyncRoutes[(product, environment)].handler(event['type'], endpoint)
+    if eventStore is not None and not await asyncio.to_thread(eventStore.begin, event['id']):
+        processed = await asyncio.to_thread(eventStore.isProcessed, event['id'])
+        logger.info("Event already processed, skipping" if processed else "Event in progress on another worker, skipping",
+                    extra=fields("webhook", eventID=event['id']))
+        metrics.inc("webhook_events_processed_total", type=event['type'], product=product, outcome="skipped" if processed else "in_progress")
+        return processed
+
+    if event['type'] in {'customer.subscription.updated', 'customer.subscription.deleted'}:
+        await asyncio.to_thread(subscriptionCache.put, event['data']['object'], created=event['created'])
+
+    success, error = False, None
+    started = time.perf_counter()
+    try:
+        success = await handler(event['data']['object']) if handler is not None else True
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        if eventStore is not None:
+            await asyncio.to_thread(eventStore.finish, event['id'], success, error)
+        metrics.observe("webhook_event_seconds", time.perf_counter() - started, type=event['type'], product=product)
+        metrics.inc("webhook_events_processed_total", type=event['type'], product=product, outcome="success" if success else "failure")
+    return success
+
+async def acceptEvent(event, payload: bytes, product: str, environment: str, endpoint: str) -> tuple:
+    """Handles a verified webhook event, see main.acceptEvent.
+
+    Args:
+        event (Webhook_Event): https://stripe.com/docs/api/events/object, parsed on first access past its id.
+        payload (bytes): Raw body of the webhook request.
+        product (str): "DispositionPro" or "TitlePro"
+        environment (str): "Prod" or "Dev"
+        endpoint (str): endpoint url of the Caspio table of the product
+
+    Returns:
+        tuple[dict, int]: Response body and status code for Stripe.
+    """
+    if workQueue is not None:
+        # Only stores the job, the work queue threads process it.
+        return await asyncio.to_thread(enqueueEvent, event=event, payload=payload, product=product, environment=environment, endpoint=endpoint)
+
+    if eventStore is not None and await asyncio.to_thread(eventStore.isProcessed, event['id']):
+        logger.info("Duplicate event dropped", extra=fields("webhook", eventID=event['id']))
+        metrics.inc("webhook_duplicates_total", product=product, environment=environment)
+        return {'status': 'accepted', 'message': 'Webhook Already Processed'}, 200
+    metrics.inc("webhook_events_received_total", type=event['type'], product=product, environment=environment)
+
+    await processEvent(event=event, product=product, environment=environment, endpoint=endpoint)
+    return {'status': 'accepted', 'message': 'Webhook Accepted'}, 200
+
+async def readBody(receive, maxBytes: int) -> bytes:
+    """Reads the request body, None when it is larger than maxBytes.
+
+    Args:
+        receive: ASGI receive callable.
+        maxBytes (int): Largest accepted body.
+
+    Returns:
+        bytes
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return bytes(body)
+        body += message.get('body', b'')
+        if len(body) > maxBytes:
+            return None
+        if not message.get('more_body'):
+            return bytes(body)
+
+async def stripeWebhook(scope: dict, receive, product: str, environment: str) -> tuple:
+    """Listening endpoint of the STRIPE webhook of a product and environment, see main.stripeWebhook.
+
+    Returns:
+        tuple[dict, int]: Response body and status code for Stripe.
+    """
+    route = asyncRoutes[(product, environment)]
+    remoteAddr = scope['client'][0] if scope.get('client') else None
+    payload = await readBody(receive, route.verifier.maxPayloadBytes)
+    sig_header = dict(scope['headers']).get(b'stripe-signature', b'').decode('latin-1')
+
+    try:
+        if payload is None:
+            raise ValueError(f"Payload larger than {route.verifier.maxPayloadBytes} bytes rejected")
+        event = route.verifier.verify(payload, sig_header)
+    except ValueError as e:
+        # Invalid payload
+        logger.warning("Invalid Payload", extra=fields("security", error=e, remoteAddr=remoteAddr))
+        return {'status': 'error', 'message': 'Invalid payload'}, 400
+
+    except stripe.error.SignatureVerificationError as e:
+        # Invalid signature
+        logger.warning("Invalid Stripe Signature", extra=fields("security", error=e, remoteAddr=remoteAddr))
+        return {'status': 'error', 'message': 'Invalid signature'}, 400
+
+    return await acceptEvent(event=event, payload=payload, product=product, environment=environment, endpoint=route.endpoint)
+
+# Admin url: method, served when adminToken is in the .env
+ADMIN_ROUTES = {'/admin/dead-letters': 'GET', '/admin/dead-letters/drain': 'POST'}
+
+async def adminRequest(scope: dict, receive) -> tuple:
+    """Dead letter admin routes, see main.adminDeadLetters.  A drain runs in a thread, off the event loop.
+
+    Returns:
+        tuple[dict, int]: Response body and status code.
+    """
+    authorization = dict(scope['headers']).get(b'authorization', b'').decode('latin-1')
+    if scope['path'] == '/admin/dead-letters':
+        options = {key: values[0] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+        return await asyncio.to_thread(adminDeadLetters, "list", authorization, options)
+    try:
+        options = json.loads(await readBody(receive, 65536) or b'{}')
+    except ValueError:
+        options = {}
+    return await asyncio.to_thread(adminDeadLetters, "drain", authorization, options if isinstance(options, dict) else {})
+
+async def respond(send, status: int, body, contentType: str = 'application/json'):
+    """Sends a JSON (dict) or text (str) response."""
+    data = json.dumps(body).encode('utf-8') if isinstance(body, dict) else body.encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', contentType.encode('latin-1')), (b'content-length', str(len(data)).encode('latin-1'))]})
+    await send({'type': 'http.response.body', 'body': data})
+
+async def lifespan(receive, send):
+    """ASGI lifespan, starts the background threads of the worker and closes the pooled connections on shutdown."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await http.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope: dict, receive, send):
+    """ASGI application."""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    started = time.perf_counter()
+    path, method = scope['path'], scope['method']
+    route, contentType = path, 'application/json'
+    if path in routePaths:
+        if method == 'POST':
+            try:
+                body, status = await stripeWebhook(scope, receive, *routePaths[path])
+            except Exception:
+                # Like Flask, log it and answer 500 so Stripe retries the event.
+                logger.exception(f"Exception on {path} [{method}]")
+                body, status = {"Message": "Internal Server Error"}, 500
+        else:
+            body, status = {"Message": "Method Not Allowed"}, 405
+    elif path == '/metrics' and method == 'GET' and adminToken:
+        if adminAuthorized(dict(scope['headers']).get(b'authorization', b'').decode('latin-1')):
+            body, status, contentType = await asyncio.to_thread(metrics.render), 200, 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, status = {'status': 'error', 'message': 'Unauthorized'}, 401
+    elif path == '/queue' and method == 'GET':
+        # Reads SQLite and the spool, in a thread.
+        body, status = await asyncio.to_thread(queueDepth)
+    elif path in ADMIN_ROUTES and adminToken:
+        if method != ADMIN_ROUTES[path]:
+            body, status = {"Message": "Method Not Allowed"}, 405
+        else:
+            body, status = await adminRequest(scope, receive)
+    else:
+        route = "unmatched"
+        headers = dict(scope['headers'])
+        logger.info("Nerd", extra=fields("scanner", userAgent=headers.get(b'user-agent', b'').decode('latin-1'), ip=headers.get(b'x-real-ip', b'').decode('latin-1'), path=path))
+        body, status = {"Message": "Stop"}, 404
+
+    await respond(send, status, body, contentType)
+    metrics.observe("http_request_seconds", time.perf_counter() - started, route=route)
+    metrics.inc("http_requests_total", route=route, method=method, status=status)
@@ -0,0 +1,318 @@
+"""Load generator for the webhook routes of a running server.
+
+Builds Stripe events of every handled type, signs them with the route's signing secret from the .env
+(use test secrets) and posts them at a fixed concurrency.  Throughput, status codes and latency
+percentiles per route and event type are written to a JSON report, which --compare diffs against a
+previous run.  --micro runs in-process micro benchmarks of the request path instead.
+
+    gunicorn --workers 3 --bind 127.0.0.1:8000 wsgi:app
+    python benchmark.py --url http://127.0.0.1:8000 --requests 2000 --concurrency 32 --report after.json --compare before.json
+    python benchmark.py --micro verify --report verify.json
+    python benchmark.py --micro routing --report routing.json
+"""
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import datetime
+import threading
+import tracemalloc
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import stripe
+from dotenv import dotenv_values
+from utils.Webhook_Verifier import Webhook_Verifier
+
+# Route: (product, environment)
+ROUTES = {
+    "/test/dispositionPro/subscriptions": ("DispositionPro", "Dev"),
+    "/test/titlePro/subscriptions": ("TitlePro", "Dev"),
+    "/live/dispositionPro/subscriptions": ("DispositionPro", "Prod"),
+    "/live/titlePro/subscriptions": ("TitlePro", "Prod")
+}
+EVENT_TYPES = ["invoice.paid", "customer.subscription.updated", "customer.subscription.deleted"]
+
+
+def buildEvent(eventType: str, customerNumber: int) -> dict:
+    """A Stripe event of the type, shaped like the ones the handlers read.
+
+    Args:
+        eventType (str): "invoice.paid", "customer.subscription.updated" or "customer.subscription.deleted"
+        customerNumber (int): Picks the customer, so the same customers come back during a run.
+
+    Returns:
+        dict: https://stripe.com/docs/api/events/object
+    """
+    customerID, subscriptionID = f"cus_bench{customerNumber}", f"sub_bench{customerNumber}"
+    quantity = random.randint(1, 20)
+    if eventType == "invoice.paid":
+        eventObject = {
+            "id": f"in_{uuid.uuid4().hex[:24]}", "object": "invoice", "customer": customerID,
+            "customer_email": f"bench{customerNumber}@example.com", "subscription": subscriptionID,
+            "amount_due": 1000 * quantity, "amount_paid": 1000 * quantity, "paid": True,
+            "billing_reason": "subscription_cycle",
+            "lines": {"has_more": False, "data": [
+                {"type": "subscription", "subscription": subscriptionID, "quantity": quantity, "proration": False}
+            ]}
+        }
+    else:
+        cancelAt = int(time.time()) + 30 * 86400 if random.random() < 0.5 else None
+        eventObject = {
+            "id": subscriptionID, "object": "subscription", "customer": customerID, "quantity": quantity,
+            "status": "canceled" if eventType == "customer.subscription.deleted" else "active",
+            "cancel_at": cancelAt, "current_period_end": int(time.time()) + 30 * 86400
+        }
+    return {
+        "id": f"evt_{uuid.uuid4().hex[:24]}", "object": "event", "type": eventType,
+        "created": int(time.time()), "livemode": False, "data": {"object": eventObject}
+    }
+
+def signatureHeader(payload: bytes, secret: str, timestamp: int = None) -> str:
+    """Stripe-Signature header of the payload, t=timestamp,v1=HMAC-SHA256(secret, "timestamp.payload").
+
+    Args:
+        payload (bytes): Request body.
+        secret (str): Webhook signing secret ex: whsec_...
+        timestamp (int, optional): Unix time of the signature, now by default.
+
+    Returns:
+        str: ex: "t=1700000000,v1=5257a8..."
+    """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signedPayload = f"{timestamp}.".encode("utf-8") + payload
+    signature = hmac.new(secret.encode("utf-8"), signedPayload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of sorted values, None when empty."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+def summarize(latencies: list, seconds: float) -> dict:
+    """Latency percentiles in milliseconds and throughput of a list of latencies in seconds."""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p90": round(percentile(latencies, 0.90) * 1000, 2) if latencies else None,
+        "p99": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "max": round(latencies[-1] * 1000, 2) if latencies else None
+    }
+
+
+class Benchmark:
+    """Posts signed events to the server from a pool of threads and records every latency."""
+
+    def __init__(self, url: str, secrets: dict, routes: list, eventTypes: list, customers: int = 100, timeout: float = 30):
+        """
+        Args:
+            url (str): Base url of the server ex: http://127.0.0.1:8000
+            secrets (dict): Route:signing secret.
+            routes (list): Routes hit, in turn.
+            eventTypes (list): Event types sent, in turn.
+            customers (int): Number of distinct customers in the events.
+            timeout (float): Seconds before a request counts as an error.
+        """
+        self.url = url.rstrip("/")
+        self.secrets = secrets
+        self.routes = routes
+        self.eventTypes = eventTypes
+        self.customers = customers
+        self.timeout = timeout
+        self.results = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        """Private Function. One keep-alive session per thread."""
+        if getattr(self._local, "session", None) is None:
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def send(self, number: int):
+        """Builds, signs and posts request 'number', then records its outcome."""
+        route = self.routes[number % len(self.routes)]
+        eventType = self.eventTypes[(number // len(self.routes)) % len(self.eventTypes)]
+        payload = json.dumps(buildEvent(eventType, random.randrange(self.customers))).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Stripe-Signature": signatureHeader(payload, self.secrets[route])}
+
+        started = time.perf_counter()
+        try:
+            status = self._session().post(self.url + route, data=payload, headers=headers, timeout=self.timeout).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        latency = time.perf_counter() - started
+        with self._lock:
+            self.results.append((route, eventType, status, latency))
+
+    def run(self, total: int, concurrency: int, warmup: int = 0) -> dict:
+        """Sends 'total' requests with 'concurrency' in flight, after 'warmup' unrecorded ones.
+
+        Returns:
+            dict: Report.
+        """
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(self.send, range(warmup)))
+            self.results.clear()
+            started = time.perf_counter()
+            list(executor.map(self.send, range(total)))
+            seconds = time.perf_counter() - started
+
+        statuses, groups = {}, {}
+        for route, eventType, status, latency in self.results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            groups.setdefault(f"{route} {eventType}", []).append(latency)
+        return {
+            "startedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "url": self.url,
+            "concurrency": concurrency,
+            "seconds": round(seconds, 3),
+            "statuses": statuses,
+            "errors": sum(count for status, count in statuses.items() if status != "200"),
+            "overall": summarize([result[3] for result in self.results], seconds),
+            "byRoute": {name: summarize(latencies, seconds) for name, latencies in sorted(groups.items())}
+        }
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Relative change of throughput and latency percentiles against a previous report.
+
+    Returns:
+        dict: ex: {"throughput": "+12.0%", "p50": "-8.1%", ...}
+    """
+    changes = {}
+    for key in ("throughput", "p50", "p90", "p99", "max"):
+        before, after = baseline["overall"].get(key), report["overall"].get(key)
+        if before and after is not None:
+            changes[key] = f"{(after - before) / before * 100:+.1f}%"
+    return changes
+
+def microbenchmark(cases: dict, iterations: int) -> dict:
+    """Times each callable and measures the memory it allocates.
+
+    Args:
+        cases (dict): Name:callable taking no arguments.
+        iterations (int): Calls timed per case.
+
+    Returns:
+        dict: Name:{"microseconds", "callsPerSecond", "peakBytes"} per case.
+    """
+    results = {}
+    for name, case in cases.items():
+        for _ in range(min(100, iterations)):
+            case()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            case()
+        seconds = time.perf_counter() - started
+
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        case()
+        peakBytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {
+            "microseconds": round(seconds / iterations * 1e6, 2),
+            "callsPerSecond": round(iterations / seconds, 1),
+            "peakBytes": peakBytes
+        }
+    return results
+
+def microVerify(iterations: int) -> dict:
+    """stripe.Webhook.construct_event against Webhook_Verifier, per event type.
+
+    Returns:
+        dict: Event type:microbenchmark results.
+    """
+    secret = "whsec_benchmark"
+    verifier = Webhook_Verifier(secret)
+    report = {}
+    for eventType in EVENT_TYPES:
+        payload = json.dumps(buildEvent(eventType, 1)).encode("utf-8")
+        header = signatureHeader(payload, secret)
+        report[eventType] = microbenchmark({
+            "construct_event": lambda: stripe.Webhook.construct_event(payload, header, secret)['data']['object']['customer'],
+            "Webhook_Verifier": lambda: verifier.verify(payload, header)['data']['object']['customer'],
+            "Webhook_Verifier (duplicate, id only)": lambda: verifier.verify(payload, header).id
+        }, iterations)
+    return report
+
+def microRouting(iterations: int) -> dict:
+    """Per-request setup of a webhook route: the .env lookups, stripe.api_key and match dispatch the routes
+    used to do against the startup-time route registry of main.py.  Needs the .env of the server.
+
+    Returns:
+        dict: Event type:microbenchmark results.
+    """
+    import main
+    config, product, environment = main.config, "TitlePro", "Dev"
+
+    def perRequest(eventType: str):
+        stripe.api_key = config[f"stripe{product}SecretKey{environment}"]
+        verifier = main.getWebhookVerifier(config[f"stripe{product}SigningSecret{environment}"])
+        stripeAPI = main.getStripeAPI(config[f"stripe{product}SecretKey{environment}"])
+        endpoint = main.CASPIO_ENDPOINTS[(product, environment)]
+        match eventType:
+            case 'customer.subscription.deleted':
+                handler = partial(main.customer_subscription_deleted, endpoint=endpoint, caspioAPI=main.caspioAPI)
+            case 'invoice.paid':
+                invoicePaid = main.DP_invoice_paid if product == "DispositionPro" else main.TP_invoice_paid
+                handler = partial(invoicePaid, endpoint=endpoint, caspioAPI=main.caspioAPI, stripeAPI=stripeAPI)
+            case 'customer.subscription.updated':
+                handler = partial(main.customer_subscription_updated, endpoint=endpoint, caspioAPI=main.caspioAPI)
+            case _:
+                handler = None
+        return verifier, handler
+
+    def registry(eventType: str):
+        route = main.webhookRoutes[(product, environment)]
+        return route.verifier, route.handler(eventType)
+
+    return {eventType: microbenchmark({
+        "per request": lambda: perRequest(eventType),
+        "registry": lambda: registry(eventType)
+    }, iterations) for eventType in EVENT_TYPES}
+
+MICRO_BENCHMARKS = {"verify": microVerify, "routing": microRouting}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the webhook routes of a running server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--routes", nargs="+", default=["/test/dispositionPro/subscriptions", "/test/titlePro/subscriptions"], choices=sorted(ROUTES))
+    parser.add_argument("--events", nargs="+", default=EVENT_TYPES, choices=EVENT_TYPES)
+    parser.add_argument("--requests", type=int, default=1000, help="Requests recorded.")
+    parser.add_argument("--warmup", type=int, default=50, help="Requests sent before recording.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight.")
+    parser.add_argument("--customers", type=int, default=100, help="Distinct customers in the events.")
+    parser.add_argument("--secret", help="Signing secret for every route, instead of the .env ones.")
+    parser.add_argument("--report", default="benchmark_report.json", help="Where the JSON report is written.")
+    parser.add_argument("--compare", help="Previous report to compare with.")
+    parser.add_argument("--micro", choices=sorted(MICRO_BENCHMARKS), help="Run an in-process micro benchmark instead.")
+    parser.add_argument("--iterations", type=int, default=5000, help="Calls per micro benchmark case.")
+    args = parser.parse_args()
+
+    if args.micro:
+        result = MICRO_BENCHMARKS[args.micro](args.iterations)
+        with open(args.report, "w") as reportFile:
+            json.dump(result, reportFile, indent=2)
+        print(json.dumps(result, indent=2))
+        sys.exit(0)
+
+    config = dotenv_values('.env')
+    secrets = {route: args.secret or config[f"stripe{product}SigningSecret{environment}"] for route, (product, environment) in ROUTES.items() if route in args.routes}
+    benchmark = Benchmark(args.url, secrets, args.routes, args.events, customers=args.customers)
+    result = benchmark.run(args.requests, args.concurrency, warmup=args.warmup)
+    if args.compare:
+        with open(args.compare, "r") as baselineFile:
+            result["comparedTo"] = {"report": args.compare, "changes": compare(result, json.load(baselineFile))}
+    with open(args.report, "w") as reportFile:
+        json.dump(result, reportFile, indent=2)
+    print(json.dumps(result["overall"] | {"errors": result["errors"]}, indent=2))
+    sys.exit(1 if result["errors"] else 0)
@@ -0,0 +1,45 @@
+"""Lists, drains and deletes the dead letters: Caspio writes that failed and are retried in the background.
+
+    python deadletters.py list --status failed
+    python deadletters.py drain --workers 16
+    python deadletters.py drain --ids 12 13
+    python deadletters.py delete 12
+
+A drain retries the letters right away, including the ones parked as 'failed' after deadLetterMaxAttempts.
+The letters of one customer run in order, different customers run in parallel.
+"""
+import sys
+import json
+import argparse
+from main import deadLetters, retryDeadLetter
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage the Caspio writes waiting in the dead-letter store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listCommand = commands.add_parser("list", help="Print the letters as JSON lines.")
+    listCommand.add_argument("--status", choices=["pending", "running", "failed"])
+    listCommand.add_argument("--limit", type=int, default=100)
+    drainCommand = commands.add_parser("drain", help="Retry the letters now.")
+    drainCommand.add_argument("--status", choices=["pending", "failed"], help="Only letters with this status, pending and failed by default.")
+    drainCommand.add_argument("--ids", type=int, nargs="+", help="Only these letters.")
+    drainCommand.add_argument("--workers", type=int, default=8, help="Customers retried at the same time.")
+    deleteCommand = commands.add_parser("delete", help="Drop letters that should not be written.")
+    deleteCommand.add_argument("ids", type=int, nargs="+")
+    args = parser.parse_args()
+
+    if deadLetters is None:
+        print("The dead-letter store is off, see deadLetterPath in the .env", file=sys.stderr)
+        sys.exit(1)
+
+    if args.command == "list":
+        for letter in deadLetters.letters(args.status, limit=args.limit):
+            print(json.dumps(letter))
+        print(json.dumps(deadLetters.depth()), file=sys.stderr)
+    elif args.command == "drain":
+        report = deadLetters.drain(retryDeadLetter, workers=args.workers, letterIDs=args.ids,
+                                   statuses=(args.status,) if args.status else ("pending", "failed"))
+        print(json.dumps(report, indent=2), file=sys.stderr)
+        sys.exit(1 if report["failed"] else 0)
+    else:
+        print(json.dumps({"deleted": deadLetters.delete(args.ids)}), file=sys.stderr)
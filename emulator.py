@@ -0,0 +1,339 @@
+"""Local stand-in for the parts of the Caspio and Stripe REST APIs this server uses, so performance work
+and tests can run offline and reproducibly.
+
+Caspio (under /caspio):
+    POST /oauth/token                            client_credentials and refresh_token grants
+    GET/PUT/POST/DELETE /v2/tables/<t>/records   q.where, q.select, q.limit, q.orderBy, q.pageNumber/q.pageSize, response=rows
+Stripe (under /stripe):
+    GET /v1/subscriptions/<id>, /v1/subscriptions (list), /v1/invoices/<id>
+
+Every response can be delayed by a latency distribution and replaced by 401/429/5xx errors at a given rate.
+Point the clients at it with these .env keys:
+
+    apiURL=http://127.0.0.1:5050/caspio
+    accessTokenURL=http://127.0.0.1:5050/caspio/oauth/token
+    stripeAPIURL=http://127.0.0.1:5050/stripe
+
+    python emulator.py --port 5050 --rows 10000 --latency uniform:20:80 --rate-429 0.02 --rate-5xx 0.01
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import parse_qs
+from flask import Flask, request
+
+CONDITION = re.compile(
+    r"\s*(\w+)\s*(?:(=|!=|<>)\s*('(?:[^']|'')*'|-?\d+(?:\.\d+)?)|IN\s*\(([^)]*)\))\s*", re.IGNORECASE
+)
+TABLES = ("DP_Payment_Logs", "Python_DP_PaymentLogs", "TitlePro_PaymentLogs")
+
+
+class UnsupportedWhere(Exception):
+    "Raised when a q.where clause uses syntax the emulator does not understand."
+
+
+def parseLatency(spec: str):
+    """Builds a latency sampler from a spec in milliseconds.
+
+    Args:
+        spec (str): "fixed:20", "uniform:10:80", "normal:50:15", "exp:40" or "" for none.
+
+    Returns:
+        Callable[[], float]: Returns a delay in seconds.
+    """
+    if not spec:
+        return lambda: 0.0
+    kind, *numbers = spec.split(":")
+    numbers = [float(number) / 1000 for number in numbers]
+    samplers = {
+        "fixed": lambda: numbers[0],
+        "uniform": lambda: random.uniform(numbers[0], numbers[1]),
+        "normal": lambda: max(0.0, random.gauss(numbers[0], numbers[1])),
+        "exp": lambda: random.expovariate(1 / numbers[0]) if numbers[0] else 0.0
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution {kind}")
+    return samplers[kind]
+
+def _literal(text: str):
+    """Private Function. Value of a quoted string or number in a q.where clause."""
+    text = text.strip()
+    if text.startswith("'"):
+        return text[1:-1].replace("''", "'")
+    return float(text) if "." in text else int(text)
+
+def parseWhere(where: str):
+    """Compiles the subset of Caspio q.where used by Caspio_API: comparisons and IN lists joined with AND.
+
+    Args:
+        where (str): ex: "PK_ID IN (1,2) AND CustomerID='cus_1'"
+
+    Raises:
+        UnsupportedWhere: For any other syntax.
+
+    Returns:
+        Callable[[dict], bool]: True for the matching records.
+    """
+    if not where:
+        return lambda record: True
+    conditions, position = [], 0
+    while position < len(where):
+        match = CONDITION.match(where, position)
+        if match is None:
+            raise UnsupportedWhere(where)
+        column, operator, value, values = match.groups()
+        if values is not None:
+            options = {_literal(option) for option in values.split(",") if option.strip()}
+            conditions.append(lambda record, column=column, options=options: record.get(column) in options)
+        else:
+            expected, negate = _literal(value), operator in {"!=", "<>"}
+            conditions.append(lambda record, column=column, expected=expected, negate=negate: (record.get(column) == expected) != negate)
+        position = match.end()
+        joiner = re.match(r"AND\s+", where[position:], re.IGNORECASE)
+        if joiner:
+            position += joiner.end()
+        elif position < len(where):
+            raise UnsupportedWhere(where)
+    return lambda record: all(condition(record) for condition in conditions)
+
+
+class Emulator:
+    """State and Flask app of the emulated APIs.  Thread safe, so it can be served by a threaded server."""
+
+    def __init__(self, rows: int = 100, subscriptions: int = None, latency: str = "", rate401: float = 0.0,
+                 rate429: float = 0.0, rate5xx: float = 0.0, tokenTTL: int = 86400, seed: int = None):
+        """
+        Args:
+            rows (int): Records seeded in each Caspio table.
+            subscriptions (int, optional): Stripe subscriptions seeded, defaults to 'rows'.
+            latency (str): Latency distribution of every response, see parseLatency.
+            rate401 (float): Share of Caspio record requests answered 401, which makes the client refresh its token.
+            rate429 (float): Share of requests answered 429 with a Retry-After header.
+            rate5xx (float): Share of requests answered 500, 502 or 503.
+            tokenTTL (int): expires_in of the issued Caspio tokens.  Expired tokens get a 401.
+            seed (int, optional): Seed of the generated data and faults, for reproducible runs.
+        """
+        self.random = random.Random(seed)
+        self.latency = parseLatency(latency)
+        self.rate401, self.rate429, self.rate5xx = rate401, rate429, rate5xx
+        self.tokenTTL = tokenTTL
+        self.tables = {}
+        self.nextPK = {}
+        self.tokens = {}
+        self.refreshTokens = set()
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._seed(rows, rows if subscriptions is None else subscriptions)
+        self.app = self._buildApp()
+
+    def _seed(self, rows: int, subscriptions: int):
+        """Private Function. Generates the Stripe subscriptions and the Caspio rows of their customers."""
+        self.subscriptions = {}
+        for number in range(subscriptions):
+            status = self.random.choice(["active"] * 8 + ["canceled", "past_due"])
+            self.subscriptions[f"sub_{number}"] = {
+                "id": f"sub_{number}", "object": "subscription", "customer": f"cus_{number}",
+                "status": status, "quantity": self.random.randint(1, 25), "created": 1600000000 + number,
+                "cancel_at": 1800000000 + number if status == "canceled" else None,
+                "current_period_end": 1800000000
+            }
+        for table in TABLES:
+            seatField = "Purchased_Seats" if table.startswith("TitlePro") else "UnitsPurchased"
+            self.tables[table] = {}
+            self.nextPK[table] = 1
+            for number in range(rows):
+                self._insert(table, {
+                    "Email": f"customer{number}@example.com", "CustomerID": f"cus_{number}",
+                    seatField: self.random.randint(1, 25), "Status": "active", "EndDate": None
+                })
+
+    def _insert(self, table: str, data: dict) -> dict:
+        """Private Function. Adds a record with the next PK_ID."""
+        record = {**data, "PK_ID": self.nextPK[table]}
+        self.tables[table][record["PK_ID"]] = record
+        self.nextPK[table] += 1
+        return record
+
+    def _count(self, name: str):
+        """Private Function. Adds one to a request counter."""
+        self.stats[name] = self.stats.get(name, 0) + 1
+
+    def _fault(self, caspio: bool):
+        """Private Function. Sleeps for the sampled latency and returns an injected error response, or None."""
+        time.sleep(self.latency())
+        roll = self.random.random()
+        if caspio:
+            if roll < self.rate401:
+                return {"Message": "Invalid access token"}, 401
+            roll -= self.rate401
+        if roll < self.rate429:
+            return {"Message": "Too many requests"}, 429, {"Retry-After": "1"}
+        roll -= self.rate429
+        if roll < self.rate5xx:
+            return {"Message": "Injected failure"}, self.random.choice([500, 502, 503])
+        return None
+
+    def _authorized(self) -> bool:
+        """Private Function. True when the bearer token was issued and has not expired."""
+        token = request.headers.get("Authorization", "").partition(" ")[2]
+        return self.tokens.get(token, 0) > time.time()
+
+    def _issueTokens(self) -> dict:
+        """Private Function. New access and refresh tokens in the Caspio token response shape."""
+        accessToken, refreshToken = f"at_{self.random.getrandbits(64):x}", f"rt_{self.random.getrandbits(64):x}"
+        self.tokens[accessToken] = time.time() + self.tokenTTL
+        self.refreshTokens.add(refreshToken)
+        return {"access_token": accessToken, "refresh_token": refreshToken, "token_type": "bearer", "expires_in": self.tokenTTL}
+
+    def _buildApp(self) -> Flask:
+        """Private Function. Flask app serving the Caspio and Stripe routes."""
+        app = Flask(__name__)
+
+        @app.route('/caspio/oauth/token', methods=['POST'])
+        def token():
+            with self._lock:
+                self._count("caspio.token")
+                # Caspio_API posts the client credentials grant without a form Content-Type.
+                form = {key: values[0] for key, values in parse_qs(request.get_data(as_text=True)).items()}
+                grantType = form.get("grant_type")
+                if grantType == "refresh_token" and form.get("refresh_token") not in self.refreshTokens:
+                    return {"error": "invalid_grant"}, 400
+                if grantType not in {"refresh_token", "client_credentials"}:
+                    return {"error": "unsupported_grant_type"}, 400
+                return self._issueTokens()
+
+        @app.route('/caspio/v2/tables/<table>/records', methods=['GET', 'PUT', 'POST', 'DELETE'])
+        def records(table):
+            fault = self._fault(caspio=True)
+            with self._lock:
+                self._count(f"caspio.{request.method}")
+                if fault is not None:
+                    self._count(f"fault.{fault[1]}")
+                    return fault
+                if not self._authorized():
+                    return {"Message": "Invalid access token"}, 401
+                if table not in self.tables:
+                    return {"Message": f"Table {table} not found"}, 404
+                try:
+                    matches = parseWhere(request.args.get("q.where"))
+                except UnsupportedWhere as e:
+                    return {"Message": f"Unsupported q.where: {e}"}, 400
+                rows = self.tables[table]
+                returnRows = request.args.get("response") == "rows"
+
+                if request.method == "POST":
+                    record = self._insert(table, json.loads(request.data or b"{}"))
+                    return ({"Result": [record]} if returnRows else ""), 201
+                if request.method == "DELETE":
+                    matched = [pkID for pkID, record in rows.items() if matches(record)]
+                    for pkID in matched:
+                        del rows[pkID]
+                    return {"RecordsAffected": len(matched)}
+                if request.method == "PUT":
+                    data = json.loads(request.data or b"{}")
+                    matched = [record for record in rows.values() if matches(record)]
+                    for record in matched:
+                        record.update(data)
+                    body = {"RecordsAffected": len(matched)}
+                    if returnRows:
+                        body["Result"] = matched
+                    return body
+
+                result = [record for record in rows.values() if matches(record)]
+                orderBy = request.args.get("q.orderBy")
+                if orderBy:
+                    column, _, direction = orderBy.partition(" ")
+                    result.sort(key=lambda record: (record.get(column) is None, record.get(column)), reverse=direction.upper() == "DESC")
+                if request.args.get("q.pageNumber") or request.args.get("q.pageSize"):
+                    pageSize = min(int(request.args.get("q.pageSize", 25)), 1000)
+                    start = (int(request.args.get("q.pageNumber", 1)) - 1) * pageSize
+                    result = result[start:start + pageSize]
+                elif request.args.get("q.limit"):
+                    result = result[:int(request.args["q.limit"])]
+                else:
+                    result = result[:1000]
+                select = request.args.get("q.select")
+                if select:
+                    columns = [column.strip() for column in select.split(",")]
+                    result = [{column: record.get(column) for column in columns} for record in result]
+                return {"Result": result}
+
+        @app.route('/stripe/v1/subscriptions', methods=['GET'])
+        def listSubscriptions():
+            fault = self._fault(caspio=False)
+            with self._lock:
+                self._count("stripe.subscriptions.list")
+                if fault is not None:
+                    return fault
+                status = request.args.get("status", "all")
+                subscriptions = [subscription for subscription in self.subscriptions.values() if status == "all" or subscription["status"] == status]
+                startingAfter = request.args.get("starting_after")
+                if startingAfter:
+                    ids = [subscription["id"] for subscription in subscriptions]
+                    subscriptions = subscriptions[ids.index(startingAfter) + 1:] if startingAfter in ids else []
+                limit = min(int(request.args.get("limit", 10)), 100)
+                page = subscriptions[:limit]
+                if request.args.get("expand[]") == "data.customer":
+                    page = [{**subscription, "customer": {"id": subscription["customer"], "email": f"{subscription['customer']}@example.com"}} for subscription in page]
+                return {"object": "list", "data": page, "has_more": len(subscriptions) > limit}
+
+        @app.route('/stripe/v1/subscriptions/<subscriptionID>', methods=['GET'])
+        def getSubscription(subscriptionID):
+            fault = self._fault(caspio=False)
+            with self._lock:
+                self._count("stripe.subscriptions.get")
+                if fault is not None:
+                    return fault
+                if subscriptionID not in self.subscriptions:
+                    return {"error": {"type": "invalid_request_error", "message": f"No such subscription: '{subscriptionID}'"}}, 404
+                return self.subscriptions[subscriptionID]
+
+        @app.route('/stripe/v1/invoices/<invoiceID>', methods=['GET'])
+        def getInvoice(invoiceID):
+            fault = self._fault(caspio=False)
+            with self._lock:
+                self._count("stripe.invoices.get")
+                if fault is not None:
+                    return fault
+                number = invoiceID.rpartition("_")[2]
+                subscription = self.subscriptions.get(f"sub_{number}")
+                if subscription is None:
+                    return {"error": {"type": "invalid_request_error", "message": f"No such invoice: '{invoiceID}'"}}, 404
+                amount = 1000 * subscription["quantity"]
+                return {
+                    "id": invoiceID, "object": "invoice", "customer": subscription["customer"],
+                    "customer_email": f"{subscription['customer']}@example.com", "subscription": subscription["id"],
+                    "amount_due": amount, "amount_paid": amount, "paid": True, "billing_reason": "subscription_cycle",
+                    "lines": {"has_more": False, "data": [
+                        {"type": "subscription", "subscription": subscription["id"], "quantity": subscription["quantity"], "proration": False}
+                    ]}
+                }
+
+        @app.route('/_emulator/stats', methods=['GET'])
+        def stats():
+            with self._lock:
+                return {"requests": dict(self.stats), "tables": {table: len(rows) for table, rows in self.tables.items()}}
+
+        return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local Caspio and Stripe emulator.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--rows", type=int, default=100, help="Records seeded in each Caspio table.")
+    parser.add_argument("--subscriptions", type=int, help="Stripe subscriptions seeded, defaults to --rows.")
+    parser.add_argument("--latency", default="", help="fixed:MS, uniform:MIN:MAX, normal:MEAN:STDDEV or exp:MEAN")
+    parser.add_argument("--rate-401", type=float, default=0.0, help="Share of Caspio requests answered 401.")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of requests answered 429.")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Share of requests answered 500/502/503.")
+    parser.add_argument("--token-ttl", type=int, default=86400, help="expires_in of the Caspio tokens.")
+    parser.add_argument("--seed", type=int, help="Seed for reproducible data and faults.")
+    args = parser.parse_args()
+
+    emulator = Emulator(rows=args.rows, subscriptions=args.subscriptions, latency=args.latency, rate401=args.rate_401,
+                        rate429=args.rate_429, rate5xx=args.rate_5xx, tokenTTL=args.token_ttl, seed=args.seed)
+    emulator.app.run(host=args.host, port=args.port, threaded=True)
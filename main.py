@@ -1,83 +1,495 @@
+import hmac
+import json
 import logging
 import datetime
-from flask import Flask, render_template, request
+import time
+from functools import partial
+from flask import Flask, render_template, request, g
 from dotenv import dotenv_values
 import stripe
+import requests
 from utils.Stripe_API import Stripe_API
 from utils.Caspio_API import Caspio_API, NoUsersToUpdate
+from utils.Work_Queue import Work_Queue
+from utils.Event_Store import Event_Store
+from utils.Subscription_Cache import Subscription_Cache
+from utils.Metrics import metrics
+from utils.Profiler import profiler
+from utils.Webhook_Verifier import Webhook_Verifier
+from utils.Webhook_Route import Webhook_Route
+from utils.Circuit_Breaker import Circuit_Breaker
+from utils.Caspio_Spool import Caspio_Spool
+from utils.Dead_Letter_Store import Dead_Letter_Store
+from utils.Log_Pipeline import logPipeline, fields
 
 
 
 app = Flask(__name__)
 config = dict(dotenv_values('.env'))
 gunicorn_logger = logging.getLogger('gunicorn.error')
-app.logger.handlers = gunicorn_logger.handlers
+# JSON lines written by a background thread, see utils/Log_Pipeline.py
+logPipeline.install(app.logger)
 app.logger.setLevel(gunicorn_logger.level)
 
+# One client per worker process, reused by every request.  The HTTP sessions inside are
+# created lazily after gunicorn forks.
+caspioAPI = Caspio_API()
+stripeAPIs = {}
 
-def DP_invoice_paid(invoiceObject: dict, endpoint: str, stripeAPI: Stripe_API, caspioAPI: Caspio_API):
-    """The Main logic for the invoice.paid trigger coming from Stripe. For DispositionPro
+# Written through by the customer.subscription events, read by invoice.paid.  Off unless subscriptionCacheTTL is set:
+# Stripe may send invoice.paid before the status change that goes with it, and a cached status would be written.
+subscriptionCache = Subscription_Cache(
+    path=config.get('subscriptionCachePath', 'subscriptions.sqlite3'),
+    ttl=int(config.get('subscriptionCacheTTL', 0)),
+    staleWhileRevalidate=int(config.get('subscriptionCacheStale', 86400)),
+    logger=app.logger
+)
+
+def getStripeAPI(secretKey: str) -> Stripe_API:
+    """Returns the worker's Stripe_API client for the secret key, creating it on first use.
+
+    Args:
+        secretKey (str): Stripe secret key of the account.
+
+    Returns:
+        Stripe_API: Shared instance of the Stripe_API class
+    """
+    if secretKey not in stripeAPIs:
+        stripeAPIs[secretKey] = Stripe_API(secretKey=secretKey, subscriptionCache=subscriptionCache)
+    return stripeAPIs[secretKey]
+
+webhookVerifiers = {}
+
+def getWebhookVerifier(signingSecret: str) -> Webhook_Verifier:
+    """Returns the worker's Webhook_Verifier for the signing secret, creating it on first use.
+
+    Args:
+        signingSecret (str): Webhook signing secret of the route.
+
+    Returns:
+        Webhook_Verifier: Shared instance of the Webhook_Verifier class
+    """
+    if signingSecret not in webhookVerifiers:
+        webhookVerifiers[signingSecret] = Webhook_Verifier(
+            secret=signingSecret,
+            maxPayloadBytes=int(config.get('webhookMaxPayloadBytes', 524288))
+        )
+    return webhookVerifiers[signingSecret]
+
+# Caspio writes deferred while Caspio is unavailable, replayed in order once it recovers.
+# Set caspioSpoolPath to an empty value to turn it off.
+caspioSpool = None
+if config.get('caspioSpoolPath', 'caspio_spool.jsonl'):
+    caspioSpool = Caspio_Spool(
+        path=config.get('caspioSpoolPath', 'caspio_spool.jsonl'),
+        drainRate=float(config.get('caspioSpoolDrainRate', 5)),
+        logger=app.logger
+    )
+
+def caspioUnavailable(response: requests.Response = None, error: Exception = None) -> bool:
+    """Whether a failed Caspio write failed because Caspio is down, rather than because of the write itself.
+
+    Args:
+        response (requests.Response, optional): Final response of the write.
+        error (Exception, optional): Error raised by the write, including CircuitOpen.
+
+    Returns:
+        bool
+    """
+    if error is not None:
+        return isinstance(error, requests.RequestException)
+    return response is not None and response.status_code >= 500
+
+def spoolPending() -> bool:
+    """Whether Caspio writes are waiting in the spool.  New writes go behind them."""
+    return caspioSpool is not None and caspioSpool.pending()
+
+def spoolWrite(operation: str, endpoint: str, data: dict, customerID: str = None) -> bool:
+    """Defers a Caspio write to the spool.
+
+    Args:
+        operation (str): "merge" (Caspio_API.mergeUser) or "update" (Caspio_API.updateUser)
+        endpoint (str): endpoint url of the Caspio table
+        data (dict): Key:Value information for user.
+        customerID (str, optional): CustomerID of the update, data['CustomerID'] for a merge.
+
+    Returns:
+        bool: True when the write was spooled, False when spooling is off.
+    """
+    if caspioSpool is None:
+        return False
+    customerID = customerID or data.get('CustomerID')
+    caspioSpool.append({"operation": operation, "endpoint": endpoint, "customerID": customerID, "data": data})
+    app.logger.warning(f"Caspio unavailable, {operation.upper()} SPOOLED", extra=fields("caspio", customerID=customerID, endpoint=endpoint, payload=data))
+    metrics.inc("caspio_writes_total", operation=operation, outcome="spooled")
+    return True
+
+# Failed Caspio writes, retried in the background with backoff.  Set deadLetterPath to an empty value to turn it off.
+deadLetters = None
+if config.get('deadLetterPath', 'dead_letters.sqlite3'):
+    deadLetters = Dead_Letter_Store(
+        path=config.get('deadLetterPath', 'dead_letters.sqlite3'),
+        maxAttempts=int(config.get('deadLetterMaxAttempts', 8)),
+        baseDelay=float(config.get('deadLetterBaseDelay', 60)),
+        maxDelay=float(config.get('deadLetterMaxDelay', 3600)),
+        logger=app.logger
+    )
+
+def deadLetter(operation: str, endpoint: str, data: dict, error: str, customerID: str = None) -> bool:
+    """Keeps a failed Caspio write in the dead-letter store, where it is retried in the background.
+
+    Args:
+        operation (str): "merge" (Caspio_API.mergeUser) or "update" (Caspio_API.updateUser)
+        endpoint (str): endpoint url of the Caspio table
+        data (dict): Key:Value information for user.
+        error (str): Why the write failed.
+        customerID (str, optional): CustomerID of the update, data['CustomerID'] for a merge.
+
+    Returns:
+        bool: True when the write was stored, False when the store is off.
+    """
+    if deadLetters is None:
+        return False
+    customerID = customerID or data.get('CustomerID')
+    letterID = deadLetters.add(operation, endpoint, data, error, customerID=customerID)
+    app.logger.warning(f"{operation.upper()} DEAD LETTERED, it is retried automatically", extra=fields("caspio", letterID=letterID, customerID=customerID, endpoint=endpoint, error=error))
+    metrics.inc("dead_letters_total", operation=operation, outcome="added")
+    return True
+
+def writeSucceeded(operation: str, endpoint: str, data: dict, customerID: str = None):
+    """Counts a successful Caspio write and removes the fields it wrote from the customer's dead letters,
+    so their retry does not put an older value back.
+
+    Args:
+        operation (str): "merge" or "update"
+        endpoint (str): endpoint url of the Caspio table
+        data (dict): Key:Value information written.
+        customerID (str, optional): CustomerID of the update, data['CustomerID'] for a merge.
+    """
+    metrics.inc("caspio_writes_total", operation=operation, outcome="success")
+    if deadLetters is not None:
+        deadLetters.supersede(endpoint, customerID or data.get('CustomerID'), data)
+
+def retryDeadLetter(letter: dict):
+    """Writes a dead letter to Caspio again, called by the retry scheduler and by drains.
+
+    Args:
+        letter (dict): Letter of the Dead_Letter_Store.
+
+    Raises:
+        RuntimeError: When Caspio rejected the write again, so the letter stays in the store.  A letter whose
+            record is gone is dropped instead.
+    """
+    try:
+        if letter['operation'] == "merge":
+            response = caspioAPI.mergeUser(data=letter['data'], endpoint=letter['endpoint'])
+            success = response.status_code in {200, 201}
+        else:
+            response = caspioAPI.updateUser(customerID=letter['customerID'], data=letter['data'], endpoint=letter['endpoint'])
+            success = response.status_code == 200
+        if not success:
+            raise RuntimeError(f"{response.status_code} {response.text}")
+    except NoUsersToUpdate:
+        app.logger.warning("DEAD LETTER DROPPED, no user exists with the customerID", extra=fields("caspio", letterID=letter['id'], customerID=letter['customerID']))
+        metrics.inc("dead_letters_total", operation=letter['operation'], outcome="missing")
+        return
+    except Exception:
+        metrics.inc("dead_letters_total", operation=letter['operation'], outcome="retry_failed")
+        raise
+    app.logger.info(f"DEAD LETTER {letter['operation'].upper()} SUCCESS", extra=fields("caspio", letterID=letter['id'], customerID=letter['customerID']))
+    metrics.inc("dead_letters_total", operation=letter['operation'], outcome="resolved")
+    metrics.inc("caspio_writes_total", operation=letter['operation'], outcome="success")
+
+def applySpooledWrite(write: dict) -> bool:
+    """Replays a spooled write, called by the spool drain thread.
+
+    Args:
+        write (dict): Written by spoolWrite.
+
+    Returns:
+        bool: True when the write is done with, False when Caspio is still unavailable.
+    """
+    try:
+        if write['operation'] == "merge":
+            response = caspioAPI.mergeUser(data=write['data'], endpoint=write['endpoint'])
+            success = response.status_code in {200, 201}
+        else:
+            response = caspioAPI.updateUser(customerID=write['customerID'], data=write['data'], endpoint=write['endpoint'])
+            success = response.status_code == 200
+    except NoUsersToUpdate:
+        app.logger.warning("SPOOLED UPDATE SKIPPED: no user exists with the customerID", extra=fields("caspio", customerID=write['customerID'], payload=write['data']))
+        metrics.inc("caspio_writes_total", operation=write['operation'], outcome="missing")
+        return True
+    except requests.RequestException as e:
+        app.logger.warning("Caspio still unavailable, spool drain paused", extra=fields("caspio", error=e))
+        return False
+
+    if not success and caspioUnavailable(response=response):
+        return False
+    if success:
+        app.logger.info(f"SPOOLED {write['operation'].upper()} SUCCESS", extra=fields("caspio", customerID=write['customerID']))
+        writeSucceeded(write['operation'], write['endpoint'], write['data'], customerID=write['customerID'])
+        return True
+    app.logger.error(f"SPOOLED {write['operation'].upper()} FAILED", extra=fields("caspio", status=response.status_code, response=response.text, customerID=write['customerID'], payload=write['data']))
+    metrics.inc("caspio_writes_total", operation=write['operation'], outcome="failure")
+    deadLetter(write['operation'], write['endpoint'], write['data'], f"{response.status_code} {response.text}", customerID=write['customerID'])
+    return True
+
+def caspioReachable() -> bool:
+    """Whether background writes may call Caspio: the breaker lets calls through, the first write of a
+    half-open breaker being its trial call."""
+    return caspioAPI._breaker.state != Circuit_Breaker.OPEN
+
+
+# Caspio column holding the purchased quantity of each product.
+SEAT_FIELDS = {"DispositionPro": "UnitsPurchased", "TitlePro": "Purchased_Seats"}
+
+# Caspio table of each product and environment.
+CASPIO_ENDPOINTS = {
+    ("DispositionPro", "Prod"): '/v2/tables/DP_Payment_Logs/records',
+    ("DispositionPro", "Dev"): '/v2/tables/Python_DP_PaymentLogs/records',
+    ("TitlePro", "Prod"): '/v2/tables/TitlePro_PaymentLogs/records',
+    ("TitlePro", "Dev"): '/v2/tables/TitlePro_PaymentLogs/records'
+}
+
+# Webhook url: (view name, product, environment)
+WEBHOOK_ROUTES = {
+    '/live/dispositionPro/subscriptions': ('dispositionProSubscriptions', "DispositionPro", "Prod"),
+    '/test/dispositionPro/subscriptions': ('test_dispositionProSubscriptions', "DispositionPro", "Dev"),
+    '/test/titlePro/subscriptions': ('test_titleProSubscriptions', "TitlePro", "Dev"),
+    '/live/titlePro/subscriptions': ('titleProSubscriptions', "TitlePro", "Prod")
+}
+
+# Read quantity/status of invoice.paid from the invoice lines instead of calling Stripe.
+invoiceLineItemMode = config.get('invoiceLineItemMode', 'False').lower() == 'true'
+
+def getInvoiceSubscription(invoiceObject: dict, stripeAPI: Stripe_API, endpoint: str, caspioAPI: Caspio_API) -> dict:
+    """Quantity and status of the subscription billed by the invoice.  In invoiceLineItemMode the quantity is read
+    from the invoice lines without a status, when the customer already has a Caspio record.  A new record needs the
+    status, so it is read from Stripe (or the subscription cache), as when the lines are missing or ambiguous.
 
     Args:
         invoiceObject (dict): https://stripe.com/docs/api/invoices/object
         stripeAPI (Stripe_API): Instance of Stripe_API class
+        endpoint (str): endpoint url of the Caspio table of the product
         caspioAPI (Caspio_API): Instance of Caspio_API class
+
+    Returns:
+        dict: Subscription with at least 'quantity', and 'status' unless read from the invoice lines.
     """
-    if invoiceObject['amount_due'] > 0:
-        subscriptionObject = stripeAPI.getSubscriptionObject(invoiceObject['subscription'])
-        UserPayload = {
-            'Email': invoiceObject['customer_email'],
-            'CustomerID': invoiceObject['customer'],
-            'UnitsPurchased': subscriptionObject['quantity'],
-            'Status': subscriptionObject['status']
-        }
-        app.logger.info(f"Invoice ID: {invoiceObject['id']} | Amount Due: {invoiceObject['amount_due']} | Amount Paid: {invoiceObject['amount_paid']} | Payload: {UserPayload}")
-        try:
-            response = caspioAPI.mergeUser(data=UserPayload, endpoint=endpoint)
+    if invoiceLineItemMode:
+        subscriptionObject = Stripe_API.subscriptionFromInvoice(invoiceObject)
+        if subscriptionObject is not None and knownCustomer(invoiceObject['customer'], endpoint, caspioAPI):
+            return subscriptionObject
+    return stripeAPI.getSubscriptionObject(invoiceObject['subscription'])
 
-            if response.status_code in {200, 201}:
-                app.logger.info("MERGE SUCCESS")
-            else:
-                app.logger.error("MERGE FAILED")
-                app.logger.error(f"{response.status_code} {response.text}")
-                app.logger.error(f"Make sure that {UserPayload} is added to Caspio")
-        except Exception as e:
-            app.logger.error(f"MERGE FAILED: {e}")
-            app.logger.error(f"Make sure that {UserPayload} is added to Caspio")
+def knownCustomer(customerID: str, endpoint: str, caspioAPI: Caspio_API) -> bool:
+    """Whether the customer has a Caspio record, so a merge updates it instead of creating it.
+
+    Args:
+        customerID (str): Stripe CustomerID of the user.
+        endpoint (str): endpoint url of the Caspio table of the product
+        caspioAPI (Caspio_API): Instance of Caspio_API class
+
+    Returns:
+        bool: False when there is no record, or Caspio could not tell (down, spooling).
+    """
+    if spoolPending():
+        return False
+    try:
+        return caspioAPI.hasUser(customerID, endpoint)
+    except Exception:
+        return False
+
+def invoicePaidPayload(invoiceObject: dict, stripeAPI: Stripe_API, seatField: str, endpoint: str, caspioAPI: Caspio_API) -> dict:
+    """Caspio payload of a paid invoice.
+
+    Args:
+        invoiceObject (dict): https://stripe.com/docs/api/invoices/object
+        stripeAPI (Stripe_API): Instance of Stripe_API class
+        seatField (str): Caspio column of the purchased quantity, "UnitsPurchased" or "Purchased_Seats"
+        endpoint (str): endpoint url of the Caspio table of the product
+        caspioAPI (Caspio_API): Instance of Caspio_API class
+
+    Returns:
+        dict: Key:Value information for user.
+    """
+    return invoiceSubscriptionPayload(invoiceObject, getInvoiceSubscription(invoiceObject, stripeAPI, endpoint, caspioAPI), seatField)
+
+def invoiceSubscriptionPayload(invoiceObject: dict, subscriptionObject: dict, seatField: str) -> dict:
+    """Caspio payload of a paid invoice and the subscription it billed.  Shared by the sync and async handlers.
+
+    Args:
+        invoiceObject (dict): https://stripe.com/docs/api/invoices/object
+        subscriptionObject (dict): Subscription with at least 'quantity'.  Without a 'status' the Caspio Status is left as is.
+        seatField (str): Caspio column of the purchased quantity, "UnitsPurchased" or "Purchased_Seats"
+
+    Returns:
+        dict: Key:Value information for user.
+    """
+    payload = {
+        'Email': invoiceObject['customer_email'],
+        'CustomerID': invoiceObject['customer'],
+        seatField: subscriptionObject['quantity']
+    }
+    if 'status' in subscriptionObject:
+        payload['Status'] = subscriptionObject['status']
+    return payload
+
+def subscriptionUpdatedPayload(subscriptionObject: dict) -> dict:
+    """Caspio payload of an updated subscription: the cancellation date, or an empty EndDate.
+
+    Args:
+        subscriptionObject (dict): https://stripe.com/docs/api/subscriptions/object
+
+    Returns:
+        dict: Key:Value information for user.
+    """
+    if subscriptionObject['cancel_at'] is not None:
+        datetime_obj = datetime.datetime.utcfromtimestamp(subscriptionObject['cancel_at'])
+        return {"EndDate": datetime_obj.strftime('%m/%d/%Y')}
+    return {"EndDate": ""}
+
+def subscriptionDeletedPayload(subscriptionObject: dict) -> dict:
+    """Caspio payload of a deleted subscription.
+
+    Args:
+        subscriptionObject (dict): https://stripe.com/docs/api/subscriptions/object
+
+    Returns:
+        dict: Key:Value information for user.
+    """
+    return {"Status": subscriptionObject['status']}
+
+# Logged when a handler's write is rejected, and when its customer has no Caspio record.
+WRITE_MESSAGES = {
+    'invoice.paid': {"failedMessage": "MERGE FAILED | Make sure that the payload is added to Caspio"},
+    'customer.subscription.updated': {"failedMessage": "UPDATE FAILED | !! Make Sure the customer is updated with the payload in Caspio !!"},
+    'customer.subscription.deleted': {
+        "failedMessage": "UPDATE FAILED | Make sure the customer gets the payload in Caspio",
+        "missingMessage": "Event: Customer cancellation requested period has ended, the subscription should be canceled but for some reason no users were found in caspio",
+        "missingLevel": logging.ERROR
+    }
+}
+
+def writeOutcome(operation: str, endpoint: str, data: dict, response=None, error: Exception = None, customerID: str = None,
+                 failedMessage: str = None, missingMessage: str = "No user exists with the customerID",
+                 missingLevel: int = logging.WARNING) -> bool:
+    """Settles a handler's Caspio write, shared by the sync and async handlers.  A success is counted and removed
+    from the dead letters, a write that failed because Caspio is unavailable is spooled, any other failure is
+    counted, logged and dead lettered.  An update of a CustomerID with no record is only logged, as before the
+    dead letters.
+
+    Args:
+        operation (str): "merge" (Caspio_API.mergeUser) or "update" (Caspio_API.updateUser)
+        endpoint (str): endpoint url of the Caspio table
+        data (dict): Key:Value information for user.
+        response (requests.Response or httpx.Response, optional): Final response of the write.
+        error (Exception, optional): Error raised by the write instead, including NoUsersToUpdate.
+        customerID (str, optional): CustomerID of the update, data['CustomerID'] for a merge.
+        failedMessage (str, optional): Error log message of a failed write.
+        missingMessage (str, optional): Log message when no record has the CustomerID.
+        missingLevel (int, optional): Log level of missingMessage.
+
+    Returns:
+        bool: True when Caspio was updated, there was no record to update or the write was deferred (spool, dead letter).
+    """
+    customerID = customerID or data.get('CustomerID')
+    if error is None and response.status_code in ({200, 201} if operation == "merge" else {200}):
+        app.logger.info(f"{operation.upper()} SUCCESS", extra=fields("caspio", customerID=customerID))
+        writeSucceeded(operation, endpoint, data, customerID=customerID)
+        return True
+    if caspioUnavailable(response=response, error=error) and spoolWrite(operation, endpoint, data, customerID=customerID):
+        return True
+
+    if isinstance(error, NoUsersToUpdate):
+        # Not transient, a retry would find no record either.
+        app.logger.log(missingLevel, missingMessage, extra=fields("caspio", customerID=customerID))
+        metrics.inc("caspio_writes_total", operation=operation, outcome="missing")
+        return True
+
+    failedMessage = failedMessage or f"{operation.upper()} FAILED"
+    if error is not None:
+        app.logger.error(failedMessage, extra=fields("caspio", error=error, customerID=customerID, payload=data))
+        reason = str(error)
     else:
-        app.logger.info("Do Not Change Units No Charge")
+        app.logger.error(failedMessage, extra=fields("caspio", status=response.status_code, response=response.text, customerID=customerID, payload=data))
+        reason = f"{response.status_code} {response.text}"
+    metrics.inc("caspio_writes_total", operation=operation, outcome="failure")
+    return deadLetter(operation, endpoint, data, reason, customerID=customerID)
 
-def TP_invoice_paid(invoiceObject: dict, stripeAPI: Stripe_API, endpoint: str, caspioAPI: Caspio_API):
-    """The Main logic for the TitlePro invoice.paid trigger coming from Stripe.
+def writeCaspio(operation: str, endpoint: str, data: dict, caspioAPI: Caspio_API, customerID: str = None, **messages) -> bool:
+    """Writes a handler's payload to Caspio, behind the spooled writes when there are any.  asgi.writeCaspio is
+    the coroutine twin, both settle the write with writeOutcome.
+
+    Args:
+        operation (str): "merge" (Caspio_API.mergeUser) or "update" (Caspio_API.updateUser)
+        endpoint (str): endpoint url of the Caspio table
+        data (dict): Key:Value information for user.
+        caspioAPI (Caspio_API): Instance of Caspio_API class
+        customerID (str, optional): CustomerID of the update, data['CustomerID'] for a merge.
+        **messages: Log messages of writeOutcome, see WRITE_MESSAGES.
+
+    Returns:
+        bool: True when Caspio was updated or the write was deferred (spool, dead letter).
+    """
+    if spoolPending():
+        # Queue up behind the writes spooled while Caspio was down, so they keep their order.
+        return spoolWrite(operation, endpoint, data, customerID=customerID)
+    try:
+        if operation == "merge":
+            response = caspioAPI.mergeUser(data=data, endpoint=endpoint)
+        else:
+            response = caspioAPI.updateUser(customerID=customerID, data=data, endpoint=endpoint)
+    except Exception as e:
+        return writeOutcome(operation, endpoint, data, error=e, customerID=customerID, **messages)
+    return writeOutcome(operation, endpoint, data, response=response, customerID=customerID, **messages)
+
+def invoice_paid(invoiceObject: dict, endpoint: str, seatField: str, stripeAPI: Stripe_API, caspioAPI: Caspio_API) -> bool:
+    """The Main logic for the invoice.paid trigger coming from Stripe, shared by DispositionPro and TitlePro.
 
     Args:
         invoiceObject (dict): https://stripe.com/docs/api/invoices/object
+        endpoint (str): endpoint url of the Caspio table of the product
+        seatField (str): Caspio column of the purchased quantity, "UnitsPurchased" or "Purchased_Seats"
         stripeAPI (Stripe_API): Instance of Stripe_API class
         caspioAPI (Caspio_API): Instance of Caspio_API class
+
+    Returns:
+        bool: True when Caspio was updated, there was nothing to update or the write was deferred (spool, dead letter).
     """
     if invoiceObject['amount_due'] > 0:
-        subscriptionObject = stripeAPI.getSubscriptionObject(invoiceObject['subscription'])
-        UserPayload = {
-            'Email': invoiceObject['customer_email'],
-            'CustomerID': invoiceObject['customer'],
-            'Purchased_Seats': subscriptionObject['quantity'],
-            'Status': subscriptionObject['status']
-        }
-        app.logger.info(f"Invoice ID: {invoiceObject['id']} | Amount Due: {invoiceObject['amount_due']} | Amount Paid: {invoiceObject['amount_paid']} | Payload: {UserPayload}")
-        try:
-            response = caspioAPI.mergeUser(data=UserPayload, endpoint=endpoint)
+        UserPayload = invoicePaidPayload(invoiceObject, stripeAPI, seatField, endpoint, caspioAPI)
+        app.logger.info("invoice.paid", extra=fields("webhook", invoiceID=invoiceObject['id'], amountDue=invoiceObject['amount_due'], amountPaid=invoiceObject['amount_paid'], payload=UserPayload))
+        return writeCaspio("merge", endpoint, UserPayload, caspioAPI, **WRITE_MESSAGES['invoice.paid'])
+    app.logger.info(f"Do Not Change {'Units' if seatField == 'UnitsPurchased' else 'Seats'} No Charge", extra=fields("webhook", invoiceID=invoiceObject['id']))
+    return True
 
-            if response.status_code in {200, 201}:
-                app.logger.info("MERGE SUCCESS")
-            else:
-                app.logger.error("MERGE FAILED")
-                app.logger.error(f"{response.status_code} {response.text}")
-                app.logger.error(f"Make sure that {UserPayload} is added to Caspio")
-        except Exception as e:
-            app.logger.error(f"MERGE FAILED: {e}")
-            app.logger.error(f"Make sure that {UserPayload} is added to Caspio")
-    else:
-        app.logger.info("Do Not Change Seats No Charge")
+def DP_invoice_paid(invoiceObject: dict, endpoint: str, stripeAPI: Stripe_API, caspioAPI: Caspio_API):
+    """The Main logic for the invoice.paid trigger coming from Stripe. For DispositionPro
+
+    Args:
+        invoiceObject (dict): https://stripe.com/docs/api/invoices/object
+        stripeAPI (Stripe_API): Instance of Stripe_API class
+        caspioAPI (Caspio_API): Instance of Caspio_API class
+
+    Returns:
+        bool: True when Caspio was updated, there was nothing to update or the write was deferred (spool, dead letter).
+    """
+    return invoice_paid(invoiceObject, endpoint, SEAT_FIELDS['DispositionPro'], stripeAPI, caspioAPI)
+
+def TP_invoice_paid(invoiceObject: dict, stripeAPI: Stripe_API, endpoint: str, caspioAPI: Caspio_API):
+    """The Main logic for the TitlePro invoice.paid trigger coming from Stripe.
+
+    Args:
+        invoiceObject (dict): https://stripe.com/docs/api/invoices/object
+        stripeAPI (Stripe_API): Instance of Stripe_API class
+        caspioAPI (Caspio_API): Instance of Caspio_API class
+
+    Returns:
+        bool: True when Caspio was updated, there was nothing to update or the write was deferred (spool, dead letter).
+    """
+    return invoice_paid(invoiceObject, endpoint, SEAT_FIELDS['TitlePro'], stripeAPI, caspioAPI)
 
 def customer_subscription_deleted(subscriptionObject: dict, endpoint: str, caspioAPI: Caspio_API):
     """The Main logic for the customer.subscription.deleted trigger coming from Stripe.
@@ -85,21 +497,14 @@ def customer_subscription_deleted(subscriptionObject: dict, endpoint: str, caspi
     Args:
         subscriptionObject (dict): https://stripe.com/docs/api/subscriptions/object
         caspioAPI (Caspio_API): Instance of Caspio_API Class
+
+    Returns:
+        bool: True when Caspio was updated, there was nothing to update or the write was deferred (spool, dead letter).
     """
-    UserPayload = {"Status": subscriptionObject['status']}
-    app.logger.info(f"CustomerID: {subscriptionObject['customer']} | Payload: {UserPayload}")
-    try:
-        response = caspioAPI.updateUser(data=UserPayload, endpoint=endpoint, customerID=subscriptionObject['customer'])
-        if response.status_code == 200:
-            app.logger.info("UPDATE SUCCESS")
-        else:
-            app.logger.error("UPDATE FAILED")
-            app.logger.error(response.status_code, response.text)
-            app.logger.error(f"Make sure CustomerID: {subscriptionObject['customer']} | Gets Payload: {UserPayload}")
-    except NoUsersToUpdate:
-        app.logger.error("Event: Customer cancellation requested period has ended, the subscription should be canceled but for some reason no users were found in caspio")
-    except Exception as e:
-        app.logger.error(e)
+    UserPayload = subscriptionDeletedPayload(subscriptionObject)
+    app.logger.info("customer.subscription.deleted", extra=fields("webhook", customerID=subscriptionObject['customer'], payload=UserPayload))
+    return writeCaspio("update", endpoint, UserPayload, caspioAPI, customerID=subscriptionObject['customer'],
+                       **WRITE_MESSAGES['customer.subscription.deleted'])
 
 def customer_subscription_updated(subscriptionObject: dict, endpoint: str, caspioAPI: Caspio_API):
     """The Main logic for the DispositionPro customer.subscription.updated trigger coming from Stripe.
@@ -107,207 +512,390 @@ def customer_subscription_updated(subscriptionObject: dict, endpoint: str, caspi
     Args:
         subscriptionObject (dict): https://stripe.com/docs/api/subscriptions/object
         caspioAPI (Caspio_API): Instance of Caspio_API Class
+
+    Returns:
+        bool: True when Caspio was updated, there was nothing to update or the write was deferred (spool, dead letter).
     """
-    unixTime = subscriptionObject['cancel_at']
-    UserPayload = {}
-    if subscriptionObject['cancel_at'] is not None:
-        datetime_obj = datetime.datetime.utcfromtimestamp(unixTime)
-        formatted_date = datetime_obj.strftime('%m/%d/%Y')
-        UserPayload = {"EndDate": formatted_date}   
-    else:
-        UserPayload = {"EndDate": ""}
-    app.logger.info(f"CustomerID: {subscriptionObject['customer']} | Payload: {UserPayload}")
+    UserPayload = subscriptionUpdatedPayload(subscriptionObject)
+    app.logger.info("customer.subscription.updated", extra=fields("webhook", customerID=subscriptionObject['customer'], payload=UserPayload))
+    return writeCaspio("update", endpoint, UserPayload, caspioAPI, customerID=subscriptionObject['customer'],
+                       **WRITE_MESSAGES['customer.subscription.updated'])
+
+def processEvent(event: dict, product: str, environment: str, endpoint: str, force: bool = False) -> bool:
+    """Runs the handler for the Stripe event.  Called by the webhook routes, or by the work queue
+    when webhookQueueMode is on.  Events already applied are skipped without any Stripe or Caspio call.
+
+    Args:
+        event (dict): https://stripe.com/docs/api/events/object
+        product (str): "DispositionPro" or "TitlePro"
+        environment (str): "Prod" or "Dev"
+        endpoint (str): endpoint url of the Caspio table of the product
+        force (bool, optional): Run the handler even when the event was already applied ex: replay.py --force
+
+    Returns:
+        bool: True when the event was applied, or had already been applied.  False when it failed or another
+            worker is still processing it, so a queued event is retried.
+    """
+    handler = webhookRoutes[(product, environment)].handler(event['type'], endpoint)
+    if not force and eventStore is not None and not eventStore.begin(event['id']):
+        processed = eventStore.isProcessed(event['id'])
+        app.logger.info("Event already processed, skipping" if processed else "Event in progress on another worker, skipping",
+                        extra=fields("webhook", eventID=event['id']))
+        metrics.inc("webhook_events_processed_total", type=event['type'], product=product, outcome="skipped" if processed else "in_progress")
+        return processed
+
+    if event['type'] in {'customer.subscription.updated', 'customer.subscription.deleted'}:
+        subscriptionCache.put(event['data']['object'], created=event['created'])
+
+    success, error = False, None
+    started = time.perf_counter()
     try:
-        response = caspioAPI.updateUser(customerID=subscriptionObject['customer'], data=UserPayload, endpoint=endpoint)
-        if response.status_code == 200:
-            app.logger.info("UPDATE SUCCESS")
-        else:
-            app.logger.error(f"UPDATE FAILED | !! Make Sure CustomerID: {subscriptionObject['customer']} | Is updated with Payload: {UserPayload} in Caspio !!")
-    except NoUsersToUpdate:
-        app.logger.warning(f"No user exists with customerID {subscriptionObject['customer']}")
+        success = handler(event['data']['object']) if handler is not None else True
     except Exception as e:
-        app.logger.error(e)
+        error = str(e)
+        raise
+    finally:
+        if eventStore is not None:
+            eventStore.finish(event['id'], success, error)
+        metrics.observe("webhook_event_seconds", time.perf_counter() - started, type=event['type'], product=product)
+        metrics.inc("webhook_events_processed_total", type=event['type'], product=product, outcome="success" if success else "failure")
+    return success
+
+def processQueuedEvent(job: dict):
+    """Work queue handler.  Parses the queued webhook payload and processes it.
 
-@app.route('/', methods=['GET'])
-def homePage():
-    ENVIRONMENT = "Prod"
-    return render_template(f'index{ENVIRONMENT}.html')
+    Args:
+        job (dict): Job written by the webhook routes.
 
+    Raises:
+        RuntimeError: When the event was not applied, so the queue retries it.
+    """
+    event = json.loads(job['event'])
+    app.logger.info("Processing queued event", extra=fields("webhook", product=job['product'], environment=job['environment'], eventID=event['id']))
+    with profiler.trace(f"queue {event['type']}"):
+        success = processEvent(event=event, product=job['product'], environment=job['environment'], endpoint=job['endpoint'])
+    if not success:
+        raise RuntimeError(f"Event {event['id']} was not applied")
+
+def processCoalescedEvents(jobs: list):
+    """Work queue batch handler.  The jobs share a Caspio table and CustomerID (see caspioCoalesceWindow).
+    Their payloads are merged in order of event 'created', so later events win field by field,
+    and written to Caspio with a single merge (when an invoice was paid) or update.
 
-@app.route('/live/dispositionPro/subscriptions', methods=['POST'])
-def dispositionProSubscriptions():
-    """Main listening endpoint for STRIPE Disposition Pro PROD webhook."""
-    dispositionProEndpoint = '/v2/tables/DP_Payment_Logs/records'
-    ENVIRONMENT = "Prod"
-    stripeAPI = Stripe_API(secretKey=config[f"stripeDispositionProSecretKey{ENVIRONMENT}"])
-    caspioAPI = Caspio_API()
-    stripe.api_key = config[f"stripeDispositionProSecretKey{ENVIRONMENT}"]
-    endpoint_secret = config[f"stripeDispositionProSigningSecret{ENVIRONMENT}"]
-    event = None
-    payload = request.data
-    sig_header = request.headers['STRIPE_SIGNATURE']
+    Args:
+        jobs (list): Jobs written by the webhook routes for the same table and customer.
 
+    Raises:
+        RuntimeError: When the events could not be read or the failed write could not be deferred, so the queue
+            retries every job of the batch.
+    """
+    if len(jobs) == 1:
+        return processQueuedEvent(jobs[0])
+
+    product, environment, endpoint = jobs[0]['product'], jobs[0]['environment'], jobs[0]['endpoint']
+    stripeAPI = webhookRoutes[(product, environment)].stripeAPI
+    events = sorted((json.loads(job['event']) for job in jobs), key=lambda event: event['created'])
+    if eventStore is not None:
+        begun = [event for event in events if eventStore.begin(event['id'])]
+        inProgress = [event['id'] for event in events if event not in begun and not eventStore.isProcessed(event['id'])]
+        if inProgress:
+            # The batch is retried once the other worker is done, so the payloads are still merged in order.
+            for event in begun:
+                eventStore.finish(event['id'], False, "Deferred, events of the batch are in progress")
+            raise RuntimeError(f"Events {', '.join(inProgress)} are in progress on another worker")
+        events = begun
+
+    UserPayload, create, customerID = {}, False, None
+    success, error = False, None
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, endpoint_secret
+        for event in events:
+            eventObject = event['data']['object']
+            customerID = eventObject['customer']
+            match event['type']:
+                case 'invoice.paid':
+                    if eventObject['amount_due'] > 0:
+                        UserPayload.update(invoicePaidPayload(eventObject, stripeAPI, SEAT_FIELDS[product], endpoint, caspioAPI))
+                        create = True
+                case 'customer.subscription.updated':
+                    subscriptionCache.put(eventObject, created=event['created'])
+                    UserPayload.update(subscriptionUpdatedPayload(eventObject))
+                case 'customer.subscription.deleted':
+                    subscriptionCache.put(eventObject, created=event['created'])
+                    UserPayload.update(subscriptionDeletedPayload(eventObject))
+
+        app.logger.info("Coalesced events", extra=fields("webhook", events=len(events), customerID=customerID, payload=UserPayload))
+        # A failed write is spooled or dead lettered by writeCaspio, a failed Stripe lookup is retried by the queue.
+        success = not UserPayload or writeCaspio(
+            "merge" if create else "update", endpoint, UserPayload, caspioAPI, customerID=customerID,
+            failedMessage="COALESCED WRITE FAILED | Make sure the customer gets the payload in Caspio"
         )
-    except ValueError as e:
-        # Invalid payload
-        app.logger.warning(e)
-        app.logger.warning(f'Invalid Payload From: {request.remote_addr}')
-        return {'status': 'error', 'message': 'Invalid payload'}, 400
+        if not success:
+            error = f"Coalesced write of {customerID} failed and could not be deferred"
+    except Exception as e:
+        error = str(e)
+    finally:
+        if eventStore is not None:
+            for event in events:
+                eventStore.finish(event['id'], success, error)
+    for event in events:
+        metrics.inc("webhook_events_processed_total", type=event['type'], product=product, outcome="success" if success else "failure")
+    if not success:
+        raise RuntimeError(error)
+
+def acceptEvent(event: dict, payload: bytes, product: str, environment: str, endpoint: str):
+    """Handles a verified webhook event: drops redeliveries, queues it in webhookQueueMode or processes it right away.
 
-    except stripe.error.SignatureVerificationError as e:
-        # Invalid signature
-        app.logger.warning(e)
-        app.logger.warning(f'Invalid Stripe Signature from: {request.remote_addr}')
-        return {'status': 'error', 'message': 'Invalid signature'}, 400
+    Args:
+        event (Webhook_Event): https://stripe.com/docs/api/events/object, parsed on first access past its id.
+        payload (bytes): Raw body of the webhook request.
+        product (str): "DispositionPro" or "TitlePro"
+        environment (str): "Prod" or "Dev"
+        endpoint (str): endpoint url of the Caspio table of the product
+
+    Returns:
+        tuple[dict, int]: Response body and status code for Stripe.
+    """
+    # Duplicates are dropped on the event id alone, before the body is parsed.
+    with profiler.phase("event_store"):
+        duplicate = eventStore is not None and eventStore.isProcessed(event['id'])
+    if duplicate:
+        app.logger.info("Duplicate event dropped", extra=fields("webhook", eventID=event['id']))
+        metrics.inc("webhook_duplicates_total", product=product, environment=environment)
+        return {'status': 'accepted', 'message': 'Webhook Already Processed'}, 200
+    metrics.inc("webhook_events_received_total", type=event['type'], product=product, environment=environment)
+
+    if workQueue is not None:
+        job = {'product': product, 'environment': environment, 'endpoint': endpoint, 'event': payload.decode('utf-8')}
+        # Only coalescing needs the parsed body, the queue stores the raw payload.
+        customerID = event['data']['object'].get('customer') if coalesceWindow > 0 else None
+        with profiler.phase("queue.enqueue"):
+            if customerID:
+                workQueue.enqueue(job, key=f"{endpoint}|{customerID}", delay=coalesceWindow)
+            else:
+                workQueue.enqueue(job)
+        return {'status': 'accepted', 'message': 'Webhook Queued'}, 200
 
+    processEvent(event=event, product=product, environment=environment, endpoint=endpoint)
+    return {'status': 'accepted', 'message': 'Webhook Accepted'}, 200
 
-    match event['type']:
-        case 'customer.subscription.deleted':
-            customer_subscription_deleted(subscriptionObject=event['data']['object'], endpoint=dispositionProEndpoint, caspioAPI=caspioAPI)
-        case 'invoice.paid':
-            DP_invoice_paid(invoiceObject=event['data']['object'], endpoint=dispositionProEndpoint, caspioAPI=caspioAPI, stripeAPI=stripeAPI)
-        case 'customer.subscription.updated':
-            customer_subscription_updated(subscriptionObject=event['data']['object'], endpoint=dispositionProEndpoint, caspioAPI=caspioAPI)
+def buildWebhookRoute(product: str, environment: str) -> Webhook_Route:
+    """Builds the clients, verifier and event type dispatch of a product and environment.
 
+    Args:
+        product (str): "DispositionPro" or "TitlePro"
+        environment (str): "Prod" or "Dev"
 
-    return {'status': 'accepted', 'message': 'Webhook Accepted'}, 200
+    Raises:
+        KeyError: When the Stripe secret key or signing secret of the route is missing from the .env
+
+    Returns:
+        Webhook_Route: Instance of the Webhook_Route class
+    """
+    endpoint = CASPIO_ENDPOINTS[(product, environment)]
+    stripeAPI = getStripeAPI(config[f"stripe{product}SecretKey{environment}"])
+    invoicePaid = DP_invoice_paid if product == "DispositionPro" else TP_invoice_paid
+    return Webhook_Route(
+        product=product,
+        environment=environment,
+        endpoint=endpoint,
+        stripeAPI=stripeAPI,
+        verifier=getWebhookVerifier(config[f"stripe{product}SigningSecret{environment}"]),
+        handlers={
+            'invoice.paid': partial(invoicePaid, endpoint=endpoint, stripeAPI=stripeAPI, caspioAPI=caspioAPI),
+            'customer.subscription.updated': partial(customer_subscription_updated, endpoint=endpoint, caspioAPI=caspioAPI),
+            'customer.subscription.deleted': partial(customer_subscription_deleted, endpoint=endpoint, caspioAPI=caspioAPI)
+        }
+    )
+
+# (product, environment): Webhook_Route, built once per worker.  Routes without keys in the .env are not served.
+webhookRoutes = {}
+for _, product, environment in WEBHOOK_ROUTES.values():
+    try:
+        webhookRoutes[(product, environment)] = buildWebhookRoute(product, environment)
+    except KeyError as e:
+        app.logger.warning(f"{product} {environment} webhook route disabled, {e} is missing from the .env")
+
+# Stripe redelivery dedupe.  Set eventStoreRetentionDays=0 to turn it off.
+eventStore = None
+if int(config.get('eventStoreRetentionDays', 30)) > 0:
+    eventStore = Event_Store(
+        path=config.get('eventStorePath', 'events.sqlite3'),
+        retentionDays=int(config.get('eventStoreRetentionDays', 30)),
+        processingTimeout=int(config.get('eventProcessingTimeout', 300))
+    )
+
+# Acknowledge-then-process mode.  The routes only verify and store the event, background
+# workers in every gunicorn process run the handlers.
+# Seconds queued events of the same table and CustomerID wait so they are merged into one Caspio write.
+coalesceWindow = float(config.get('caspioCoalesceWindow', 0))
+workQueue = None
+if config.get('webhookQueueMode', 'False').lower() == 'true':
+    workQueue = Work_Queue(
+        path=config.get('webhookQueuePath', 'webhook_queue.sqlite3'),
+        handler=processQueuedEvent,
+        batchHandler=processCoalescedEvents,
+        workers=int(config.get('webhookQueueWorkers', 2)),
+        maxAttempts=int(config.get('webhookQueueMaxAttempts', 5)),
+        # An event left 'processing' by a crashed worker is taken again once its job is re-leased.
+        leaseSeconds=eventStore.processingTimeout if eventStore is not None else 300,
+        logger=app.logger
+    )
+
+def start():
+    """Starts the background threads of this process: the spool drain, the dead-letter retries and the work queue
+    workers.  Called by the servers (wsgi.py, the ASGI lifespan), not on import, so the CLIs importing this module
+    never write to Caspio or lease queued events behind the caller's back.  Safe to call repeatedly and after a fork.
+    """
+    if caspioSpool is not None:
+        caspioSpool.start(apply=applySpooledWrite, canDrain=caspioReachable)
+    if deadLetters is not None:
+        # Dead letters wait until the spooled writes of an outage are written, those may be newer.
+        deadLetters.start(apply=retryDeadLetter, canRun=lambda: caspioReachable() and not spoolPending())
+    if workQueue is not None:
+        workQueue.start()
+
+
+@app.before_request
+def startTimer():
+    """Remembers when the request started, for the route latency histogram, and starts the profiler trace."""
+    g.requestStarted = time.perf_counter()
+    profiler.begin(f"{request.method} {request.path}")
+
+@app.after_request
+def recordRequest(response):
+    """Counts the request and observes its latency by route.  Unknown urls share one label."""
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    if 'requestStarted' in g:
+        metrics.observe("http_request_seconds", time.perf_counter() - g.requestStarted, route=route)
+    metrics.inc("http_requests_total", route=route, method=request.method, status=response.status_code)
+    g.responseStatus = response.status_code
+    return response
+
+@app.teardown_request
+def endTrace(error=None):
+    """Ends the profiler trace, also when the request raised."""
+    profiler.end(status=g.get('responseStatus'), error=repr(error) if error else None)
+
+
+@app.route('/', methods=['GET'])
+def homePage():
+    ENVIRONMENT = "Prod"
+    return render_template(f'index{ENVIRONMENT}.html')
 
-@app.route('/test/dispositionPro/subscriptions', methods=['POST'])
-def test_dispositionProSubscriptions():
-    """Test listening endpoint for STRIPE Disposition Pro DEV webhook."""
-    dispositionProEndpoint = '/v2/tables/Python_DP_PaymentLogs/records'
-    ENVIRONMENT = "Dev"
-    stripeAPI = Stripe_API(secretKey=config[f"stripeDispositionProSecretKey{ENVIRONMENT}"])
-    caspioAPI = Caspio_API()
-    stripe.api_key = config[f"stripeDispositionProSecretKey{ENVIRONMENT}"]
-    endpoint_secret = config[f"stripeDispositionProSigningSecret{ENVIRONMENT}"]
-    event = None
+
+def stripeWebhook(product: str, environment: str):
+    """Listening endpoint of the STRIPE webhook of a product and environment, see WEBHOOK_ROUTES."""
+    route = webhookRoutes[(product, environment)]
     payload = request.data
     sig_header = request.headers['STRIPE_SIGNATURE']
 
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, endpoint_secret
-        )
+        with profiler.phase("verify"):
+            event = route.verifier.verify(payload, sig_header)
     except ValueError as e:
         # Invalid payload
-        app.logger.warning(e)
-        app.logger.warning(f'Invalid Payload From: {request.remote_addr}')
+        app.logger.warning("Invalid Payload", extra=fields("security", error=e, remoteAddr=request.remote_addr))
         return {'status': 'error', 'message': 'Invalid payload'}, 400
 
     except stripe.error.SignatureVerificationError as e:
         # Invalid signature
-        app.logger.warning(e)
-        app.logger.warning(f'Invalid Stripe Signature from: {request.remote_addr}')
+        app.logger.warning("Invalid Stripe Signature", extra=fields("security", error=e, remoteAddr=request.remote_addr))
         return {'status': 'error', 'message': 'Invalid signature'}, 400
 
+    return acceptEvent(event=event, payload=payload, product=product, environment=environment, endpoint=route.endpoint)
 
-    match event['type']:
-        case 'customer.subscription.deleted':
-            customer_subscription_deleted(subscriptionObject=event['data']['object'], endpoint=dispositionProEndpoint, caspioAPI=caspioAPI)
-        case 'invoice.paid':
-            DP_invoice_paid(invoiceObject=event['data']['object'], endpoint=dispositionProEndpoint, caspioAPI=caspioAPI, stripeAPI=stripeAPI)
-        case 'customer.subscription.updated':
-            customer_subscription_updated(subscriptionObject=event['data']['object'], endpoint=dispositionProEndpoint, caspioAPI=caspioAPI)
+for path, (viewName, product, environment) in WEBHOOK_ROUTES.items():
+    if (product, environment) in webhookRoutes:
+        app.add_url_rule(path, endpoint=viewName, view_func=stripeWebhook, methods=['POST'],
+                         defaults={'product': product, 'environment': environment})
 
+def caspioStatus() -> dict:
+    """Caspio circuit breaker state, spooled Caspio writes and dead letters per status, for /queue."""
+    return {
+        'caspioBreaker': caspioAPI._breaker.state,
+        'caspioSpooled': caspioSpool.depth() if caspioSpool is not None else 0,
+        'deadLetters': deadLetters.depth() if deadLetters is not None else {}
+    }
 
-    return {'status': 'accepted', 'message': 'Webhook Accepted'}, 200
+@app.route('/queue', methods=['GET'])
+def queueDepth():
+    """Number of queued webhook events per status, Caspio circuit breaker state, spooled Caspio writes and dead letters."""
+    if workQueue is None:
+        return {'status': 'disabled', **caspioStatus()}, 200
+    return {'status': 'enabled', **workQueue.depth(), **caspioStatus()}, 200
 
-@app.route('/test/titlePro/subscriptions', methods=['POST'])
-def test_titleProSubscriptions():
-    """Test listening endpoint for STRIPE TitlePro DEV webhook."""
-    titleProEndpoint = '/v2/tables/TitlePro_PaymentLogs/records'
-    ENVIRONMENT = "Dev"
-    stripeAPI = Stripe_API(secretKey=config[f"stripeTitleProSecretKey{ENVIRONMENT}"])
-    caspioAPI = Caspio_API()
-    stripe.api_key = config[f"stripeTitleProSecretKey{ENVIRONMENT}"]
-    endpoint_secret = config[f"stripeTitleProSigningSecret{ENVIRONMENT}"]
-    event = None
-    payload = request.data
-    sig_header = request.headers['STRIPE_SIGNATURE']
 
-    try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, endpoint_secret
-        )
-    except ValueError as e:
-        # Invalid payload
-        app.logger.warning(e)
-        app.logger.warning(f'Invalid Payload From: {request.remote_addr}')
-        return {'status': 'error', 'message': 'Invalid payload'}, 400
+# Bearer token of the /admin and /metrics routes.  They are not served when it is missing from the .env
+adminToken = config.get('adminToken')
 
-    except stripe.error.SignatureVerificationError as e:
-        # Invalid signature
-        app.logger.warning(e)
-        app.logger.warning(f'Invalid Stripe Signature from: {request.remote_addr}')
-        return {'status': 'error', 'message': 'Invalid signature'}, 400
+def adminAuthorized(authorization: str) -> bool:
+    """Checks the Authorization header of an admin or metrics request, shared by the Flask and ASGI apps.
 
-    match event['type']:
-        case 'customer.subscription.deleted':
-            customer_subscription_deleted(subscriptionObject=event['data']['object'], endpoint=titleProEndpoint, caspioAPI=caspioAPI)
-        case 'invoice.paid':
-            TP_invoice_paid(invoiceObject=event['data']['object'], endpoint=titleProEndpoint, caspioAPI=caspioAPI, stripeAPI=stripeAPI)
-        case 'customer.subscription.updated':
-            customer_subscription_updated(subscriptionObject=event['data']['object'], endpoint=titleProEndpoint, caspioAPI=caspioAPI)
-    
-    return {'status': 'accepted', 'message': 'Webhook Accepted'}, 200
+    Args:
+        authorization (str): Authorization header of the request ex: "Bearer <adminToken>"
 
-@app.route('/live/titlePro/subscriptions', methods=['POST'])
-def titleProSubscriptions():
-    """Live listening endpoint for STRIPE TitlePro DEV webhook."""
-    titleProEndpoint = '/v2/tables/TitlePro_PaymentLogs/records'
-    ENVIRONMENT = "Prod"
-    stripeAPI = Stripe_API(secretKey=config[f"stripeTitleProSecretKey{ENVIRONMENT}"])
-    caspioAPI = Caspio_API()
-    stripe.api_key = config[f"stripeTitleProSecretKey{ENVIRONMENT}"]
-    endpoint_secret = config[f"stripeTitleProSigningSecret{ENVIRONMENT}"]
-    event = None
-    payload = request.data
-    sig_header = request.headers['STRIPE_SIGNATURE']
+    Returns:
+        bool: True when it carries the adminToken.
+    """
+    return bool(adminToken) and hmac.compare_digest((authorization or "").encode('utf-8'), f"Bearer {adminToken}".encode('utf-8'))
 
-    try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, endpoint_secret
-        )
-    except ValueError as e:
-        # Invalid payload
-        app.logger.warning(e)
-        app.logger.warning(f'Invalid Payload From: {request.remote_addr}')
-        return {'status': 'error', 'message': 'Invalid payload'}, 400
+def metricsPage():
+    """Prometheus metrics summed over every gunicorn worker."""
+    if not adminAuthorized(request.headers.get('Authorization')):
+        return {'status': 'error', 'message': 'Unauthorized'}, 401
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
-    except stripe.error.SignatureVerificationError as e:
-        # Invalid signature
-        app.logger.warning(e)
-        app.logger.warning(f'Invalid Stripe Signature from: {request.remote_addr}')
-        return {'status': 'error', 'message': 'Invalid signature'}, 400
+def adminDeadLetters(action: str, authorization: str, options: dict) -> tuple:
+    """Lists or drains the dead letters, shared by the admin routes of the Flask and ASGI apps.
 
-    match event['type']:
-        case 'customer.subscription.deleted':
-            customer_subscription_deleted(subscriptionObject=event['data']['object'], endpoint=titleProEndpoint, caspioAPI=caspioAPI)
-        case 'invoice.paid':
-            TP_invoice_paid(invoiceObject=event['data']['object'], endpoint=titleProEndpoint, caspioAPI=caspioAPI, stripeAPI=stripeAPI)
-        case 'customer.subscription.updated':
-            customer_subscription_updated(subscriptionObject=event['data']['object'], endpoint=titleProEndpoint, caspioAPI=caspioAPI)
+    Args:
+        action (str): "list" or "drain"
+        authorization (str): Authorization header of the request ex: "Bearer <adminToken>"
+        options (dict): Query string of a list (status, limit) or JSON body of a drain (ids, status, workers).
 
-    return {'status': 'accepted', 'message': 'Webhook Accepted'}, 200
+    Returns:
+        tuple[dict, int]: Response body and status code.
+    """
+    if not adminAuthorized(authorization):
+        return {'status': 'error', 'message': 'Unauthorized'}, 401
+    if deadLetters is None:
+        return {'status': 'disabled'}, 200
+    status = options.get('status') or None
+    if status not in {None, 'pending', 'failed'} and not (action == "list" and status == 'running'):
+        return {'status': 'error', 'message': f'Unknown status {status}'}, 400
+    try:
+        if action == "list":
+            return {'status': 'enabled', **deadLetters.depth(), 'letters': deadLetters.letters(status, limit=int(options.get('limit', 100)))}, 200
+        letterIDs = [int(letterID) for letterID in options['ids']] if options.get('ids') is not None else None
+        workers = int(options.get('workers', 8))
+    except (TypeError, ValueError):
+        return {'status': 'error', 'message': 'Invalid ids, limit or workers'}, 400
+    report = deadLetters.drain(retryDeadLetter, workers=workers, letterIDs=letterIDs, statuses=(status,) if status else ("pending", "failed"))
+    app.logger.info("Dead letters drained", extra=fields("admin", **report))
+    return {'status': 'drained', **report}, 200
+
+def deadLettersPage():
+    """Dead letters waiting for a retry ex: GET /admin/dead-letters?status=failed&limit=50"""
+    return adminDeadLetters("list", request.headers.get('Authorization'), request.args)
+
+def drainDeadLettersPage():
+    """Retries dead letters right away ex: POST /admin/dead-letters/drain {"status": "failed", "workers": 16}"""
+    options = request.get_json(silent=True)
+    return adminDeadLetters("drain", request.headers.get('Authorization'), options if isinstance(options, dict) else {})
+
+if adminToken:
+    app.add_url_rule('/metrics', view_func=metricsPage, methods=['GET'])
+    app.add_url_rule('/admin/dead-letters', view_func=deadLettersPage, methods=['GET'])
+    app.add_url_rule('/admin/dead-letters/drain', view_func=drainDeadLettersPage, methods=['POST'])
 
 
 @app.errorhandler(404)
-def not_found():
-    try:
-        UserMachine = request.headers["User-Agent"]
-    except Exception:
-        UserMachine = ""
-    try:
-        requestIP = request.headers["X-Real-Ip"]
-    except Exception:
-        requestIP = ""
-    app.logger.info(f"Nerd Using {UserMachine}. From IP: {requestIP}")
+def not_found(error=None):
+    # Scanner hits, sample them with logSampleRates=scanner:0.01
+    app.logger.info("Nerd", extra=fields("scanner", userAgent=request.headers.get("User-Agent", ""), ip=request.headers.get("X-Real-Ip", ""), path=request.path))
     return {"Message": "Stop"}, 404
 
 if __name__ == '__main__':
+    start()
     app.run(host="0.0.0.0", port=5000, debug=True)
 
@@ -0,0 +1,218 @@
+"""Reconciles a Caspio PaymentLogs table with the subscriptions in Stripe.
+
+Every subscription of the product's Stripe account is streamed into a CustomerID keyed table, then the
+Caspio table is streamed page by page and joined against it.  Only the rows whose quantity, Status or
+EndDate differ are written, through a bounded pool of threads.
+
+    python reconcile.py --product DispositionPro --environment Prod --dry-run
+    python reconcile.py --product TitlePro --environment Prod --workers 8 --create-missing
+"""
+import sys
+import json
+import time
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from main import config, caspioAPI, getStripeAPI, subscriptionUpdatedPayload, SEAT_FIELDS, CASPIO_ENDPOINTS
+
+# When a customer has several subscriptions, the one ranked first decides the row.
+STATUS_RANK = ["active", "trialing", "past_due", "unpaid", "incomplete", "paused", "canceled", "incomplete_expired"]
+
+# Statuses of the customers --create-missing creates a record for.  The webhooks only create a record when an
+# invoice is paid, so a customer whose subscriptions are all canceled, expired or unpaid for never gets one.
+CREATE_STATUSES = {"active", "past_due", "unpaid"}
+
+# Most PK_IDs sent in one bulk update, so several PUTs of the same change can run in parallel.
+UPDATE_CHUNK = 200
+
+
+def _rank(subscriptionObject: dict) -> tuple:
+    """Private Function. Sort key of a subscription, the lowest wins."""
+    status = subscriptionObject.get('status')
+    rank = STATUS_RANK.index(status) if status in STATUS_RANK else len(STATUS_RANK)
+    return (rank, -subscriptionObject.get('created', 0))
+
+def expectedRows(stripeAPI, seatField: str) -> dict:
+    """Builds the Caspio row every Stripe customer should have.
+
+    Args:
+        stripeAPI (Stripe_API): Instance of Stripe_API class of the product's account.
+        seatField (str): Caspio column of the purchased quantity, "UnitsPurchased" or "Purchased_Seats"
+
+    Returns:
+        dict: CustomerID:{"subscription", "email", "row"} for each customer.
+    """
+    expected = {}
+    for subscriptionObject in stripeAPI.iterSubscriptions(expandCustomer=True):
+        customer = subscriptionObject['customer']
+        customerID = customer['id'] if isinstance(customer, dict) else customer
+        current = expected.get(customerID)
+        if current is not None and _rank(current['subscription']) <= _rank(subscriptionObject):
+            continue
+
+        row = {'Status': subscriptionObject['status'], **subscriptionUpdatedPayload(subscriptionObject)}
+        if subscriptionObject.get('quantity') is not None:
+            row[seatField] = subscriptionObject['quantity']
+        expected[customerID] = {
+            'subscription': {'status': subscriptionObject['status'], 'created': subscriptionObject.get('created', 0)},
+            'email': customer.get('email') if isinstance(customer, dict) else None,
+            'row': row
+        }
+    return expected
+
+def normalizeDate(value) -> str:
+    """Caspio date in the '%m/%d/%Y' format written by the webhooks.
+
+    Args:
+        value (str): Date as returned by Caspio ex: "2024-01-31T00:00:00", "01/31/2024" or None
+
+    Returns:
+        str: ex: "01/31/2024", "" when there is no date.
+    """
+    if not value:
+        return ""
+    for parse in (datetime.datetime.fromisoformat, lambda text: datetime.datetime.strptime(text, '%m/%d/%Y')):
+        try:
+            return parse(value).strftime('%m/%d/%Y')
+        except ValueError:
+            pass
+    return value
+
+def diffRow(expected: dict, record: dict, seatField: str) -> dict:
+    """Fields of the Caspio record that differ from Stripe.
+
+    Args:
+        expected (dict): Row built by expectedRows.
+        record (dict): Caspio record.
+        seatField (str): Caspio column of the purchased quantity.
+
+    Returns:
+        dict: Key:Value changes to write, empty when the record is in sync.
+    """
+    delta = {}
+    if seatField in expected and str(record.get(seatField) or 0) != str(expected[seatField]):
+        delta[seatField] = expected[seatField]
+    if (record.get('Status') or "") != expected['Status']:
+        delta['Status'] = expected['Status']
+    if normalizeDate(record.get('EndDate')) != expected['EndDate']:
+        delta['EndDate'] = expected['EndDate']
+    return delta
+
+def reconcile(product: str, environment: str, dryRun: bool = False, createMissing: bool = False, workers: int = 8,
+              pageSize: int = 1000, out=sys.stdout) -> dict:
+    """Compares the product's Caspio table with Stripe and writes the differences.
+
+    Args:
+        product (str): "DispositionPro" or "TitlePro"
+        environment (str): "Prod" or "Dev"
+        dryRun (bool, optional): Only print the changes.
+        createMissing (bool, optional): Create a record for Stripe customers missing from Caspio, see CREATE_STATUSES.
+        workers (int, optional): Caspio writes running at the same time.
+        pageSize (int, optional): Caspio records per page.
+        out (file, optional): Where planned changes are printed, one JSON line each.
+
+    Returns:
+        dict: Throughput report.
+    """
+    seatField = SEAT_FIELDS[product]
+    endpoint = CASPIO_ENDPOINTS[(product, environment)]
+    stripeAPI = getStripeAPI(config[f"stripe{product}SecretKey{environment}"])
+    report = {"product": product, "environment": environment, "dryRun": dryRun}
+
+    started = time.monotonic()
+    expected = expectedRows(stripeAPI, seatField)
+    report["stripeCustomers"] = len(expected)
+    report["stripeSeconds"] = round(time.monotonic() - started, 3)
+
+    joinStarted = time.monotonic()
+    updates, seen, scanned, unknown = {}, set(), 0, 0
+    for record in caspioAPI.iterRecords(endpoint, qSelect=f"PK_ID,CustomerID,{seatField},Status,EndDate", pageSize=pageSize, prefetch=True):
+        scanned += 1
+        customerID = record.get('CustomerID')
+        entry = expected.get(customerID)
+        if entry is None:
+            unknown += 1
+            continue
+        seen.add(customerID)
+        delta = diffRow(entry['row'], record, seatField)
+        if delta:
+            updates[record['PK_ID']] = delta
+            out.write(json.dumps({"action": "update", "PK_ID": record['PK_ID'], "CustomerID": customerID, "data": delta}) + "\n")
+
+    missing, notCreated = {}, 0
+    for customerID, entry in expected.items():
+        if customerID in seen:
+            continue
+        if entry['subscription']['status'] not in CREATE_STATUSES:
+            notCreated += 1
+            continue
+        missing[customerID] = {'Email': entry['email'], 'CustomerID': customerID, **entry['row']}
+        if createMissing:
+            out.write(json.dumps({"action": "create", "CustomerID": customerID, "data": missing[customerID]}) + "\n")
+    report.update({"caspioRecords": scanned, "notInStripe": unknown, "missingInCaspio": len(missing),
+                   "missingInactive": notCreated, "updatesPlanned": len(updates),
+                   "caspioSeconds": round(time.monotonic() - joinStarted, 3)})
+
+    writeStarted = time.monotonic()
+    written = failed = 0
+    if not dryRun:
+        groups = {}
+        for pkID, delta in updates.items():
+            groups.setdefault(json.dumps(delta, sort_keys=True), {})[pkID] = delta
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for records in groups.values():
+                pkIDs = list(records)
+                for start in range(0, len(pkIDs), UPDATE_CHUNK):
+                    chunk = {pkID: records[pkID] for pkID in pkIDs[start:start + UPDATE_CHUNK]}
+                    futures.append(executor.submit(caspioAPI.bulkUpdate, endpoint, chunk))
+            if createMissing:
+                futures += [executor.submit(caspioAPI.post, endpoint, data) for data in missing.values()]
+
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    out.write(json.dumps({"action": "error", "error": str(e)}) + "\n")
+                    continue
+                if isinstance(result, list):
+                    for chunkResult in result:
+                        if chunkResult["error"]:
+                            failed += len(chunkResult["PK_IDs"])
+                            out.write(json.dumps({"action": "error", **chunkResult}) + "\n")
+                        else:
+                            written += len(chunkResult["PK_IDs"])
+                elif result.status_code in {200, 201}:
+                    written += 1
+                else:
+                    failed += 1
+                    out.write(json.dumps({"action": "error", "status_code": result.status_code, "error": result.text}) + "\n")
+
+    totalSeconds = time.monotonic() - started
+    report.update({
+        "written": written,
+        "failed": failed,
+        "writeSeconds": round(time.monotonic() - writeStarted, 3),
+        "totalSeconds": round(totalSeconds, 3),
+        "customersPerSecond": round((len(expected) + scanned) / totalSeconds, 1) if totalSeconds else None,
+        "caspioRetries": caspioAPI._retryPolicy.stats()
+    })
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reconcile a Caspio PaymentLogs table with Stripe.")
+    parser.add_argument("--product", required=True, choices=sorted(SEAT_FIELDS))
+    parser.add_argument("--environment", default="Prod", choices=["Prod", "Dev"])
+    parser.add_argument("--dry-run", action="store_true", help="Print the changes without writing them.")
+    parser.add_argument("--create-missing", action="store_true", help="Create records for active, past_due or unpaid Stripe customers missing from Caspio.")
+    parser.add_argument("--workers", type=int, default=8, help="Caspio writes running at the same time.")
+    parser.add_argument("--page-size", type=int, default=1000, help="Caspio records per page.")
+    args = parser.parse_args()
+
+    summary = reconcile(args.product, args.environment, dryRun=args.dry_run, createMissing=args.create_missing,
+                        workers=args.workers, pageSize=args.page_size)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    sys.exit(1 if summary["failed"] else 0)
@@ -0,0 +1,150 @@
+"""Replays exported Stripe events through the webhook handlers, ex: after an outage.
+
+The dump is a JSON list, a Stripe list object ({"data": [...]}) or one event per line (JSONL).  Events are
+sorted by 'created' and partitioned by customer: the events of one customer run in order, different
+customers run in parallel.  Events already applied are skipped unless --force is given.
+
+    python replay.py events.jsonl --product DispositionPro --environment Prod --workers 8
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from main import processEvent, CASPIO_ENDPOINTS, SEAT_FIELDS
+
+HANDLED_TYPES = {'invoice.paid', 'customer.subscription.updated', 'customer.subscription.deleted'}
+
+
+def loadEvents(path: str) -> list[dict]:
+    """Reads the exported events.
+
+    Args:
+        path (str): JSON or JSONL file of Stripe events.
+
+    Returns:
+        list[dict]: Events sorted by 'created'.
+    """
+    with open(path, "r") as dumpFile:
+        text = dumpFile.read()
+    try:
+        data = json.loads(text)
+        events = data['data'] if isinstance(data, dict) else data
+    except ValueError:
+        events = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return sorted(events, key=lambda event: event['created'])
+
+def partition(events: list[dict]) -> list[list[dict]]:
+    """Groups the events by customer, keeping their order.
+
+    Args:
+        events (list[dict]): Events sorted by 'created'.
+
+    Returns:
+        list[list[dict]]: One list per customer, largest first so the longest chains start early.
+    """
+    partitions = {}
+    for event in events:
+        customerID = event['data']['object'].get('customer') or event['id']
+        partitions.setdefault(customerID, []).append(event)
+    return sorted(partitions.values(), key=len, reverse=True)
+
+
+class Replay:
+    """Runs partitions of events on a thread pool and keeps the progress counters."""
+
+    def __init__(self, product: str, environment: str, force: bool = False, out=sys.stderr, progressEvery: float = 5.0):
+        """
+        Args:
+            product (str): "DispositionPro" or "TitlePro"
+            environment (str): "Prod" or "Dev"
+            force (bool, optional): Run events that were already applied again.
+            out (file, optional): Where progress and failures are written.
+            progressEvery (float, optional): Seconds between progress lines.
+        """
+        self.product = product
+        self.environment = environment
+        self.endpoint = CASPIO_ENDPOINTS[(product, environment)]
+        self.force = force
+        self.out = out
+        self.progressEvery = progressEvery
+        self.total = self.done = self.failed = 0
+        self.failures = []
+        self._lock = threading.Lock()
+        self._started = None
+        self._lastProgress = 0
+
+    def _record(self, event: dict, success: bool, error: str = None):
+        """Private Function. Updates the counters and prints progress."""
+        with self._lock:
+            self.done += 1
+            if not success:
+                self.failed += 1
+                self.failures.append({"id": event['id'], "type": event['type'], "error": error})
+            now = time.monotonic()
+            if now - self._lastProgress >= self.progressEvery or self.done == self.total:
+                self._lastProgress = now
+                self.out.write(f"{self.done}/{self.total} events | {self.rate():.1f}/s | {self.failed} failed\n")
+
+    def rate(self) -> float:
+        """Events processed per second since the replay started."""
+        elapsed = time.monotonic() - self._started if self._started else 0
+        return self.done / elapsed if elapsed else 0.0
+
+    def _runPartition(self, events: list[dict]):
+        """Private Function. Processes the events of one customer in order.  A failure does not stop the
+        later events, which carry newer state."""
+        for event in events:
+            if event['type'] not in HANDLED_TYPES:
+                self._record(event, True)
+                continue
+            try:
+                success = processEvent(event=event, product=self.product, environment=self.environment,
+                                       endpoint=self.endpoint, force=self.force)
+                self._record(event, success, None if success else "handler returned False")
+            except Exception as e:
+                self._record(event, False, str(e))
+
+    def run(self, events: list[dict], workers: int = 8) -> dict:
+        """Replays the events.
+
+        Args:
+            events (list[dict]): Events sorted by 'created'.
+            workers (int, optional): Customers processed at the same time.
+
+        Returns:
+            dict: Report with counts, seconds and rate.
+        """
+        self.total = len(events)
+        self._started = time.monotonic()
+        partitions = partition(events)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(self._runPartition, events) for events in partitions]:
+                future.result()
+        return {
+            "events": self.total,
+            "customers": len(partitions),
+            "failed": self.failed,
+            "seconds": round(time.monotonic() - self._started, 3),
+            "eventsPerSecond": round(self.rate(), 1)
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay exported Stripe events through the webhook handlers.")
+    parser.add_argument("path", help="JSON or JSONL file of Stripe events.")
+    parser.add_argument("--product", required=True, choices=sorted(SEAT_FIELDS))
+    parser.add_argument("--environment", default="Prod", choices=["Prod", "Dev"])
+    parser.add_argument("--workers", type=int, default=8, help="Customers processed at the same time.")
+    parser.add_argument("--force", action="store_true", help="Run events that were already applied again.")
+    parser.add_argument("--failures", help="Write the failed events to this JSONL file.")
+    args = parser.parse_args()
+
+    replay = Replay(args.product, args.environment, force=args.force)
+    summary = replay.run(loadEvents(args.path), workers=args.workers)
+    if args.failures:
+        with open(args.failures, "w") as failuresFile:
+            failuresFile.writelines(json.dumps(failure) + "\n" for failure in replay.failures)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    sys.exit(1 if summary["failed"] else 0)
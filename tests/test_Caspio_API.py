@@ -4,11 +4,19 @@
 # pylint: disable=protected-access
 # pylint: disable=line-too-long
 # pylint: disable=missing-function-docstring
+import time
 import random
 import json
+from urllib.parse import quote
+import httpx
 import pytest
+import requests
+import urllib3
 from unittest.mock import patch, mock_open
 from utils.Caspio_API import Caspio_API, NoUsersToUpdate
+from utils.Caspio_Index import Caspio_Index
+from utils.Retry_Policy import Retry_Policy
+from utils.Circuit_Breaker import Circuit_Breaker, CircuitOpen
 
 ## They Work Tested 11-20-2023
 
@@ -58,8 +66,13 @@ class MockEnvFile:
 endpoint = "/v2/tables/Python_DP_PaymentLogs/records"
 
 @pytest.fixture
-def caspioAPI():
-    return Caspio_API()
+def caspioAPI(tmp_path):
+    api = Caspio_API()
+    api._index = Caspio_Index(path=str(tmp_path / "caspio_index.sqlite3"))
+    api._tokens.path = str(tmp_path / "caspio_tokens.json")
+    api._retryPolicy = Retry_Policy(baseDelay=0, maxDelay=0)
+    api._breaker = Circuit_Breaker(name="caspio", enabled=False)
+    return api
 
 
 
@@ -209,3 +222,226 @@ def test_update_tokens_empty_file(caspioAPI):
         mock_file.assert_called_with(".env", "w")
         mock_file().write.assert_not_called()
 
+
+class MockResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.text = json.dumps(data) if data is not None else ""
+
+class MockSend:
+    """Stands in for Caspio_API._send.  Returns the responses given per HTTP method and records every call."""
+    def __init__(self, **responses):
+        self.responses = responses
+        self.calls = []
+
+    def __call__(self, method, url, **kwargs):
+        self.calls.append((method, kwargs))
+        response = self.responses[method]
+        return response.pop(0) if isinstance(response, list) else response
+
+    def callsTo(self, method):
+        return [kwargs for callMethod, kwargs in self.calls if callMethod == method]
+
+def test_findUser_uses_filtered_query(caspioAPI):
+    """Tests that the CustomerID lookup is done as a filtered query instead of a full table GET"""
+
+    record = {"PK_ID": 7, "CustomerID": "cus_123"}
+    with patch.object(caspioAPI, "_send", MockSend(GET=MockResponse(200, {"Result": [record]}))) as mock_send:
+        response, found = caspioAPI._findUser("cus_123", endpoint)
+
+    assert response.status_code == 200
+    assert found == record
+    params = mock_send.callsTo("GET")[0]["params"]
+    assert params["q.where"] == "CustomerID='cus_123'"
+    assert params["q.select"] == "PK_ID,CustomerID"
+
+def test_mergeUser_posts_when_lookup_is_empty(caspioAPI):
+    """Tests that mergeUser creates a new record when the filtered lookup finds no CustomerID"""
+
+    data = {"CustomerID": "cus_new", "UnitsPurchased": 3}
+    with patch.object(caspioAPI, "_send", MockSend(GET=MockResponse(200, {"Result": []}), POST=MockResponse(201))) as mock_send:
+        response = caspioAPI.mergeUser(data=data, endpoint=endpoint)
+
+    assert response.status_code == 201
+    assert json.loads(mock_send.callsTo("POST")[0]["data"]) == data
+
+def test_upsert_mode_existing_customer_is_one_call(caspioAPI):
+    """Tests that the upsert mode of mergeUser only issues a filtered PUT when the CustomerID already exists"""
+
+    caspioAPI._upsertMode = True
+    data = {"CustomerID": "cus_123", "UnitsPurchased": 3}
+    put = MockResponse(200, {"RecordsAffected": 1, "Result": [{"PK_ID": 7, "CustomerID": "cus_123"}]})
+    with patch.object(caspioAPI, "_send", MockSend(PUT=put)) as mock_send:
+        response = caspioAPI.mergeUser(data=data, endpoint=endpoint)
+
+    assert response.status_code == 200
+    assert len(mock_send.calls) == 1
+    assert mock_send.callsTo("PUT")[0]["params"]["q.where"] == "CustomerID='cus_123'"
+
+def test_upsert_mode_new_customer_posts(caspioAPI):
+    """Tests that the upsert mode of mergeUser creates the record when the filtered PUT affected no rows"""
+
+    caspioAPI._upsertMode = True
+    data = {"CustomerID": "cus_new", "UnitsPurchased": 3}
+    with patch.object(caspioAPI, "_send", MockSend(PUT=MockResponse(200, {"RecordsAffected": 0}), POST=MockResponse(201))) as mock_send:
+        response = caspioAPI.mergeUser(data=data, endpoint=endpoint)
+
+    assert response.status_code == 201
+    assert len(mock_send.callsTo("POST")) == 1
+
+def test_index_skips_lookup_for_repeat_customer(caspioAPI):
+    """Tests that the PK_ID found by the first lookup is reused so the second update skips the GET"""
+
+    lookup = MockResponse(200, {"Result": [{"PK_ID": 7, "CustomerID": "cus_123"}]})
+    with patch.object(caspioAPI, "_send", MockSend(GET=lookup, PUT=MockResponse(200, {"RecordsAffected": 1}))) as mock_send:
+        caspioAPI.updateUser(customerID="cus_123", data={"Status": "active"}, endpoint=endpoint)
+        caspioAPI.updateUser(customerID="cus_123", data={"Status": "canceled"}, endpoint=endpoint)
+
+    assert len(mock_send.callsTo("GET")) == 1
+    assert mock_send.callsTo("PUT")[-1]["params"]["q.where"] == "PK_ID=7 AND CustomerID='cus_123'"
+
+def test_index_invalidated_when_record_is_gone(caspioAPI):
+    """Tests that a cached PK_ID which no longer matches is dropped and the customer is looked up again"""
+
+    caspioAPI._index.set(endpoint, "cus_123", 7)
+    lookup = MockResponse(200, {"Result": [{"PK_ID": 9, "CustomerID": "cus_123"}]})
+    puts = [MockResponse(200, {"RecordsAffected": 0}), MockResponse(200, {"RecordsAffected": 1})]
+    with patch.object(caspioAPI, "_send", MockSend(GET=lookup, PUT=puts)) as mock_send:
+        response = caspioAPI.updateUser(customerID="cus_123", data={"Status": "active"}, endpoint=endpoint)
+
+    assert response.status_code == 200
+    assert len(mock_send.callsTo("GET")) == 1
+    assert caspioAPI._index.get(endpoint, "cus_123") == 9
+
+def test_session_is_reused_within_a_worker(caspioAPI):
+    """Tests that every call in a worker goes over the same pooled keep-alive session"""
+
+    assert caspioAPI._http.session is caspioAPI._http.session
+    assert Caspio_API()._http.session is caspioAPI._http.session
+
+def test_retry_keeps_the_original_filter(caspioAPI):
+    """Tests that a GET retried after a 503 and a 401 is sent again with the same q.where"""
+
+    responses = [MockResponse(503), MockResponse(401), MockResponse(200, {"Result": []})]
+    with patch.object(caspioAPI, "_send", MockSend(GET=responses)) as mock_send, \
+         patch.object(caspioAPI._tokens, "refresh") as mock_refresh:
+        response = caspioAPI.get(endpoint, qWhere="CustomerID='cus_123'")
+
+    assert response.status_code == 200
+    assert [call["params"]["q.where"] for call in mock_send.callsTo("GET")] == ["CustomerID='cus_123'"] * 3
+    mock_refresh.assert_called_once()
+    assert caspioAPI._retryPolicy.stats()["retry_503"] == 1
+
+def test_retries_are_bounded(caspioAPI):
+    """Tests that a request failing with 500 stops after maxAttempts instead of looping"""
+
+    with patch.object(caspioAPI, "_send", MockSend(PUT=MockResponse(500))) as mock_send:
+        response = caspioAPI.put(endpoint, {"Status": "active"}, "PK_ID=1")
+
+    assert response.status_code == 500
+    assert len(mock_send.calls) == caspioAPI._retryPolicy.maxAttempts
+    assert caspioAPI._retryPolicy.stats()["gaveUp"] == 1
+
+def test_open_breaker_fails_fast(caspioAPI):
+    """Tests that once the breaker opens after repeated 503s, the next call is rejected without a request"""
+
+    caspioAPI._breaker = Circuit_Breaker(name="caspio", failureThreshold=2, openSeconds=60)
+    with patch.object(caspioAPI, "_send", MockSend(PUT=MockResponse(503))) as mock_send:
+        with pytest.raises(CircuitOpen):
+            caspioAPI.put(endpoint, {"Status": "active"}, "PK_ID=1")
+        sent = len(mock_send.calls)
+        with pytest.raises(CircuitOpen):
+            caspioAPI.put(endpoint, {"Status": "active"}, "PK_ID=1")
+
+    assert sent == 2
+    assert len(mock_send.calls) == sent
+    assert caspioAPI._breaker.state == Circuit_Breaker.OPEN
+
+def test_post_is_not_retried_on_server_error(caspioAPI):
+    """Tests that a POST, which Caspio may already have applied, is not sent twice after a 500"""
+
+    with patch.object(caspioAPI, "_send", MockSend(POST=MockResponse(500))) as mock_send:
+        response = caspioAPI.post(endpoint, {"CustomerID": "cus_123"})
+
+    assert response.status_code == 500
+    assert len(mock_send.calls) == 1
+
+def test_post_is_retried_only_when_the_connection_failed():
+    """Tests that a POST is retried after a failed connect, but not after a reset that may follow the server applying it"""
+
+    started = time.monotonic()
+    refused = requests.ConnectionError(urllib3.exceptions.MaxRetryError(None, "/", urllib3.exceptions.NewConnectionError(None, "refused")))
+    try:
+        raise requests.ConnectionError("All connection attempts failed") from httpx.ConnectError("refused")
+    except requests.ConnectionError as e:
+        asyncRefused = e
+    try:
+        raise requests.ConnectionError("Server disconnected") from httpx.RemoteProtocolError("Server disconnected")
+    except requests.ConnectionError as e:
+        asyncReset = e
+    reset = requests.ConnectionError(urllib3.exceptions.ProtocolError("Connection aborted.", ConnectionResetError(104)))
+
+    for error in (refused, asyncRefused, requests.ConnectTimeout("connect timeout")):
+        assert Retry_Policy().shouldRetry("POST", 1, started, error=error)
+    for error in (reset, asyncReset, requests.ReadTimeout("read timeout")):
+        assert not Retry_Policy().shouldRetry("POST", 1, started, error=error)
+        assert Retry_Policy().shouldRetry("PUT", 1, started, error=error)
+
+def test_retry_after_header_is_honored():
+    """Tests that the wait before a retry follows the Retry-After header"""
+
+    response = MockResponse(429)
+    response.headers = {"Retry-After": "3"}
+    assert Retry_Policy(maxDelay=8).delay(1, response) == 3
+    assert Retry_Policy(maxDelay=2).delay(1, response) == 2
+
+def test_bulkUpdate_groups_identical_payloads(caspioAPI):
+    """Tests that records getting the same data are updated with one PK_ID IN (...) request per chunk"""
+
+    records = {1: {"Status": "canceled"}, 2: {"Status": "canceled"}, 3: {"EndDate": ""}, 4: {"Status": "canceled"}}
+    with patch.object(caspioAPI, "_send", MockSend(PUT=MockResponse(200, {"RecordsAffected": 3}))) as mock_send:
+        results = caspioAPI.bulkUpdate(endpoint, records)
+
+    wheres = sorted(call["params"]["q.where"] for call in mock_send.callsTo("PUT"))
+    assert wheres == ["PK_ID IN (1,2,4)", "PK_ID IN (3)"]
+    assert [result["PK_IDs"] for result in results] == [[1, 2, 4], [3]]
+
+def test_bulkUpdate_chunks_long_filters(caspioAPI):
+    """Tests that a large group is split so the encoded q.where stays under the limit"""
+
+    records = {pkID: {"Status": "canceled"} for pkID in range(1000, 1100)}
+    with patch.object(caspioAPI, "_send", MockSend(PUT=MockResponse(200, {"RecordsAffected": 1}))) as mock_send:
+        results = caspioAPI.bulkUpdate(endpoint, records, maxWhereLength=100)
+
+    assert len(results) > 1
+    assert sorted(pkID for result in results for pkID in result["PK_IDs"]) == list(range(1000, 1100))
+    for call in mock_send.callsTo("PUT"):
+        assert len(quote(call["params"]["q.where"])) <= 100
+
+def pagedTable(records):
+    """MockSend GET handler serving 'records' page by page."""
+    def send(method, url, **kwargs):
+        pageNumber, pageSize = kwargs["params"]["q.pageNumber"], kwargs["params"]["q.pageSize"]
+        return MockResponse(200, {"Result": records[(pageNumber - 1) * pageSize:pageNumber * pageSize]})
+    return send
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_iterRecords_walks_every_page(caspioAPI, prefetch):
+    """Tests that iterRecords yields the records of every page, not only the first one"""
+
+    records = [{"PK_ID": pkID, "CustomerID": f"cus_{pkID}"} for pkID in range(1, 26)]
+    with patch.object(caspioAPI, "_send", side_effect=pagedTable(records)) as mock_send:
+        streamed = list(caspioAPI.iterRecords(endpoint, qSelect="PK_ID,CustomerID", pageSize=10, prefetch=prefetch))
+
+    assert streamed == records
+    assert mock_send.call_count == 3
+    assert mock_send.call_args.kwargs["params"]["q.select"] == "PK_ID,CustomerID"
+
+def test_iterRecords_is_lazy(caspioAPI):
+    """Tests that pages are only fetched as the records are consumed"""
+
+    records = [{"PK_ID": pkID} for pkID in range(1, 26)]
+    with patch.object(caspioAPI, "_send", side_effect=pagedTable(records)) as mock_send:
+        stream = caspioAPI.iterRecords(endpoint, pageSize=10)
+        assert next(stream) == {"PK_ID": 1}
+        assert mock_send.call_count == 1
@@ -0,0 +1,58 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import os
+import pytest
+from utils.Caspio_Spool import Caspio_Spool
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Caspio_Spool(path=str(tmp_path / "caspio_spool.jsonl"), drainRate=0)
+
+def write(number):
+    return {"operation": "update", "endpoint": "/v2/tables/T/records", "customerID": f"cus_{number}", "data": {"Status": "canceled"}}
+
+
+def test_drains_in_order_and_empties_the_file(spool):
+    """Tests that spooled writes are replayed in the order they were spooled"""
+
+    for number in range(3):
+        spool.append(write(number))
+    assert spool.pending() and spool.depth() == 3
+
+    applied = []
+    assert spool.drain(lambda spooled: applied.append(spooled['customerID']) is None) == 3
+    assert applied == ["cus_0", "cus_1", "cus_2"]
+    assert not spool.pending()
+    assert os.path.getsize(spool.path) == 0
+
+def test_stops_while_caspio_is_down_and_resumes(spool):
+    """Tests that a write that can not be applied yet stays at the head of the spool"""
+
+    for number in range(3):
+        spool.append(write(number))
+    calls = []
+
+    def applyOnce(spooled):
+        calls.append(spooled['customerID'])
+        return len(calls) == 1
+
+    assert spool.drain(applyOnce) == 1
+    assert spool.depth() == 2
+
+    resumed = Caspio_Spool(path=spool.path, drainRate=0)
+    applied = []
+    assert resumed.drain(lambda spooled: applied.append(spooled['customerID']) is None) == 2
+    assert applied == ["cus_1", "cus_2"]
+
+def test_offset_past_the_end_is_ignored(spool):
+    """Tests that an offset left behind by a spool emptied before the offset was reset does not skip new writes"""
+
+    spool.append(write(0))
+    spool._setOffset(10_000)
+    assert spool.pending() and spool.depth() == 1
+
+    applied = []
+    assert spool.drain(lambda spooled: applied.append(spooled['customerID']) is None) == 1
+    assert applied == ["cus_0"]
@@ -0,0 +1,57 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import pytest
+from utils.Circuit_Breaker import Circuit_Breaker, CircuitOpen
+
+
+@pytest.fixture
+def breaker():
+    return Circuit_Breaker(name="caspio", failureThreshold=3, slowCallSeconds=1.0, openSeconds=60)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    """Tests that only consecutive failures open the breaker, then calls fail fast"""
+
+    for success in (False, False, True, False, False):
+        breaker.record(success, breaker.before())
+    assert breaker.state == Circuit_Breaker.CLOSED
+
+    breaker.record(False, 0.1, breaker.before())
+    assert breaker.state == Circuit_Breaker.OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before()
+
+def test_slow_calls_count_as_failures(breaker):
+    """Tests that successful calls slower than slowCallSeconds open the breaker too"""
+
+    for _ in range(3):
+        breaker.record(True, 2.5, breaker.before())
+    assert breaker.state == Circuit_Breaker.OPEN
+
+def test_half_open_trial(breaker):
+    """Tests that one trial call is let through after openSeconds, and that its outcome closes or reopens the breaker"""
+
+    for _ in range(3):
+        breaker.record(False, 0.1, breaker.before())
+    breaker._openedAt -= 60
+    assert breaker.state == Circuit_Breaker.HALF_OPEN
+
+    assert breaker.before() is True
+    with pytest.raises(CircuitOpen):
+        breaker.before()
+    breaker.record(False, 0.1, trial=True)
+    assert breaker.state == Circuit_Breaker.OPEN
+
+    breaker._openedAt -= 60
+    breaker.record(True, 0.1, trial=breaker.before())
+    assert breaker.state == Circuit_Breaker.CLOSED
+    assert breaker.before() is False
+
+def test_disabled_breaker_never_opens():
+    """Tests that a disabled breaker lets every call through"""
+
+    breaker = Circuit_Breaker(name="caspio", failureThreshold=1, enabled=False)
+    breaker.record(False, 0.1, breaker.before())
+    breaker.before()
+    assert breaker.state == Circuit_Breaker.CLOSED
@@ -0,0 +1,92 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import pytest
+from utils.Dead_Letter_Store import Dead_Letter_Store
+
+endpoint = "/v2/tables/Python_DP_PaymentLogs/records"
+
+
+@pytest.fixture
+def deadLetters(tmp_path):
+    return Dead_Letter_Store(path=str(tmp_path / "dead_letters.sqlite3"), maxAttempts=2, baseDelay=0, maxDelay=0)
+
+
+def test_newer_failure_is_merged_into_the_waiting_letter(deadLetters):
+    """Tests that a second failed write for the same customer updates the waiting letter, newer fields winning"""
+
+    first = deadLetters.add("update", endpoint, {"Status": "active", "EndDate": ""}, "400 Bad Request", customerID="cus_1")
+    second = deadLetters.add("merge", endpoint, {"CustomerID": "cus_1", "Status": "canceled"}, "500 Internal Server Error")
+    deadLetters.add("update", endpoint, {"Status": "active"}, "400 Bad Request", customerID="cus_2")
+
+    letter = deadLetters.letters()[0]
+    assert first == second
+    assert (letter["operation"], letter["customerID"], letter["error"]) == ("merge", "cus_1", "500 Internal Server Error")
+    assert letter["data"] == {"Status": "canceled", "EndDate": "", "CustomerID": "cus_1"}
+    assert deadLetters.depth() == {"pending": 2, "running": 0, "failed": 0}
+
+def test_successful_write_supersedes_older_fields(deadLetters):
+    """Tests that a later successful write removes the fields it wrote, and letters left empty are deleted"""
+
+    deadLetters.add("merge", endpoint, {"CustomerID": "cus_1", "UnitsPurchased": 5, "Status": "active"}, "400 Bad Request")
+    deadLetters.add("update", endpoint, {"EndDate": ""}, "400 Bad Request", customerID="cus_2")
+
+    assert deadLetters.supersede(endpoint, "cus_1", {"CustomerID": "cus_1", "UnitsPurchased": 7}) == 1
+    assert deadLetters.supersede(endpoint, "cus_2", {"EndDate": "01/31/2030"}) == 1
+    assert deadLetters.supersede(endpoint, "cus_3", {"EndDate": ""}) == 0
+    assert [letter["data"] for letter in deadLetters.letters()] == [{"CustomerID": "cus_1", "Status": "active"}]
+
+def test_failed_retries_are_parked(deadLetters):
+    """Tests that a letter failing every retry is rescheduled, then parked as failed after maxAttempts"""
+
+    def failingWrite(letter):
+        raise RuntimeError("400 Bad Request")
+
+    deadLetters.add("update", endpoint, {"Status": "active"}, "400 Bad Request", customerID="cus_1")
+    assert deadLetters.runOnce(failingWrite)
+    assert deadLetters.depth()["pending"] == 1
+    assert deadLetters.runOnce(failingWrite)
+    assert deadLetters.depth() == {"pending": 0, "running": 0, "failed": 1}
+    assert not deadLetters.runOnce(failingWrite)
+
+def test_drain_retries_parked_letters_by_customer(deadLetters):
+    """Tests that a drain writes pending and failed letters, keeps failures and can be limited to some ids"""
+
+    written = []
+
+    def write(letter):
+        if letter["customerID"] == "cus_bad":
+            raise RuntimeError("400 Bad Request")
+        written.append(letter["customerID"])
+
+    letterIDs = [deadLetters.add("update", endpoint, {"Status": "active"}, "500", customerID=f"cus_{number}") for number in range(20)]
+    deadLetters.add("update", endpoint, {"Status": "active"}, "500", customerID="cus_bad")
+    deadLetters._connection().execute("UPDATE letters SET status='failed' WHERE id=?", (letterIDs[0],))
+
+    assert deadLetters.drain(write, workers=4, letterIDs=letterIDs[:2])["resolved"] == 2
+    report = deadLetters.drain(write, workers=4)
+    assert (report["letters"], report["resolved"], report["failed"]) == (19, 18, 1)
+    assert sorted(written) == sorted(f"cus_{number}" for number in range(20))
+    assert [letter["customerID"] for letter in deadLetters.letters()] == ["cus_bad"]
+
+def test_write_during_a_retry_supersedes_it(deadLetters):
+    """Tests that fields written while a letter is retried are left out of the retry, or written again after it"""
+
+    deadLetters.add("update", endpoint, {"Status": "past_due", "EndDate": ""}, "500", customerID="cus_1")
+    letter = deadLetters._claim(letterIDs=None, statuses=("pending",))[0]
+    assert deadLetters.supersede(endpoint, "cus_1", {"EndDate": "01/31/2030"}) == 1
+
+    written = []
+
+    def write(retried):
+        written.append(retried["data"])
+        # A live write lands while the retry is on its way.
+        deadLetters.supersede(endpoint, "cus_1", {"Status": "active"})
+
+    assert deadLetters.retry(letter, write)
+    assert written == [{"Status": "past_due"}]
+    assert [(waiting["operation"], waiting["status"], waiting["data"]) for waiting in deadLetters.letters()] == [("update", "pending", {"Status": "active"})]
+
+    assert deadLetters.runOnce(written.append)
+    assert written[-1]["data"] == {"Status": "active"}
+    assert deadLetters.depth() == {"pending": 0, "running": 0, "failed": 0}
@@ -0,0 +1,46 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import pytest
+from utils.Event_Store import Event_Store
+
+
+@pytest.fixture
+def eventStore(tmp_path):
+    return Event_Store(path=str(tmp_path / "events.sqlite3"))
+
+
+def test_processed_event_is_not_processed_again(eventStore):
+    """Tests that a redelivered event is rejected once the first delivery was applied"""
+
+    assert eventStore.begin("evt_1")
+    eventStore.finish("evt_1", success=True)
+
+    assert eventStore.isProcessed("evt_1")
+    assert not eventStore.begin("evt_1")
+
+def test_failed_event_can_be_retried(eventStore):
+    """Tests that an event whose processing failed is processed again on redelivery"""
+
+    assert eventStore.begin("evt_1")
+    eventStore.finish("evt_1", success=False, error="MERGE FAILED")
+
+    assert not eventStore.isProcessed("evt_1")
+    assert eventStore.begin("evt_1")
+
+def test_event_in_progress_is_not_taken_twice(eventStore):
+    """Tests that a second worker does not pick up an event another worker is still processing"""
+
+    assert eventStore.begin("evt_1")
+    assert not eventStore.begin("evt_1")
+
+def test_state_is_shared_between_workers(tmp_path):
+    """Tests that a second store on the same file (another gunicorn worker) sees the processed event"""
+
+    path = str(tmp_path / "events.sqlite3")
+    Event_Store(path=path).begin("evt_1")
+    Event_Store(path=path).finish("evt_1", success=True)
+
+    otherWorker = Event_Store(path=path)
+    assert otherWorker.isProcessed("evt_1")
+    assert "evt_1" in otherWorker._processed
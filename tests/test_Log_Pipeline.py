@@ -0,0 +1,70 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import json
+import logging
+from utils.Log_Pipeline import Log_Pipeline, _Listener, fields
+
+
+def pipelineLogger(name: str, pipeline: Log_Pipeline) -> logging.Logger:
+    logger = logging.getLogger(f"test_log_pipeline.{name}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    pipeline.install(logger)
+    return logger
+
+def readLines(path) -> list[dict]:
+    with open(path, "r") as logFile:
+        return [json.loads(line) for line in logFile]
+
+
+def test_records_are_written_as_json_lines(tmp_path):
+    """Tests that the logging thread writes the message, category, fields and traceback as one JSON line"""
+
+    pipeline = Log_Pipeline(path=str(tmp_path / "app.log"))
+    logger = pipelineLogger("json", pipeline)
+    logger.info("MERGE SUCCESS", extra=fields("caspio", customerID="cus_1", payload={"Status": "active"}))
+    try:
+        raise RuntimeError("Caspio is down")
+    except RuntimeError:
+        logger.exception("UPDATE FAILED")
+    pipeline.stop()
+
+    merged, failed = readLines(tmp_path / "app.log")
+    assert (merged["message"], merged["category"], merged["customerID"], merged["payload"]) == ("MERGE SUCCESS", "caspio", "cus_1", {"Status": "active"})
+    assert (failed["level"], failed["category"]) == ("ERROR", "app")
+    assert "RuntimeError: Caspio is down" in failed["exception"]
+
+def test_sampling_and_levels_per_category(tmp_path):
+    """Tests that a category can be sampled or raised to a higher level, and warnings are never sampled"""
+
+    pipeline = Log_Pipeline(path=str(tmp_path / "app.log"), sampleRates={"scanner": 0}, levels={"webhook": logging.WARNING})
+    logger = pipelineLogger("sampling", pipeline)
+    for _ in range(5):
+        logger.info("Nerd", extra=fields("scanner", ip="10.0.0.1"))
+    logger.warning("Nerd", extra=fields("scanner", ip="10.0.0.2"))
+    logger.info("Duplicate event dropped", extra=fields("webhook", eventID="evt_1"))
+    logger.info("MERGE SUCCESS", extra=fields("caspio"))
+    pipeline.stop()
+
+    assert [(line["category"], line["message"]) for line in readLines(tmp_path / "app.log")] == [("scanner", "Nerd"), ("caspio", "MERGE SUCCESS")]
+    assert pipeline.stats()["sampledOut"] == 5
+
+def test_full_queue_drops_and_reports(tmp_path):
+    """Tests that records are dropped instead of blocking when the queue is full, and the next line reports them"""
+
+    pipeline = Log_Pipeline(path=str(tmp_path / "app.log"), maxQueue=2)
+    logger = pipelineLogger("drops", pipeline)
+    # Pretend the logging thread is stuck so nothing leaves the queue.
+    pipeline.start()
+    pipeline._listener.stop()
+    for number in range(5):
+        logger.info(f"record {number}")
+    assert pipeline.stats() == {"queued": 2, "dropped": 3, "sampledOut": 0}
+
+    pipeline._listener = _Listener(pipeline, pipeline._output())
+    pipeline._listener.start()
+    pipeline.stop()
+    lines = readLines(tmp_path / "app.log")
+    assert (lines[0]["category"], lines[0]["dropped"]) == ("logging", 3)
+    assert [line["message"] for line in lines[1:]] == ["record 0", "record 1"]
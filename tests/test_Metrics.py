@@ -0,0 +1,97 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import os
+import json
+import asyncio
+import pytest
+from utils.Metrics import Metrics
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    return Metrics(path=str(tmp_path / "metrics"), flushInterval=3600, buckets=(0.1, 1.0))
+
+
+def test_counters_and_histograms_render(metrics):
+    """Tests the Prometheus text of a counter and a cumulative histogram"""
+
+    metrics.inc("caspio_writes_total", operation="merge", outcome="success")
+    metrics.inc("caspio_writes_total", operation="merge", outcome="success")
+    metrics.observe("stripe_get_seconds", 0.05, resource="v1/subscriptions")
+    metrics.observe("stripe_get_seconds", 0.5, resource="v1/subscriptions")
+    text = metrics.render()
+
+    assert 'caspio_writes_total{operation="merge",outcome="success"} 2' in text
+    assert 'stripe_get_seconds_bucket{resource="v1/subscriptions",le="0.1"} 1' in text
+    assert 'stripe_get_seconds_bucket{resource="v1/subscriptions",le="+Inf"} 2' in text
+    assert 'stripe_get_seconds_count{resource="v1/subscriptions"} 2' in text
+
+def test_large_counters_render_exactly(metrics):
+    """Tests that counters past a million keep every digit, so rate() sees each increase"""
+
+    metrics.inc("webhook_events_received_total", amount=1234567)
+    metrics.inc("webhook_events_received_total")
+    metrics.observe("stripe_get_seconds", 0.25)
+    text = metrics.render()
+
+    assert "webhook_events_received_total 1234568\n" in text
+    assert "stripe_get_seconds_sum 0.25\n" in text
+
+def test_render_sums_every_worker_file(metrics):
+    """Tests that the files written by other workers are added to this process's totals"""
+
+    metrics.inc("http_requests_total", route="/queue")
+    os.makedirs(metrics.path)
+    with open(os.path.join(metrics.path, "999-1.json"), "w") as otherWorker:
+        json.dump(metrics._snapshot(), otherWorker)
+    metrics.inc("http_requests_total", route="/queue")
+
+    assert 'http_requests_total{route="/queue"} 3' in metrics.render()
+
+def test_timed_records_failures_too(metrics):
+    """Tests that the decorator observes calls that raise"""
+
+    @metrics.timed("caspio_call_seconds", operation="get")
+    def failing():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        failing()
+    assert 'caspio_call_seconds_count{operation="get"} 1' in metrics.render()
+
+def test_timed_coroutine_observes_the_await(metrics):
+    """Tests that an async function is timed until it returns, not until the coroutine is created"""
+
+    @metrics.timed("caspio_call_seconds", operation="get")
+    async def slow():
+        await asyncio.sleep(0.2)
+        return "done"
+
+    assert asyncio.run(slow()) == "done"
+    text = metrics.render()
+    assert 'caspio_call_seconds_bucket{operation="get",le="0.1"} 0' in text
+    assert 'caspio_call_seconds_count{operation="get"} 1' in text
+
+def test_disabled_metrics_record_nothing(tmp_path):
+    """Tests that a disabled registry writes no files"""
+
+    metrics = Metrics(path=str(tmp_path / "metrics"), enabled=False)
+    metrics.inc("http_requests_total")
+    metrics.observe("http_request_seconds", 0.1)
+    metrics.flush()
+    assert not os.path.exists(metrics.path)
+
+def test_files_of_exited_workers_are_folded(metrics):
+    """Tests that the file of an exited worker is added to the exited file once and deleted, the totals unchanged"""
+
+    metrics.inc("http_requests_total", route="/queue")
+    os.makedirs(metrics.path)
+    exitedWorker = os.path.join(metrics.path, "999999999-1.json")
+    with open(exitedWorker, "w") as otherWorker:
+        json.dump(metrics._snapshot(), otherWorker)
+
+    assert 'http_requests_total{route="/queue"} 2' in metrics.render()
+    assert not os.path.exists(exitedWorker)
+    assert 'http_requests_total{route="/queue"} 2' in metrics.render()
+    assert sorted(fileName for fileName in os.listdir(metrics.path) if fileName.endswith(".json")) == sorted([Metrics.EXITED_FILE, metrics._fileName])
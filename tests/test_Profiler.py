@@ -0,0 +1,74 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import os
+import json
+import time
+import pytest
+from utils.Profiler import Profiler
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    return Profiler(path=str(tmp_path / "profiles"), threshold=0.05, stackInterval=0.005, enabled=True)
+
+def dumps(profiler, extension=".json"):
+    if not os.path.exists(profiler.path):
+        return []
+    return sorted(fileName for fileName in os.listdir(profiler.path) if fileName.endswith(extension))
+
+
+def test_slow_request_dumps_phase_breakdown(profiler):
+    """Tests that a request above the threshold is written with its phases and sampled stacks"""
+
+    profiler.begin("POST /test/titlePro/subscriptions")
+    with profiler.phase("verify"):
+        pass
+    with profiler.phase("caspio.GET"):
+        time.sleep(0.1)
+    profiler.end(status=200)
+
+    [dump] = dumps(profiler)
+    with open(os.path.join(profiler.path, dump), "r") as dumpFile:
+        report = json.load(dumpFile)
+    assert report["phases"]["caspio.GET"]["seconds"] >= 0.1
+    assert report["phases"]["verify"]["count"] == 1
+    assert report["status"] == 200
+    assert any("sleep" in stack or "test_slow_request" in stack for stack in report["stacks"])
+
+def test_fast_request_is_not_dumped(profiler):
+    """Tests that requests under the threshold leave nothing behind"""
+
+    with profiler.trace("GET /queue"):
+        with profiler.phase("caspio.GET"):
+            pass
+    assert dumps(profiler) == []
+
+def test_sampled_request_gets_a_cprofile(profiler):
+    """Tests that a sampled request is dumped with a .prof file even when fast"""
+
+    profiler.sampleRate = 1.0
+    with profiler.trace("GET /queue"):
+        sum(range(1000))
+    assert len(dumps(profiler)) == 1
+    assert len(dumps(profiler, ".prof")) == 1
+
+def test_dumps_are_rotated(profiler):
+    """Tests that only the newest maxFiles dumps are kept"""
+
+    profiler.threshold = 0
+    profiler.maxFiles = 3
+    for _ in range(5):
+        with profiler.trace("GET /queue"):
+            time.sleep(0.001)
+    assert len(dumps(profiler)) == 3
+
+def test_disabled_profiler_is_a_no_op(tmp_path):
+    """Tests that nothing is traced or written when the profiler is off"""
+
+    profiler = Profiler(path=str(tmp_path / "profiles"), threshold=0)
+    with profiler.trace("GET /queue"):
+        with profiler.phase("caspio.GET"):
+            pass
+    assert getattr(profiler._local, "trace", None) is None
+    assert not os.path.exists(profiler.path)
@@ -0,0 +1,60 @@
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+from unittest.mock import patch
+from utils.Stripe_API import Stripe_API
+
+
+def invoice(lines, **fields):
+    invoiceObject = {
+        "id": "in_1",
+        "subscription": "sub_1",
+        "paid": True,
+        "billing_reason": "subscription_cycle",
+        "lines": {"has_more": False, "data": lines}
+    }
+    invoiceObject.update(fields)
+    return invoiceObject
+
+def line(quantity, **fields):
+    lineItem = {"type": "subscription", "subscription": "sub_1", "quantity": quantity, "proration": False}
+    lineItem.update(fields)
+    return lineItem
+
+
+def test_subscription_read_from_invoice_lines():
+    """Tests that the quantity comes from the invoice's subscription line and no status is made up"""
+
+    assert Stripe_API.subscriptionFromInvoice(invoice([line(4)])) == {"id": "sub_1", "quantity": 4}
+
+def test_proration_lines_are_ignored():
+    """Tests that proration lines of a subscription update do not count as the subscription quantity"""
+
+    lines = [line(2, proration=True), line(6), line(4, type="invoiceitem")]
+    assert Stripe_API.subscriptionFromInvoice(invoice(lines, billing_reason="subscription_update"))["quantity"] == 6
+
+def test_ambiguous_invoices_fall_back():
+    """Tests that truncated, multi item, unpaid, new or non subscription invoices are left to the Stripe API"""
+
+    truncated = invoice([line(4)])
+    truncated["lines"]["has_more"] = True
+    assert Stripe_API.subscriptionFromInvoice(truncated) is None
+    assert Stripe_API.subscriptionFromInvoice(invoice([line(4), line(2)])) is None
+    assert Stripe_API.subscriptionFromInvoice(invoice([line(4)], paid=False)) is None
+    assert Stripe_API.subscriptionFromInvoice(invoice([line(4)], billing_reason="manual")) is None
+    assert Stripe_API.subscriptionFromInvoice(invoice([line(4)], billing_reason="subscription_create")) is None
+    assert Stripe_API.subscriptionFromInvoice(invoice([])) is None
+
+def test_iterSubscriptions_follows_pagination():
+    """Tests that every page is requested with starting_after set to the last subscription of the previous page"""
+
+    pages = [
+        {"data": [{"id": "sub_1"}, {"id": "sub_2"}], "has_more": True},
+        {"data": [{"id": "sub_3"}], "has_more": False}
+    ]
+    stripeAPI = Stripe_API(secretKey="sk_test")
+    with patch.object(stripeAPI, "get", side_effect=pages) as mock_get:
+        subscriptions = list(stripeAPI.iterSubscriptions(limit=2))
+
+    assert [subscription["id"] for subscription in subscriptions] == ["sub_1", "sub_2", "sub_3"]
+    assert "starting_after" not in mock_get.call_args_list[0].args[0]
+    assert "starting_after=sub_2" in mock_get.call_args_list[1].args[0]
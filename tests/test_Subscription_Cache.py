@@ -0,0 +1,61 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import time
+import pytest
+from utils.Subscription_Cache import Subscription_Cache
+
+
+class MockStripe:
+    def __init__(self, quantity=5):
+        self.quantity = quantity
+        self.calls = 0
+
+    def __call__(self, subscriptionID):
+        self.calls += 1
+        return {"id": subscriptionID, "customer": "cus_1", "status": "active", "quantity": self.quantity}
+
+@pytest.fixture
+def cache(tmp_path):
+    return Subscription_Cache(path=str(tmp_path / "subscriptions.sqlite3"), ttl=60, staleWhileRevalidate=600)
+
+
+def test_event_write_through_skips_stripe(cache):
+    """Tests that a subscription written by a customer.subscription.updated event is served without a Stripe call"""
+
+    stripe = MockStripe()
+    cache.put({"id": "sub_1", "customer": "cus_1", "status": "active", "quantity": 3}, created=100)
+
+    assert cache.get("sub_1", stripe)["quantity"] == 3
+    assert stripe.calls == 0
+
+def test_older_event_does_not_overwrite_newer(cache):
+    """Tests that events arriving out of order keep the state of the newest event"""
+
+    cache.put({"id": "sub_1", "status": "canceled", "quantity": 3}, created=200)
+    cache.put({"id": "sub_1", "status": "active", "quantity": 3}, created=100)
+
+    assert cache.get("sub_1", MockStripe())["status"] == "canceled"
+
+def test_missing_entry_is_fetched_and_cached(cache):
+    """Tests that a cache miss calls Stripe once and caches the result"""
+
+    stripe = MockStripe(quantity=7)
+    assert cache.get("sub_1", stripe)["quantity"] == 7
+    assert cache.get("sub_1", stripe)["quantity"] == 7
+    assert stripe.calls == 1
+
+def test_stale_entry_is_served_while_revalidating(cache):
+    """Tests that a stale entry is returned right away and refreshed in the background"""
+
+    stripe = MockStripe(quantity=9)
+    cache.put({"id": "sub_1", "status": "active", "quantity": 3}, created=100)
+    cache._connection().execute("UPDATE subscriptions SET cachedAt=?", (time.time() - 120,))
+
+    assert cache.get("sub_1", stripe)["quantity"] == 3
+    for _ in range(100):
+        if cache._read("sub_1")[0]["quantity"] == 9:
+            break
+        time.sleep(0.01)
+    assert cache.get("sub_1", stripe)["quantity"] == 9
+    assert stripe.calls == 1
@@ -0,0 +1,60 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import time
+import pytest
+from utils.Token_Manager import Token_Manager
+
+
+class MockTokenEndpoint:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, refreshToken):
+        self.calls += 1
+        return {"access_token": f"token{self.calls}", "expires_in": 86399}
+
+@pytest.fixture
+def endpoint():
+    return MockTokenEndpoint()
+
+def makeManager(path, endpoint, **kwargs):
+    manager = Token_Manager(path=path, fetchTokens=endpoint, accessToken="token0", refreshToken="refresh", **kwargs)
+    manager.start = lambda: None
+    return manager
+
+
+def test_other_worker_adopts_refreshed_token(tmp_path, endpoint):
+    """Tests that after one worker refreshes, another worker uses the new token without refreshing"""
+
+    path = str(tmp_path / "tokens.json")
+    workerA = makeManager(path, endpoint)
+    workerB = makeManager(path, endpoint)
+
+    assert workerA.refresh(staleToken="token0") == "token1"
+    assert workerB.accessToken() == "token1"
+    assert workerB.refresh(staleToken="token0") == "token1"
+    assert endpoint.calls == 1
+
+def test_token_is_refreshed_before_expiry(tmp_path, endpoint):
+    """Tests that a token inside the refresh margin is refreshed before it is used"""
+
+    manager = makeManager(str(tmp_path / "tokens.json"), endpoint, refreshMargin=300)
+    manager.refresh()
+    manager._expiresAt = time.time() + 60
+
+    assert manager.accessToken() == "token2"
+    assert endpoint.calls == 2
+
+def test_tokens_are_persisted_in_background(tmp_path, endpoint):
+    """Tests that the persist callback receives the new tokens"""
+
+    persisted = []
+    manager = makeManager(str(tmp_path / "tokens.json"), endpoint, persist=persisted.append)
+    manager.refresh()
+    for _ in range(50):
+        if persisted:
+            break
+        time.sleep(0.01)
+
+    assert persisted == [{"bearerAccessToken": "token1", "refreshToken": "refresh"}]
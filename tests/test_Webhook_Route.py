@@ -0,0 +1,37 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+from functools import partial
+from utils.Webhook_Route import Webhook_Route
+from utils.Webhook_Verifier import Webhook_Verifier
+
+
+def update(subscriptionObject, endpoint, caspioAPI):
+    return (subscriptionObject['customer'], endpoint, caspioAPI)
+
+route = Webhook_Route(
+    product="TitlePro",
+    environment="Dev",
+    endpoint="/v2/tables/TitlePro_PaymentLogs/records",
+    stripeAPI=None,
+    verifier=Webhook_Verifier("whsec_test"),
+    handlers={'customer.subscription.updated': partial(update, endpoint="/v2/tables/TitlePro_PaymentLogs/records", caspioAPI="caspio")}
+)
+
+
+def test_dispatch_uses_bound_arguments():
+    """Tests that a handler only needs the event's data.object"""
+
+    assert route.handler('customer.subscription.updated')({"customer": "cus_1"}) == ("cus_1", "/v2/tables/TitlePro_PaymentLogs/records", "caspio")
+    assert route.handler('customer.subscription.updated', route.endpoint) is route.handlers['customer.subscription.updated']
+
+def test_unhandled_event_type():
+    """Tests that event types without a handler are ignored"""
+
+    assert route.handler('charge.refunded') is None
+
+def test_endpoint_override():
+    """Tests that a queued job keeps writing to the table it was queued for"""
+
+    handler = route.handler('customer.subscription.updated', "/v2/tables/Old_PaymentLogs/records")
+    assert handler({"customer": "cus_1"})[1] == "/v2/tables/Old_PaymentLogs/records"
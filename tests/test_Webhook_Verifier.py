@@ -0,0 +1,62 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import hmac
+import json
+import time
+import hashlib
+import pytest
+import stripe
+from utils.Webhook_Verifier import Webhook_Verifier
+
+secret = "whsec_test"
+
+
+def signed(event, timestamp=None, signingSecret=secret):
+    payload = json.dumps(event).encode("utf-8")
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(signingSecret.encode("utf-8"), f"{timestamp}.".encode("utf-8") + payload, hashlib.sha256).hexdigest()
+    return payload, f"t={timestamp},v1={signature}"
+
+event = {"id": "evt_1", "type": "invoice.paid", "created": 1, "data": {"object": {"id": "in_1", "customer": "cus_1"}}}
+
+
+def test_valid_event_matches_construct_event():
+    """Tests that a correctly signed event reads the same as stripe.Webhook.construct_event"""
+
+    payload, header = signed(event)
+    verified = Webhook_Verifier(secret).verify(payload, header)
+    constructed = stripe.Webhook.construct_event(payload, header, secret)
+
+    assert verified['id'] == constructed['id']
+    assert verified['data']['object']['customer'] == constructed['data']['object']['customer']
+
+def test_id_is_read_without_parsing():
+    """Tests that the event id of a duplicate is available before the body is parsed"""
+
+    payload, header = signed(event)
+    verified = Webhook_Verifier(secret).verify(payload, header)
+
+    assert verified.id == "evt_1"
+    assert verified._data is None
+    assert verified['type'] == "invoice.paid"
+
+@pytest.mark.parametrize("header", [
+    "garbage",
+    "t=1",
+    signed(event, signingSecret="whsec_other")[1],
+    signed(event, timestamp=int(time.time()) - 3600)[1]
+])
+def test_bad_signatures_are_rejected(header):
+    """Tests malformed headers, other secrets and replayed old signatures"""
+
+    payload, _ = signed(event)
+    with pytest.raises(stripe.error.SignatureVerificationError):
+        Webhook_Verifier(secret).verify(payload, header)
+
+def test_oversized_payload_is_rejected_before_hmac():
+    """Tests that a body above maxPayloadBytes is refused as an invalid payload"""
+
+    payload, header = signed({**event, "padding": "x" * 2048})
+    with pytest.raises(ValueError):
+        Webhook_Verifier(secret, maxPayloadBytes=1024).verify(payload, header)
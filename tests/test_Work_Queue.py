@@ -0,0 +1,87 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import time
+import pytest
+from utils.Work_Queue import Work_Queue
+
+
+@pytest.fixture
+def handled():
+    return []
+
+@pytest.fixture
+def workQueue(tmp_path, handled):
+    return Work_Queue(path=str(tmp_path / "queue.sqlite3"), handler=handled.append, workers=0, maxAttempts=2)
+
+
+def test_job_is_handled_and_removed(workQueue, handled):
+    """Tests that a queued job reaches the handler and leaves the queue once it succeeds"""
+
+    workQueue.enqueue({"event": "evt_1"})
+    assert workQueue.depth()["pending"] == 1
+
+    assert workQueue.runOnce()
+    assert handled == [{"event": "evt_1"}]
+    assert workQueue.depth()["pending"] == 0
+    assert not workQueue.runOnce()
+
+def test_failed_job_is_retried_then_parked(tmp_path):
+    """Tests that a failing job is rescheduled with backoff and parked as failed after maxAttempts"""
+
+    def failingHandler(job):
+        raise RuntimeError("Caspio is down")
+
+    workQueue = Work_Queue(path=str(tmp_path / "queue.sqlite3"), handler=failingHandler, workers=0, maxAttempts=2)
+    jobID = workQueue.enqueue({"event": "evt_1"})
+
+    assert workQueue.runOnce()
+    assert workQueue.depth()["pending"] == 1
+    workQueue._connection().execute("UPDATE jobs SET availableAt=0 WHERE id=?", (jobID,))
+    assert workQueue.runOnce()
+    assert workQueue.depth()["failed"] == 1
+
+def test_expired_lease_is_reclaimed(workQueue, handled):
+    """Tests that a job left running by a dead worker is picked up again once its lease runs out"""
+
+    jobID = workQueue.enqueue({"event": "evt_1"})
+    assert workQueue._claim()[0][0] == jobID
+    assert workQueue._claim() == []
+
+    workQueue._connection().execute("UPDATE jobs SET leasedUntil=? WHERE id=?", (time.time() - 1, jobID))
+    assert workQueue.runOnce()
+    assert handled == [{"event": "evt_1"}]
+
+def test_jobs_with_the_same_key_are_claimed_together(tmp_path):
+    """Tests that jobs sharing a key are handed to the batch handler as one batch once the first one is due"""
+
+    batches = []
+    workQueue = Work_Queue(path=str(tmp_path / "queue.sqlite3"), handler=None, batchHandler=batches.append, workers=0)
+    workQueue.enqueue({"event": "evt_1"}, key="cus_1")
+    workQueue.enqueue({"event": "evt_2"}, key="cus_2")
+    workQueue.enqueue({"event": "evt_3"}, key="cus_1", delay=60)
+
+    assert workQueue.runOnce()
+    assert workQueue.runOnce()
+    assert not workQueue.runOnce()
+    assert batches == [[{"event": "evt_1"}, {"event": "evt_3"}], [{"event": "evt_2"}]]
+
+def test_delayed_job_waits_for_its_window(workQueue, handled):
+    """Tests that a job enqueued with a delay is not run before the delay is over"""
+
+    workQueue.enqueue({"event": "evt_1"}, delay=60)
+    assert not workQueue.runOnce()
+    assert handled == []
+
+def test_backing_off_job_is_not_claimed_with_a_batch(tmp_path):
+    """Tests that a job waiting out its retry delay is left alone when a newer job with the same key is claimed"""
+
+    batches = []
+    workQueue = Work_Queue(path=str(tmp_path / "queue.sqlite3"), handler=None, batchHandler=batches.append, workers=0)
+    failedID = workQueue.enqueue({"event": "evt_1"}, key="cus_1")
+    workQueue._connection().execute("UPDATE jobs SET attempts=1, availableAt=? WHERE id=?", (time.time() + 60, failedID))
+    workQueue.enqueue({"event": "evt_2"}, key="cus_1")
+
+    assert workQueue.runOnce()
+    assert batches == [[{"event": "evt_2"}]]
+    assert workQueue.depth()["pending"] == 1
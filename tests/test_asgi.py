@@ -0,0 +1,209 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import json
+import time
+import uuid
+import asyncio
+import httpx
+import pytest
+from emulator import Emulator
+from benchmark import buildEvent, signatureHeader
+from utils.Caspio_API import Caspio_API, NoUsersToUpdate
+from utils.Caspio_Index import Caspio_Index
+from utils.Retry_Policy import Retry_Policy
+from utils.Circuit_Breaker import Circuit_Breaker
+from utils.Stripe_API import Stripe_API
+from utils.Async_Caspio_API import Async_Caspio_API
+from utils.Async_Stripe_API import Async_Stripe_API
+from tests.test_emulator import serve
+
+table = "Python_DP_PaymentLogs"
+endpoint = f"/v2/tables/{table}/records"
+
+
+def emulatedCaspio(tmp_path, baseURL, name, upsertMode=False):
+    api = Caspio_API()
+    api._apiURL = f"{baseURL}/caspio"
+    api._accessTokenURL = f"{baseURL}/caspio/oauth/token"
+    api._index = Caspio_Index(path=str(tmp_path / f"{name}_index.sqlite3"))
+    api._tokens.path = str(tmp_path / f"{name}_tokens.json")
+    api._tokens.persist = None
+    api._retryPolicy = Retry_Policy(maxAttempts=10, baseDelay=0, maxDelay=0)
+    api._upsertMode = upsertMode
+    api._breaker = Circuit_Breaker(name="caspio", enabled=False)
+    return api
+
+@pytest.fixture
+def emulators(request):
+    faults = getattr(request, "param", {})
+    emulated = [Emulator(rows=20, seed=3, **faults) for _ in range(2)]
+    servers = [serve(emulator) for emulator in emulated]
+    yield [(emulator, baseURL) for emulator, (_, baseURL) in zip(emulated, servers)]
+    for server, _ in servers:
+        server.shutdown()
+
+
+@pytest.mark.parametrize("emulators", [{"rate401": 0.1, "rate5xx": 0.1}], indirect=True)
+@pytest.mark.parametrize("upsertMode", [False, True])
+def test_async_caspio_matches_sync(tmp_path, emulators, upsertMode):
+    """Tests that the same writes through Caspio_API and Async_Caspio_API leave identical tables"""
+
+    (syncEmulator, syncURL), (asyncEmulator, asyncURL) = emulators
+    syncAPI = emulatedCaspio(tmp_path, syncURL, "sync", upsertMode)
+    asyncAPI = Async_Caspio_API(emulatedCaspio(tmp_path, asyncURL, "async", upsertMode))
+    writes = [
+        ("mergeUser", {"data": {"CustomerID": "cus_4", "UnitsPurchased": 40}, "endpoint": endpoint}),
+        ("mergeUser", {"data": {"CustomerID": "cus_new", "UnitsPurchased": 2}, "endpoint": endpoint}),
+        ("updateUser", {"customerID": "cus_new", "data": {"Status": "canceled"}, "endpoint": endpoint}),
+        ("updateUser", {"customerID": "cus_4", "data": {"EndDate": "01/31/2030"}, "endpoint": endpoint})
+    ]
+
+    async def runAsync():
+        return [(await getattr(asyncAPI, method)(**kwargs)).status_code for method, kwargs in writes]
+
+    syncStatuses = [getattr(syncAPI, method)(**kwargs).status_code for method, kwargs in writes]
+    assert asyncio.run(runAsync()) == syncStatuses
+    assert syncEmulator.tables[table] == asyncEmulator.tables[table]
+
+    with pytest.raises(NoUsersToUpdate):
+        syncAPI.updateUser("cus_missing", {"Status": "canceled"}, endpoint)
+    with pytest.raises(NoUsersToUpdate):
+        asyncio.run(asyncAPI.updateUser("cus_missing", {"Status": "canceled"}, endpoint))
+
+def test_upsert_404_is_no_record(tmp_path, emulators, monkeypatch):
+    """Tests that a 404 to the upsert PUT creates the record in mergeUser and raises NoUsersToUpdate in updateUser"""
+
+    (syncEmulator, syncURL), (asyncEmulator, asyncURL) = emulators
+    syncAPI = emulatedCaspio(tmp_path, syncURL, "sync", upsertMode=True)
+    asyncAPI = Async_Caspio_API(emulatedCaspio(tmp_path, asyncURL, "async", upsertMode=True))
+    notFound = httpx.Response(404, json={"Message": "No records match the where clause"})
+
+    async def asyncNotFound(*args, **kwargs):
+        return notFound
+
+    monkeypatch.setattr(syncAPI, "put", lambda *args, **kwargs: notFound)
+    monkeypatch.setattr(asyncAPI, "put", asyncNotFound)
+    data = {"CustomerID": "cus_new", "UnitsPurchased": 2}
+
+    assert syncAPI.mergeUser(data, endpoint).status_code in {200, 201}
+    assert asyncio.run(asyncAPI.mergeUser(data, endpoint)).status_code in {200, 201}
+    for emulator in (syncEmulator, asyncEmulator):
+        assert [row["UnitsPurchased"] for row in emulator.tables[table].values() if row["CustomerID"] == "cus_new"] == [2]
+    with pytest.raises(NoUsersToUpdate):
+        syncAPI.updateUser("cus_new", {"Status": "canceled"}, endpoint)
+    with pytest.raises(NoUsersToUpdate):
+        asyncio.run(asyncAPI.updateUser("cus_new", {"Status": "canceled"}, endpoint))
+
+def test_async_stripe_matches_sync(emulators):
+    """Tests that Async_Stripe_API reads the same objects as Stripe_API"""
+
+    _, (_, baseURL) = emulators
+    syncAPI, asyncAPI = Stripe_API(secretKey="sk_test"), Async_Stripe_API(secretKey="sk_test")
+    syncAPI._apiURL = asyncAPI._apiURL = f"{baseURL}/stripe"
+
+    async def fetch():
+        return await asyncAPI.getSubscriptionObject("sub_7"), await asyncAPI.getInvoiceObject("in_7")
+
+    assert asyncio.run(fetch()) == (syncAPI.getSubscriptionObject("sub_7"), syncAPI.getInvoiceObject("in_7"))
+
+def test_invoice_lines_create_the_row_with_its_status(tmp_path, emulators, monkeypatch):
+    """Tests that in invoiceLineItemMode a customer without a Caspio row gets the status from Stripe, a known one no Stripe call"""
+
+    asgi = pytest.importorskip("asgi")
+    main = pytest.importorskip("main")
+    for module in (main, asgi):
+        monkeypatch.setattr(module, "invoiceLineItemMode", True)
+    monkeypatch.setattr(main, "caspioSpool", None)
+    monkeypatch.setattr(main, "deadLetters", None)
+
+    def invoice(number):
+        event = buildEvent("invoice.paid", number)
+        event["data"]["object"].update({"customer": f"cus_{number}", "subscription": f"sub_{number}"})
+        event["data"]["object"]["lines"]["data"][0].update({"subscription": f"sub_{number}", "quantity": 30})
+        return event["data"]["object"]
+
+    (syncEmulator, syncURL), (asyncEmulator, asyncURL) = emulators
+    syncStripe, asyncStripe = Stripe_API(secretKey="sk_test"), Async_Stripe_API(secretKey="sk_test")
+    syncStripe._apiURL, asyncStripe._apiURL = f"{syncURL}/stripe", f"{asyncURL}/stripe"
+    asyncCaspio = Async_Caspio_API(emulatedCaspio(tmp_path, asyncURL, "async"))
+    syncCaspio = emulatedCaspio(tmp_path, syncURL, "sync")
+    for emulator in (syncEmulator, asyncEmulator):
+        emulator.tables[table] = {pkID: row for pkID, row in emulator.tables[table].items() if row["CustomerID"] != "cus_7"}
+
+    for number in (7, 8):
+        assert main.invoice_paid(invoice(number), endpoint, "UnitsPurchased", syncStripe, syncCaspio)
+        assert asyncio.run(asgi.invoice_paid(invoice(number), endpoint, "UnitsPurchased", asyncStripe, asyncCaspio))
+
+    for emulator in (syncEmulator, asyncEmulator):
+        rows = {row["CustomerID"]: row for row in emulator.tables[table].values()}
+        subscription = emulator.subscriptions["sub_7"]
+        assert (rows["cus_7"]["UnitsPurchased"], rows["cus_7"]["Status"]) == (subscription["quantity"], subscription["status"])
+        assert rows["cus_8"]["UnitsPurchased"] == 30
+        assert emulator.stats["stripe.subscriptions.get"] == 1
+
+def test_asgi_routes(tmp_path, emulators, monkeypatch):
+    """Tests a signed event, a bad signature and an unknown url through the ASGI app"""
+
+    asgi = pytest.importorskip("asgi")
+    (emulator, baseURL), _ = emulators
+    caspioAPI = emulatedCaspio(tmp_path, baseURL, "asgi")
+    for name in ("_apiURL", "_accessTokenURL", "_index", "_tokens", "_retryPolicy", "_upsertMode", "_breaker"):
+        monkeypatch.setattr(asgi.caspioAPI, name, getattr(caspioAPI, name))
+    if asgi.workQueue is not None:
+        pytest.skip("webhookQueueMode processes events in the work queue")
+
+    event = buildEvent("customer.subscription.updated", 0)
+    event["id"] = f"evt_{uuid.uuid4().hex}"
+    event["data"]["object"].update({"customer": "cus_9", "cancel_at": None})
+    payload = json.dumps(event).encode("utf-8")
+    secret = asgi.asyncRoutes[("DispositionPro", "Dev")].verifier.secret
+
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi.app), base_url="http://asgi") as client:
+            accepted = await client.post("/test/dispositionPro/subscriptions", content=payload, headers={"Stripe-Signature": signatureHeader(payload, secret)})
+            rejected = await client.post("/test/dispositionPro/subscriptions", content=payload, headers={"Stripe-Signature": signatureHeader(payload, "whsec_other")})
+            unknown = await client.get("/wp-login.php")
+        return accepted, rejected, unknown
+
+    accepted, rejected, unknown = asyncio.run(post())
+    assert (accepted.status_code, accepted.json()["message"]) == (200, "Webhook Accepted")
+    assert (rejected.status_code, rejected.json()["message"]) == (400, "Invalid signature")
+    assert unknown.status_code == 404
+    assert emulator.tables[table][10]["EndDate"] == ""
+
+def test_blocking_state_stays_off_the_event_loop(tmp_path, emulators):
+    """Tests that a slow CustomerID index and token store (SQLite and file locks) do not stall other coroutines"""
+
+    (_, baseURL), _ = emulators
+    syncAPI = emulatedCaspio(tmp_path, baseURL, "slow")
+    asyncAPI = Async_Caspio_API(syncAPI)
+    indexGet, accessToken = syncAPI._index.get, syncAPI._tokens.accessToken
+
+    def slowIndexGet(*args):
+        time.sleep(0.3)
+        return indexGet(*args)
+
+    def slowAccessToken():
+        time.sleep(0.1)
+        return accessToken()
+
+    syncAPI._index.get, syncAPI._tokens.accessToken = slowIndexGet, slowAccessToken
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        response = await asyncAPI.updateUser("cus_4", {"EndDate": ""}, endpoint)
+        task.cancel()
+        return response.status_code, ticks
+
+    status, ticks = asyncio.run(run())
+    assert status == 200
+    assert ticks >= 20
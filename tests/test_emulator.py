@@ -0,0 +1,83 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import json
+import threading
+import pytest
+from werkzeug.serving import make_server
+from emulator import Emulator, parseWhere
+from utils.Caspio_API import Caspio_API
+from utils.Caspio_Index import Caspio_Index
+from utils.Retry_Policy import Retry_Policy
+from utils.Circuit_Breaker import Circuit_Breaker
+from utils.Stripe_API import Stripe_API
+
+endpoint = "/v2/tables/Python_DP_PaymentLogs/records"
+
+
+def serve(emulator):
+    server = make_server("127.0.0.1", 0, emulator.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+@pytest.fixture
+def emulated(tmp_path, request):
+    emulator = Emulator(rows=30, seed=1, **getattr(request, "param", {}))
+    server, baseURL = serve(emulator)
+    api = Caspio_API()
+    api._apiURL = f"{baseURL}/caspio"
+    api._accessTokenURL = f"{baseURL}/caspio/oauth/token"
+    api._index = Caspio_Index(path=str(tmp_path / "caspio_index.sqlite3"))
+    api._tokens.path = str(tmp_path / "caspio_tokens.json")
+    api._tokens.persist = None
+    api._retryPolicy = Retry_Policy(baseDelay=0, maxDelay=0)
+    api._breaker = Circuit_Breaker(name="caspio", enabled=False)
+    yield emulator, api, baseURL
+    server.shutdown()
+
+
+def test_where_subset():
+    """Tests the q.where clauses Caspio_API sends"""
+
+    record = {"PK_ID": 3, "CustomerID": "cus_o'neil"}
+    assert parseWhere("CustomerID='cus_o''neil'")(record)
+    assert parseWhere("PK_ID=3 AND CustomerID='cus_o''neil'")(record)
+    assert parseWhere("PK_ID IN (1,3,5)")(record)
+    assert not parseWhere("PK_ID IN (1,5)")(record)
+
+def test_caspio_client_against_emulator(emulated):
+    """Tests token refresh, merge, update and paging of Caspio_API without the live API"""
+
+    emulator, api, _ = emulated
+    response = api.mergeUser({"CustomerID": "cus_5", "UnitsPurchased": 99}, endpoint)
+    assert response.status_code == 200
+    assert emulator.tables["Python_DP_PaymentLogs"][6]["UnitsPurchased"] == 99
+
+    response = api.mergeUser({"CustomerID": "cus_new", "UnitsPurchased": 1}, endpoint)
+    assert response.status_code == 201
+    assert api.updateUser("cus_new", {"Status": "canceled"}, endpoint).status_code == 200
+
+    records = list(api.iterRecords(endpoint, qSelect="PK_ID,CustomerID", pageSize=7))
+    assert len(records) == 31
+    assert emulator.stats["caspio.token"] >= 1
+
+@pytest.mark.parametrize("emulated", [{"rate429": 0.3, "rate5xx": 0.2}], indirect=True)
+def test_retries_against_injected_faults(emulated):
+    """Tests that GETs survive injected 429 and 5xx responses"""
+
+    emulator, api, _ = emulated
+    api._retryPolicy = Retry_Policy(maxAttempts=20, baseDelay=0, maxDelay=0)
+    for _ in range(10):
+        assert api.get(endpoint, qLimit=1).status_code == 200
+    assert any(name.startswith("fault.") for name in emulator.stats)
+
+def test_stripe_client_against_emulator(emulated):
+    """Tests Stripe_API against the emulated subscription and invoice routes"""
+
+    _, _, baseURL = emulated
+    stripeAPI = Stripe_API(secretKey="sk_test")
+    stripeAPI._apiURL = f"{baseURL}/stripe"
+    assert stripeAPI.fetchSubscriptionObject("sub_3")["customer"] == "cus_3"
+    assert stripeAPI.getInvoiceObject("in_3")["subscription"] == "sub_3"
+    assert len(list(stripeAPI.iterSubscriptions(limit=7))) == 30
+    assert json.loads(json.dumps(next(stripeAPI.iterSubscriptions(expandCustomer=True))))["customer"]["id"] == "cus_0"
@@ -0,0 +1,94 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import io
+import copy
+import json
+import pytest
+from emulator import Emulator
+from utils.Stripe_API import Stripe_API
+from tests.test_asgi import emulatedCaspio
+from tests.test_emulator import serve
+
+reconcile = pytest.importorskip("reconcile")
+
+table = "Python_DP_PaymentLogs"
+
+
+def subscription(number, customer, status, created, quantity=5):
+    return {"id": f"sub_{number}", "object": "subscription", "customer": customer, "status": status, "quantity": quantity,
+            "created": created, "cancel_at": None, "current_period_end": 1800000000}
+
+@pytest.fixture
+def emulated(tmp_path, monkeypatch):
+    # Caspio rows of cus_0 to cus_3, Stripe subscriptions of cus_0 to cus_6
+    emulator = Emulator(rows=4, subscriptions=0, seed=5)
+    for number, status in enumerate(["active", "past_due", "active", "canceled", "active", "canceled", "incomplete_expired"]):
+        emulator.subscriptions[f"sub_{number}"] = subscription(number, f"cus_{number}", status, 1600000000 + number, quantity=number + 1)
+    for record in emulator.tables[table].values():
+        record.update({"UnitsPurchased": int(record["CustomerID"][4:]) + 1, "Status": "active", "EndDate": None})
+    server, baseURL = serve(emulator)
+
+    stripeAPI = Stripe_API(secretKey="sk_test")
+    stripeAPI._apiURL = f"{baseURL}/stripe"
+    monkeypatch.setitem(reconcile.config, "stripeDispositionProSecretKeyDev", "sk_test")
+    monkeypatch.setattr(reconcile, "getStripeAPI", lambda secretKey: stripeAPI)
+    monkeypatch.setattr(reconcile, "caspioAPI", emulatedCaspio(tmp_path, baseURL, "reconcile"))
+    yield emulator, stripeAPI
+    server.shutdown()
+
+def rows(emulator):
+    return {record["CustomerID"]: record for record in emulator.tables[table].values()}
+
+
+def test_expected_row_follows_the_best_ranked_subscription(emulated):
+    """Tests that an active subscription beats a newer canceled one, and the newest wins between equal statuses"""
+
+    emulator, stripeAPI = emulated
+    emulator.subscriptions["sub_10"] = subscription(10, "cus_0", "canceled", 1700000000, quantity=40)
+    emulator.subscriptions["sub_11"] = subscription(11, "cus_2", "active", 1700000000, quantity=30)
+    emulator.subscriptions["sub_12"] = subscription(12, "cus_3", "past_due", 1500000000, quantity=20)
+
+    expected = reconcile.expectedRows(stripeAPI, "UnitsPurchased")
+    assert expected["cus_0"]["row"] == {"Status": "active", "EndDate": "", "UnitsPurchased": 1}
+    assert expected["cus_2"]["row"]["UnitsPurchased"] == 30
+    assert expected["cus_3"]["row"]["Status"] == "past_due"
+    assert expected["cus_4"]["email"] == "cus_4@example.com"
+
+def test_diff_row_only_returns_changed_fields():
+    """Tests that quantity, Status and EndDate are compared the way Caspio returns them"""
+
+    expected = {"UnitsPurchased": 3, "Status": "active", "EndDate": "01/31/2030"}
+    assert reconcile.diffRow(expected, {"UnitsPurchased": 3, "Status": "active", "EndDate": "2030-01-31T00:00:00"}, "UnitsPurchased") == {}
+    assert reconcile.diffRow(expected, {"UnitsPurchased": 2, "Status": None, "EndDate": None}, "UnitsPurchased") == expected
+
+def test_reconcile_updates_drifted_rows_and_creates_paying_customers(emulated):
+    """Tests that drifted rows are updated and only customers the webhooks would have created are created"""
+
+    emulator, _ = emulated
+    out = io.StringIO()
+    report = reconcile.reconcile("DispositionPro", "Dev", createMissing=True, workers=2, out=out)
+
+    synced = rows(emulator)
+    assert (synced["cus_1"]["Status"], synced["cus_3"]["Status"]) == ("past_due", "canceled")
+    assert synced["cus_4"]["UnitsPurchased"] == 5 and synced["cus_4"]["Email"] == "cus_4@example.com"
+    assert "cus_5" not in synced and "cus_6" not in synced
+    assert (report["updatesPlanned"], report["missingInCaspio"], report["missingInactive"]) == (2, 1, 2)
+    assert (report["written"], report["failed"]) == (3, 0)
+    assert sorted(json.loads(line)["action"] for line in out.getvalue().splitlines()) == ["create", "update", "update"]
+
+    again = reconcile.reconcile("DispositionPro", "Dev", createMissing=True, out=io.StringIO())
+    assert (again["updatesPlanned"], again["missingInCaspio"], again["written"]) == (0, 0, 0)
+
+def test_dry_run_writes_nothing(emulated):
+    """Tests that a dry run prints the planned changes without a single Caspio write"""
+
+    emulator, _ = emulated
+    before = copy.deepcopy(emulator.tables)
+    out = io.StringIO()
+    report = reconcile.reconcile("DispositionPro", "Dev", dryRun=True, createMissing=True, out=out)
+
+    assert emulator.tables == before
+    assert not {"caspio.PUT", "caspio.POST"} & set(emulator.stats)
+    assert (report["updatesPlanned"], report["written"]) == (2, 0)
+    assert len(out.getvalue().splitlines()) == 3
@@ -0,0 +1,150 @@
+# pylint: disable=invalid-name
+# pylint: disable=protected-access
+# pylint: disable=missing-function-docstring
+import io
+import json
+import pytest
+import main
+from emulator import Emulator
+from replay import Replay, loadEvents, partition
+from utils.Event_Store import Event_Store
+from utils.Dead_Letter_Store import Dead_Letter_Store
+from utils.Work_Queue import Work_Queue
+from tests.test_asgi import emulatedCaspio
+from tests.test_emulator import serve
+
+table = "Python_DP_PaymentLogs"
+
+
+def event(number, customerID, created, cancelAt=None, eventType="customer.subscription.updated"):
+    return {
+        "id": f"evt_{number}", "object": "event", "type": eventType, "created": created,
+        "data": {"object": {"id": f"sub_{customerID}", "object": "subscription", "customer": customerID,
+                            "status": "active", "cancel_at": cancelAt}}
+    }
+
+@pytest.fixture
+def emulated(tmp_path, monkeypatch):
+    emulator = Emulator(rows=5, seed=2)
+    server, baseURL = serve(emulator)
+    caspioAPI = emulatedCaspio(tmp_path, baseURL, "replay")
+    for name in ("_apiURL", "_accessTokenURL", "_index", "_tokens", "_retryPolicy", "_upsertMode", "_breaker"):
+        monkeypatch.setattr(main.caspioAPI, name, getattr(caspioAPI, name))
+    monkeypatch.setattr(main, "eventStore", Event_Store(path=str(tmp_path / "events.sqlite3")))
+    monkeypatch.setattr(main, "caspioSpool", None)
+    monkeypatch.setattr(main, "deadLetters", None)
+    yield emulator
+    server.shutdown()
+
+def endDates(emulator):
+    return {record["CustomerID"]: record["EndDate"] for record in emulator.tables[table].values()}
+
+
+@pytest.mark.parametrize("layout", ["list", "stripeList", "jsonl"])
+def test_events_are_loaded_in_created_order(tmp_path, layout):
+    """Tests the JSON list, Stripe list object and JSONL dumps"""
+
+    events = [event(1, "cus_1", 30), event(2, "cus_2", 10), event(3, "cus_1", 20)]
+    path = tmp_path / "events.json"
+    if layout == "list":
+        path.write_text(json.dumps(events))
+    elif layout == "stripeList":
+        path.write_text(json.dumps({"object": "list", "data": events, "has_more": False}))
+    else:
+        path.write_text("\n".join(json.dumps(item) for item in events) + "\n\n")
+
+    assert [item["id"] for item in loadEvents(str(path))] == ["evt_2", "evt_3", "evt_1"]
+
+def test_partition_keeps_the_order_of_each_customer():
+    """Tests that events are grouped by customer in order, the longest chain first, events without a customer alone"""
+
+    events = [event(1, "cus_1", 1), event(2, "cus_2", 2), event(3, "cus_1", 3), event(4, "cus_1", 4), event(5, None, 5)]
+    partitions = partition(events)
+
+    assert [[item["id"] for item in events] for events in partitions] == [["evt_1", "evt_3", "evt_4"], ["evt_2"], ["evt_5"]]
+
+def test_replay_applies_each_customer_in_order(emulated):
+    """Tests that the last event of a customer wins although the events run in parallel, unhandled types count as done"""
+
+    events = [
+        event(1, "cus_1", 1, cancelAt=1900000000), event(2, "cus_2", 2, cancelAt=1900000000),
+        event(3, "cus_1", 3, cancelAt=None), event(4, "cus_3", 4, eventType="customer.created")
+    ]
+    report = Replay("DispositionPro", "Dev", out=io.StringIO()).run(events, workers=4)
+
+    assert (report["events"], report["customers"], report["failed"]) == (len(events), 3, 0)
+    dates = endDates(emulated)
+    assert (dates["cus_1"], dates["cus_2"]) == ("", "03/17/2030")
+
+def test_replayed_events_are_skipped_unless_forced(emulated):
+    """Tests that replay goes through processEvent, so an event id already applied makes no Caspio call"""
+
+    events = [event(1, "cus_1", 1, cancelAt=1900000000)]
+    assert Replay("DispositionPro", "Dev", out=io.StringIO()).run(events)["failed"] == 0
+    writes = emulated.stats["caspio.PUT"]
+
+    emulated.tables[table][2]["EndDate"] = None
+    assert Replay("DispositionPro", "Dev", out=io.StringIO()).run(events)["failed"] == 0
+    assert emulated.stats["caspio.PUT"] == writes
+    assert endDates(emulated)["cus_1"] is None
+
+    assert Replay("DispositionPro", "Dev", force=True, out=io.StringIO()).run(events)["failed"] == 0
+    assert emulated.stats["caspio.PUT"] == writes + 1
+    assert endDates(emulated)["cus_1"] == "03/17/2030"
+
+def test_queued_event_in_progress_is_retried(emulated, tmp_path):
+    """Tests that a queued event another worker left in 'processing' is retried instead of completed unapplied"""
+
+    workQueue = Work_Queue(path=str(tmp_path / "queue.sqlite3"), handler=main.processQueuedEvent,
+                           batchHandler=main.processCoalescedEvents, workers=0)
+    endpoint = main.CASPIO_ENDPOINTS[("DispositionPro", "Dev")]
+    for item in (event(1, "cus_1", 1, cancelAt=1900000000), event(2, "cus_2", 2, cancelAt=1900000000)):
+        workQueue.enqueue({"product": "DispositionPro", "environment": "Dev", "endpoint": endpoint, "event": json.dumps(item)})
+    # A worker crashed while processing evt_1, the lease of its job ran out.
+    main.eventStore.begin("evt_1")
+
+    assert workQueue.runOnce() and workQueue.runOnce()
+    assert workQueue.depth()["pending"] == 1
+    assert (endDates(emulated)["cus_1"], endDates(emulated)["cus_2"]) == (None, "03/17/2030")
+
+    main.eventStore._connection().execute("UPDATE events SET updatedAt=0 WHERE eventID='evt_1'")
+    workQueue._connection().execute("UPDATE jobs SET availableAt=0")
+    assert workQueue.runOnce()
+    assert workQueue.depth()["pending"] == 0
+    assert endDates(emulated)["cus_1"] == "03/17/2030"
+
+def test_coalesced_batch_waits_for_events_in_progress(emulated, tmp_path):
+    """Tests that a batch holding an event in progress elsewhere is retried whole, and its other events released"""
+
+    workQueue = Work_Queue(path=str(tmp_path / "queue.sqlite3"), handler=main.processQueuedEvent,
+                           batchHandler=main.processCoalescedEvents, workers=0)
+    endpoint = main.CASPIO_ENDPOINTS[("DispositionPro", "Dev")]
+    for item in (event(1, "cus_1", 1, cancelAt=None), event(2, "cus_1", 2, cancelAt=1900000000)):
+        workQueue.enqueue({"product": "DispositionPro", "environment": "Dev", "endpoint": endpoint, "event": json.dumps(item)},
+                          key=f"{endpoint}|cus_1")
+    main.eventStore.begin("evt_1")
+
+    assert workQueue.runOnce()
+    assert workQueue.depth()["pending"] == 2
+    assert endDates(emulated)["cus_1"] is None
+
+    main.eventStore._connection().execute("UPDATE events SET updatedAt=0 WHERE eventID='evt_1'")
+    workQueue._connection().execute("UPDATE jobs SET availableAt=0")
+    assert workQueue.runOnce()
+    assert workQueue.depth()["pending"] == 0
+    assert endDates(emulated)["cus_1"] == "03/17/2030"
+
+def test_update_of_an_unknown_customer_is_not_dead_lettered(emulated, tmp_path, monkeypatch):
+    """Tests that an update without a Caspio record is only logged, and a letter whose record is gone is dropped"""
+
+    deadLetters = Dead_Letter_Store(path=str(tmp_path / "dead_letters.sqlite3"), baseDelay=0, maxDelay=0)
+    monkeypatch.setattr(main, "deadLetters", deadLetters)
+    endpoint = main.CASPIO_ENDPOINTS[("DispositionPro", "Dev")]
+
+    subscription = event(1, "cus_unknown", 1)["data"]["object"]
+    assert main.customer_subscription_updated(subscription, endpoint=endpoint, caspioAPI=main.caspioAPI)
+    assert deadLetters.depth() == {"pending": 0, "running": 0, "failed": 0}
+
+    deadLetters.add("update", endpoint, {"Status": "active"}, "500", customerID="cus_unknown")
+    assert deadLetters.runOnce(main.retryDeadLetter)
+    assert deadLetters.depth() == {"pending": 0, "running": 0, "failed": 0}
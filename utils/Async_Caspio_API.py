@@ -0,0 +1,193 @@
+import time
+import json
+import asyncio
+import requests
+import httpx
+from utils.Async_HTTP_Session import Async_HTTP_Session
+from utils.Caspio_API import Caspio_API, NoUsersToUpdate
+from utils.Metrics import metrics
+
+
+class Async_Caspio_API:
+    """Coroutine version of the Caspio_API calls the webhook handlers make, over an Async_HTTP_Session.
+
+    Wraps a Caspio_API and shares its token manager, CustomerID index and retry policy, so the
+    requests, retries, circuit breaker, 401 refreshes and results are the same as the sync client's.  Token reads
+    and refreshes (token file, file lock, token request) and CustomerID index lookups (SQLite) run in a thread,
+    so a slow lock never stalls the event loop.
+    """
+
+    def __init__(self, caspioAPI: Caspio_API = None, http: Async_HTTP_Session = None):
+        """
+        Args:
+            caspioAPI (Caspio_API, optional): Sync client whose configuration and state are shared.
+            http (Async_HTTP_Session, optional): Shared pooled client, a private one by default.
+        """
+        self.caspioAPI = caspioAPI or Caspio_API()
+        self._http = http or Async_HTTP_Session()
+
+    async def _request(self, method: str, endpoint: str, params: dict = None, data: str = None) -> httpx.Response:
+        """Private Function. Sends an authorized request to the Caspio REST API, see Caspio_API._request.
+
+        Args:
+            method (str): HTTP method.
+            endpoint (str): url endpoint of the request.
+            params (dict, optional): Query parameters ex: {"q.where": "PK_ID=1"}
+            data (str, optional): JSON body.
+
+        Returns:
+            httpx.Response: Has the status_code, text and headers of a requests.Response.
+        """
+        api = self.caspioAPI
+        retryPolicy = api._retryPolicy
+        started = time.monotonic()
+        attempt = 0
+        refreshed = False
+        retryPolicy.count("requests")
+        while True:
+            attempt += 1
+            trial = api._breaker.before()
+            token = await asyncio.to_thread(api._tokens.accessToken)
+            sent = time.monotonic()
+            try:
+                response = await self._http.request(method, api._apiURL + endpoint, headers=api._headers(token), params=params, data=data)
+            except requests.RequestException as e:
+                api._breaker.record(False, time.monotonic() - sent, trial)
+                metrics.inc("caspio_responses_total", method=method, status=type(e).__name__)
+                if not retryPolicy.shouldRetry(method, attempt, started, error=e):
+                    raise
+                await asyncio.sleep(retryPolicy.delay(attempt))
+                continue
+
+            api._breaker.record(response.status_code < 500, time.monotonic() - sent, trial)
+            metrics.inc("caspio_responses_total", method=method, status=response.status_code)
+            if response.status_code == 401 and not refreshed:
+                refreshed = True
+                retryPolicy.count("retry_401")
+                await asyncio.to_thread(api._tokens.refresh, staleToken=token)
+                continue
+            if response.status_code < 400 or not retryPolicy.shouldRetry(method, attempt, started, response=response):
+                return response
+            await asyncio.sleep(retryPolicy.delay(attempt, response))
+
+    @metrics.timed("caspio_call_seconds", operation="get")
+    async def get(self, endpoint: str, qWhere: str = None, qSelect: str = None, qLimit: int = None) -> httpx.Response:
+        """Simple GET Request to Caspio API, see Caspio_API.get"""
+        params = {}
+        if qWhere:
+            params["q.where"] = qWhere
+        if qSelect:
+            params["q.select"] = qSelect
+        if qLimit:
+            params["q.limit"] = qLimit
+        return await self._request("GET", endpoint, params=params)
+
+    @metrics.timed("caspio_call_seconds", operation="put")
+    async def put(self, endpoint: str, data: dict, qWhere: str, returnRows: bool = False) -> httpx.Response:
+        """Simple PUT request, see Caspio_API.put"""
+        params = {"q.where": qWhere}
+        if returnRows:
+            params["response"] = "rows"
+        return await self._request("PUT", endpoint, params=params, data=json.dumps(data))
+
+    @metrics.timed("caspio_call_seconds", operation="post")
+    async def post(self, endpoint: str, data: dict, returnRows: bool = False) -> httpx.Response:
+        """Simple POST request, see Caspio_API.post"""
+        params = {"response": "rows"} if returnRows else {}
+        return await self._request("POST", endpoint, params=params, data=json.dumps(data))
+
+    async def _findUser(self, customerID: str, endpoint: str) -> tuple[httpx.Response, dict]:
+        """Private Function. See Caspio_API._findUser"""
+        response = await self.get(endpoint, qWhere=Caspio_API._customerWhere(customerID), qSelect="PK_ID,CustomerID", qLimit=1)
+
+        if response.status_code in {200, 201}:
+            for record in json.loads(response.text)['Result']:
+                if customerID == record['CustomerID']:
+                    return response, record
+        return response, None
+
+    async def hasUser(self, customerID: str, endpoint: str) -> bool:
+        """Whether the table has a record for the CustomerID, see Caspio_API.hasUser
+
+        Args:
+            customerID (str): Stripe CustomerID of the user.
+            endpoint (str): endpoint url of the table you want to search
+
+        Returns:
+            bool: False when no record has the CustomerID or the lookup failed.
+        """
+        api = self.caspioAPI
+        if await asyncio.to_thread(api._index.get, endpoint, customerID) is not None:
+            return True
+        _, record = await self._findUser(customerID, endpoint)
+        if record is None:
+            return False
+        await asyncio.to_thread(api._index.set, endpoint, customerID, record['PK_ID'])
+        return True
+
+    async def _putUser(self, customerID: str, data: dict, endpoint: str) -> tuple[httpx.Response, bool]:
+        """Private Function. See Caspio_API._putUser"""
+        api = self.caspioAPI
+        customerWhere = Caspio_API._customerWhere(customerID)
+        pkID = await asyncio.to_thread(api._index.get, endpoint, customerID)
+        if pkID is not None:
+            response = await self.put(endpoint, data, f"PK_ID={pkID} AND {customerWhere}")
+            if response.status_code in {200, 201} and Caspio_API._recordsAffected(response) > 0:
+                return response, True
+            if response.status_code not in {200, 201, 404}:
+                return response, False
+            # The record was deleted or changed since it was indexed.
+            await asyncio.to_thread(api._index.invalidate, endpoint, customerID)
+
+        if api._upsertMode:
+            response = await self.put(endpoint, data, customerWhere, returnRows=True)
+            found = response.status_code in {200, 201} and Caspio_API._recordsAffected(response) > 0
+            if found:
+                await asyncio.to_thread(api._rememberRows, endpoint, response)
+            return response, found
+
+        response, record = await self._findUser(customerID, endpoint)
+        if record is None:
+            return response, False
+        await asyncio.to_thread(api._index.set, endpoint, customerID, record['PK_ID'])
+        return await self.put(endpoint, data, f"PK_ID={record['PK_ID']}"), True
+
+    @metrics.timed("caspio_call_seconds", operation="mergeUser")
+    async def mergeUser(self, data: dict, endpoint: str) -> httpx.Response:
+        """Updates the record of data['CustomerID'], or creates it, see Caspio_API.mergeUser
+
+        Args:
+            data (dict): Key:Value information for user.
+            endpoint (str): endpoint url of the table you want to affect
+
+        Returns:
+            httpx.Response
+        """
+        response, found = await self._putUser(data['CustomerID'], data, endpoint)
+        if found or response.status_code not in {200, 201, 404}:
+            return response
+
+        response = await self.post(endpoint, data, returnRows=True)
+        if response.status_code in {200, 201}:
+            await asyncio.to_thread(self.caspioAPI._rememberRows, endpoint, response)
+        return response
+
+    @metrics.timed("caspio_call_seconds", operation="updateUser")
+    async def updateUser(self, customerID: str, data: dict, endpoint: str) -> httpx.Response:
+        """Updates the record of the CustomerID, see Caspio_API.updateUser
+
+        Args:
+            customerID (str): Stripe CustomerID of the user.
+            data (dict): Key:Value information for user.
+            endpoint (str): endpoint url of the table you want to affect
+
+        Raises:
+            NoUsersToUpdate: When no record has the CustomerID.
+
+        Returns:
+            httpx.Response
+        """
+        response, found = await self._putUser(customerID, data, endpoint)
+        if found or response.status_code not in {200, 201, 404}:
+            return response
+        raise NoUsersToUpdate
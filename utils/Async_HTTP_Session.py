@@ -0,0 +1,74 @@
+import os
+import asyncio
+import httpx
+import requests
+
+
+class Async_HTTP_Session:
+    """Pooled keep-alive httpx.AsyncClient shared by every coroutine of a worker.
+    The client is created lazily and rebuilt when the process or the event loop changes, since its
+    connections belong to the loop that opened them.
+
+    Transport errors are raised as the matching requests exceptions (ConnectionError, ConnectTimeout,
+    ReadTimeout), so Retry_Policy and the callers handle them exactly like the sync clients' errors.
+    """
+
+    def __init__(self, maxConnections: int = 100, maxKeepalive: int = 20, timeout: float = 10):
+        """
+        Args:
+            maxConnections (int): Maximum number of open connections, over every host.
+            maxKeepalive (int): Maximum number of idle kept-alive connections.
+            timeout (float): Seconds before connecting or reading times out.
+        """
+        self.maxConnections = maxConnections
+        self.maxKeepalive = maxKeepalive
+        self.timeout = timeout
+        self._client = None
+        self._loop = None
+        self._pid = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """httpx.AsyncClient for the current process and event loop."""
+        loop = asyncio.get_running_loop()
+        if self._pid != os.getpid() or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.maxConnections, max_keepalive_connections=self.maxKeepalive),
+                timeout=self.timeout
+            )
+            self._loop = loop
+            self._pid = os.getpid()
+        return self._client
+
+    async def request(self, method: str, url: str, data: str = None, **kwargs) -> httpx.Response:
+        """Sends the request over the pooled client.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Full url of the request.
+            data (str, optional): Request body.
+            **kwargs: Passed through to httpx.AsyncClient.request (headers, params).
+
+        Raises:
+            requests.ConnectTimeout: The connection could not be opened in time.
+            requests.ReadTimeout: The server did not answer in time.
+            requests.ConnectionError: Any other transport error.
+
+        Returns:
+            httpx.Response: Has the status_code, text and headers the sync callers read.
+        """
+        try:
+            return await self.client.request(method, url, content=data, **kwargs)
+        except httpx.ConnectTimeout as e:
+            raise requests.ConnectTimeout(str(e)) from e
+        except httpx.TimeoutException as e:
+            raise requests.ReadTimeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+
+    async def aclose(self):
+        """Closes the kept-alive connections of the current client."""
+        if self._client is not None and self._pid == os.getpid():
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
@@ -0,0 +1,72 @@
+import json
+import asyncio
+from utils.Async_HTTP_Session import Async_HTTP_Session
+from utils.Stripe_API import Stripe_API, FailedGetRequest
+from utils.Subscription_Cache import Subscription_Cache
+from utils.Metrics import metrics
+
+
+class Async_Stripe_API:
+    """Coroutine version of the Stripe_API calls the webhook handlers make, over an Async_HTTP_Session.
+    Same urls, headers, metrics and errors as Stripe_API.  The subscription cache (SQLite) is read and
+    written in a thread, and stale entries are still refreshed from a background thread with a sync Stripe_API.
+    """
+
+    _apiURL = Stripe_API._apiURL
+
+    def __init__(self, secretKey: str, subscriptionCache: Subscription_Cache = None, http: Async_HTTP_Session = None):
+        """
+        Args:
+            secretKey (str): Stripe secret key of the account.
+            subscriptionCache (Subscription_Cache, optional): Cache read before calling Stripe for a subscription.
+            http (Async_HTTP_Session, optional): Shared pooled client, a private one by default.
+        """
+        self.headers = {"Authorization": f"Bearer {secretKey}"}
+        self.subscriptionCache = subscriptionCache
+        self._http = http or Async_HTTP_Session()
+        self._syncAPI = Stripe_API(secretKey=secretKey)
+
+    async def get(self, endpoint: str) -> dict:
+        """Perform a get request to endpoint
+
+        Args: endpoint (str): url endpoint of api get request
+        Returns: dict: Json response data turned into a dict.
+        """
+        resource = "/".join(endpoint.split("?")[0].split("/")[:2])
+        with metrics.timer("stripe_get_seconds", resource=resource):
+            response = await self._http.request("GET", f"{self._apiURL}/{endpoint}", headers=self.headers)
+        metrics.inc("stripe_responses_total", resource=resource, status=response.status_code)
+        if response.status_code == 200:
+            return dict(json.loads(response.text))
+        raise FailedGetRequest(f"{response.status_code} : {response.text}")
+
+    async def getSubscriptionObject(self, subscriptionID: str) -> dict:
+        """Perform a Get request to /v1/subscriptions/id, unless the subscriptionCache can answer.
+        https://stripe.com/docs/api/subscriptions/object
+
+        Args: subscriptionID (str): ID of the Stripe Subscription Object
+        Returns: dict: Json response data turned into a dict.
+        """
+        if self.subscriptionCache is None:
+            return await self.fetchSubscriptionObject(subscriptionID)
+        subscription = await asyncio.to_thread(self.subscriptionCache.peek, subscriptionID, loader=self._syncAPI.fetchSubscriptionObject)
+        if subscription is None:
+            subscription = await self.fetchSubscriptionObject(subscriptionID)
+            await asyncio.to_thread(self.subscriptionCache.put, subscription)
+        return subscription
+
+    async def fetchSubscriptionObject(self, subscriptionID: str) -> dict:
+        """Perform a Get request to /v1/subscriptions/id, bypassing the subscriptionCache.
+
+        Args: subscriptionID (str): ID of the Stripe Subscription Object
+        Returns: dict: Json response data turned into a dict.
+        """
+        return await self.get(f"v1/subscriptions/{subscriptionID}")
+
+    async def getInvoiceObject(self, invoiceID: str) -> dict:
+        """Perform a Get request to /v1/invoices/id
+
+        Args: invoiceID (str): Stripe Invoice ID
+        Returns: dict: Json response data turned into a dict.
+        """
+        return await self.get(f"v1/invoices/{invoiceID}")
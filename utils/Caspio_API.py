@@ -1,11 +1,25 @@
+import time
 import base64
 import json
+from urllib.parse import quote
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from dotenv import dotenv_values
+from utils.Caspio_Index import Caspio_Index
+from utils.HTTP_Session import HTTP_Session
+from utils.Token_Manager import Token_Manager
+from utils.Retry_Policy import Retry_Policy
+from utils.Circuit_Breaker import Circuit_Breaker
+from utils.Metrics import metrics
+from utils.Profiler import profiler
 
 class NoUsersToUpdate(Exception):
     "Raised when No Users are found with the Customer ID so there is no Update to be done."
 
+class FailedCaspioRequest(Exception):
+    "Raised when a Caspio request needed to continue does not return 200."
+
 class Caspio_API:
     
     _config = dict(dotenv_values('.env'))
@@ -15,6 +29,108 @@ class Caspio_API:
     _refreshToken = _config['refreshToken']
     _bearerAccessToken = _config['bearerAccessToken']
     _apiURL = _config['apiURL']
+    _upsertMode = _config.get('caspioUpsertMode', 'False').lower() == 'true'
+    _http = HTTP_Session(poolConnections=int(_config.get('caspioPoolConnections', 2)), poolMaxsize=int(_config.get('caspioPoolMaxsize', 10)))
+    _index = Caspio_Index(path=_config.get('caspioIndexPath', 'caspio_index.sqlite3'), ttl=int(_config.get('caspioIndexTTL', 86400)))
+    _tokenPath = _config.get('caspioTokenPath', 'caspio_tokens.json')
+    _retryPolicy = Retry_Policy(
+        maxAttempts=int(_config.get('caspioRetryMaxAttempts', 4)),
+        baseDelay=float(_config.get('caspioRetryBaseDelay', 0.5)),
+        maxDelay=float(_config.get('caspioRetryMaxDelay', 8)),
+        maxElapsed=float(_config.get('caspioRetryMaxElapsed', 30))
+    )
+    _breaker = Circuit_Breaker(
+        name="caspio",
+        failureThreshold=int(_config.get('caspioBreakerFailures', 5)),
+        slowCallSeconds=float(_config.get('caspioBreakerSlowCall', 5)),
+        openSeconds=float(_config.get('caspioBreakerOpenSeconds', 30)),
+        enabled=_config.get('caspioBreakerEnabled', 'True').lower() == 'true'
+    )
+
+    def __init__(self):
+        self._tokens = Token_Manager(
+            path=self._tokenPath,
+            fetchTokens=self._refresh_BearerAccessToken,
+            accessToken=self._bearerAccessToken,
+            refreshToken=self._refreshToken,
+            refreshMargin=int(self._config.get('caspioTokenRefreshMargin', 300)),
+            persist=self._updateTokens
+        )
+
+    def _headers(self, token: str) -> dict:
+        """Private Function. Headers of a Caspio REST request.
+
+        Args:
+            token (str): Bearer access token.
+
+        Returns:
+            dict: Request headers.
+        """
+        return {
+            "Authorization": f"bearer {token}",
+            "Content-Type": "application/json"
+        }
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Private Function. Sends the request over the worker's pooled keep-alive session.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Full url of the request.
+            **kwargs: Passed through to requests.Session.request (headers, params, data).
+
+        Returns:
+            requests.Response: The Response <Response> object, which contains a server's response to an HTTP request.
+        """
+        return self._http.session.request(method, url, timeout=10, **kwargs)
+
+    def _request(self, method: str, endpoint: str, params: dict = None, data: str = None) -> requests.Response:
+        """Private Function. Sends an authorized request to the Caspio REST API.
+        A 401 refreshes the token once.  429, 5xx, timeouts and connection errors are retried
+        following the Retry_Policy, always with the original params and body.  Every attempt goes
+        through the circuit breaker, which fails fast with CircuitOpen while Caspio is down.
+
+        Args:
+            method (str): HTTP method.
+            endpoint (str): url endpoint of the request.
+            params (dict, optional): Query parameters ex: {"q.where": "PK_ID=1"}
+            data (str, optional): JSON body.
+
+        Returns:
+            requests.Response: The Response <Response> object, which contains a server's response to an HTTP request.
+        """
+        started = time.monotonic()
+        attempt = 0
+        refreshed = False
+        self._retryPolicy.count("requests")
+        while True:
+            attempt += 1
+            trial = self._breaker.before()
+            token = self._tokens.accessToken()
+            sent = time.monotonic()
+            try:
+                with profiler.phase(f"caspio.{method}"):
+                    response = self._send(method, self._apiURL + endpoint, headers=self._headers(token), params=params, data=data)
+            except requests.RequestException as e:
+                self._breaker.record(False, time.monotonic() - sent, trial)
+                metrics.inc("caspio_responses_total", method=method, status=type(e).__name__)
+                if not self._retryPolicy.shouldRetry(method, attempt, started, error=e):
+                    raise
+                with profiler.phase("caspio.retry_wait"):
+                    self._retryPolicy.wait(attempt)
+                continue
+
+            self._breaker.record(response.status_code < 500, time.monotonic() - sent, trial)
+            metrics.inc("caspio_responses_total", method=method, status=response.status_code)
+            if response.status_code == 401 and not refreshed:
+                refreshed = True
+                self._retryPolicy.count("retry_401")
+                self._tokens.refresh(staleToken=token)
+                continue
+            if response.status_code < 400 or not self._retryPolicy.shouldRetry(method, attempt, started, response=response):
+                return response
+            with profiler.phase("caspio.retry_wait"):
+                self._retryPolicy.wait(attempt, response)
 
     def _updateTokens(self, tokens: dict):
         """Private Function.  Used to update the .env file.  Only updates the key:value 
@@ -44,33 +160,30 @@ class Caspio_API:
 
         #current_app.logger.info(f'.env File Updated with rows {tokens}')
 
-    def _get_BearerAccessToken(self) -> requests.Response:
-        """Private Function. Requests _BearerAccessToken from Caspio. Gets A new BAT and Refresh token from Caspio
-        Only Updates .env variables when response.status_code = 200.
+    def _get_BearerAccessToken(self) -> dict:
+        """Private Function. Requests a new Bearer Access Token and Refresh token from Caspio with the client credentials.
 
         Returns:
-            requests.Response: The Response <Response> object, which contains a server's response to an HTTP request.
+            dict: The token response ('access_token', 'refresh_token', 'expires_in') or None when the request failed.
         """
-
-
         postData = f"grant_type=client_credentials&client_id={self._clientID}&client_secret={self._clientSecret}"
-        response = requests.post(self._accessTokenURL,data=postData, timeout=10)
+        response = self._send("POST", self._accessTokenURL, data=postData)
 
         if response.status_code == 200:
-            jsonData = json.loads(response.text)
-            self._bearerAccessToken = jsonData["access_token"]
-            self._refreshToken = jsonData["refresh_token"]
-            tokens = {
-                "bearerAccessToken": jsonData["access_token"],
-                "refreshToken": jsonData["refresh_token"]
-            }
-            self._updateTokens(tokens)
-            
-        return response
+            return json.loads(response.text)
+        return None
         
-    def _refresh_BearerAccessToken(self):
+    def _refresh_BearerAccessToken(self, refreshToken: str) -> dict:
         """Private Function.  Uses the Caspio Refresh token to refresh the Caspio Bearer Access Token. 
+        Falls back to the client credentials when Caspio rejects the Refresh token.
+        Called by the Token_Manager, which shares the result with every worker.
         https://howto.caspio.com/web-services-api/rest-api/authenticating-rest/
+
+        Args:
+            refreshToken (str): Current Caspio Refresh token.
+
+        Returns:
+            dict: The token response ('access_token', 'expires_in', maybe 'refresh_token') or None when the request failed.
         """
         dataToEncode = f"{self._clientID}:{self._clientSecret}"
         binaryData = dataToEncode.encode("utf-8")
@@ -81,46 +194,43 @@ class Caspio_API:
             "Authorization": "Basic " + decodedData
         }
 
-        postData = f"grant_type=refresh_token&refresh_token={self._refreshToken}"
-        response = requests.post(self._accessTokenURL,data=postData, headers=headers, timeout=10)
-
-        if (response.status_code == 400):
-            self._get_BearerAccessToken()
-        elif (response.status_code == 200):
-            responseDict = json.loads(response.text)
-            self._bearerAccessToken = responseDict['access_token']
-            tokens = {
-                "bearerAccessToken": responseDict['access_token']
-            }
-            self._updateTokens(tokens)
+        postData = f"grant_type=refresh_token&refresh_token={refreshToken}"
+        tokens = None
+        with profiler.phase("caspio.token_refresh"):
+            response = self._send("POST", self._accessTokenURL, data=postData, headers=headers)
+            if (response.status_code == 400):
+                tokens = self._get_BearerAccessToken()
+            elif (response.status_code == 200):
+                tokens = json.loads(response.text)
+        metrics.inc("caspio_token_refreshes_total", outcome="success" if tokens else "failure")
+        return tokens
 
         
-    def get(self, endpoint: str, qWhere: str = None) -> requests.Response:
+    @metrics.timed("caspio_call_seconds", operation="get")
+    def get(self, endpoint: str, qWhere: str = None, qSelect: str = None, qLimit: int = None) -> requests.Response:
         """Simple GET Request to Caspio API.
 
         Args:
             endpoint (str): endpoint of GET request.
+            qWhere (str, optional): Caspio q.where filter ex: qWhere = "CustomerID='cus_123'".
+            qSelect (str, optional): Comma separated list of the columns returned ex: qSelect = "PK_ID,CustomerID".
+            qLimit (int, optional): Maximum number of records returned.
 
         Returns:
             requests.Response: The Response <Response> object, which contains a server's response to an HTTP request.
         """
-        headers = {
-            "Authorization": f"bearer {self._bearerAccessToken}",
-            "Content-Type": "application/json"
-        }
-        
+        params = {}
         if qWhere:
-            response = requests.get(f"{self._apiURL}{endpoint}?q.where={qWhere}",headers=headers, timeout=10)
-        else:
-            response = requests.get(self._apiURL+ endpoint,headers=headers, timeout=10)
-
-        if response.status_code == 401:
-            self._refresh_BearerAccessToken()
-            response = self.get(endpoint)
-            
-        return response
+            params["q.where"] = qWhere
+        if qSelect:
+            params["q.select"] = qSelect
+        if qLimit:
+            params["q.limit"] = qLimit
 
-    def put(self, endpoint: str, data: dict, qWhere: str) -> requests.Response:
+        return self._request("GET", endpoint, params=params)
+
+    @metrics.timed("caspio_call_seconds", operation="put")
+    def put(self, endpoint: str, data: dict, qWhere: str, returnRows: bool = False) -> requests.Response:
         """Simple PUT request.  Requires data in a dict of values changed, 
         and an identifier for the row being changed.
 
@@ -128,47 +238,34 @@ class Caspio_API:
             endpoint (str): url endpoint of put request.
             data (dict): Key:Value pairs of the information being updated.
             qWhere (str): Identifier for the line being changed ex: qWhere = f"PaymentID={record['PaymentID']}".
+            returnRows (bool, optional): Ask Caspio to send the updated rows back in 'Result'.
 
         Returns:
             requests.Response: The Response <Response> object, which contains a server's response to an HTTP request.
         """
-        headers = {
-            "Authorization": f"bearer {self._bearerAccessToken}",
-            "Content-Type": "application/json"
-        }
+        params = {"q.where": qWhere}
+        if returnRows:
+            params["response"] = "rows"
         JSONData = json.dumps(data)
-        response = requests.put(f"{self._apiURL}{endpoint}?q.where={qWhere}",headers=headers, data=JSONData, timeout=10)
+        return self._request("PUT", endpoint, params=params, data=JSONData)
 
-
-        if response.status_code == 401:
-            self._refresh_BearerAccessToken()
-            response = self.put(endpoint, data, qWhere)
-        
-        return response
-
-    def post(self, endpoint: str, data: dict) -> requests.Response:
+    @metrics.timed("caspio_call_seconds", operation="post")
+    def post(self, endpoint: str, data: dict, returnRows: bool = False) -> requests.Response:
         """Simple POST request to specified endpoint.
 
         Args:
             endpoint (str): url endpoint of POST request.
             data (dict): Dictionary of data passed into the POST request.
+            returnRows (bool, optional): Ask Caspio to send the created row back in 'Result'.
 
         Returns:
             requests.Response: The Response <Response> object, which contains a server's response to an HTTP request.
         """
-        headers = {
-            "Authorization": f"bearer {self._bearerAccessToken}",
-            "Content-Type": "application/json"
-        }
+        params = {"response": "rows"} if returnRows else {}
         JSONData = json.dumps(data)
-        response = requests.post(self._apiURL + endpoint,headers=headers, data=JSONData, timeout=10)
-
-        if response.status_code == 401:
-            self._refresh_BearerAccessToken()
-            response = self.post(endpoint, data)
-        return response
-        
+        return self._request("POST", endpoint, params=params, data=JSONData)
 
+    @metrics.timed("caspio_call_seconds", operation="delete")
     def delete(self, endpoint: str, qWhere: str) -> requests.Response:
         """Simple DEL request to specified endpoint.
 
@@ -176,24 +273,245 @@ class Caspio_API:
             endpoint (str): url endpoint of DEL request.
 
         Returns: 
-            requests.Response: The Response <Response> object, which contains a server's response to an HTTP request.  Or an empty Response() object if the requests times out
+            requests.Response: The Response <Response> object, which contains a server's response to an HTTP request.
         """
-        headers = {
-            "Authorization": f"bearer {self._bearerAccessToken}",
-            "Content-Type": "application/json"
-        }
-        response = requests.delete(f"{self._apiURL}{endpoint}?q.where={qWhere}",headers=headers, timeout=10)
+        return self._request("DELETE", endpoint, params={"q.where": qWhere})
 
-        if response.status_code == 401:
-            self._refresh_BearerAccessToken()
-            response = self.delete(endpoint, qWhere)
-        return response
+    @metrics.timed("caspio_call_seconds", operation="iterRecords")
+    def _getPage(self, endpoint: str, pageNumber: int, pageSize: int, params: dict) -> list[dict]:
+        """Private Function. Fetches one page of records.
+
+        Args:
+            endpoint (str): endpoint of GET request.
+            pageNumber (int): Page to fetch, starting at 1.
+            pageSize (int): Records per page.
+            params (dict): q.select / q.where / q.orderBy parameters.
+
+        Returns:
+            list[dict]: Records of the page.
+        """
+        response = self._request("GET", endpoint, params={**params, "q.pageNumber": pageNumber, "q.pageSize": pageSize})
+        if response.status_code != 200:
+            raise FailedCaspioRequest(f"{response.status_code} : {response.text}")
+        return json.loads(response.text)['Result']
+
+    def iterRecords(self, endpoint: str, qSelect: str = None, qWhere: str = None, qOrderBy: str = "PK_ID",
+                    pageSize: int = 1000, prefetch: bool = False) -> Iterator[dict]:
+        """Yields every record of the table one at a time, walking q.pageNumber lazily so only one page
+        (two with prefetch) is held in memory.
+
+        Args:
+            endpoint (str): endpoint of the table ex: /v2/tables/DP_Payment_Logs/records
+            qSelect (str, optional): Comma separated list of the columns returned ex: qSelect = "PK_ID,CustomerID".
+            qWhere (str, optional): Caspio q.where filter.
+            qOrderBy (str, optional): Order of the records, keeps the pages stable.  Defaults to PK_ID.
+            pageSize (int, optional): Records per request, at most 1000.
+            prefetch (bool, optional): Fetch the next page in the background while the current one is consumed.
+
+        Raises:
+            FailedCaspioRequest: When a page can not be fetched.
+
+        Yields:
+            dict: One record.
+        """
+        params = {}
+        if qSelect:
+            params["q.select"] = qSelect
+        if qWhere:
+            params["q.where"] = qWhere
+        if qOrderBy:
+            params["q.orderBy"] = qOrderBy
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            pageNumber = 1
+            page = self._getPage(endpoint, pageNumber, pageSize, params)
+            while page:
+                nextPage = None
+                if executor is not None and len(page) == pageSize:
+                    nextPage = executor.submit(self._getPage, endpoint, pageNumber + 1, pageSize, params)
+                yield from page
+                if len(page) < pageSize:
+                    break
+                pageNumber += 1
+                page = nextPage.result() if nextPage is not None else self._getPage(endpoint, pageNumber, pageSize, params)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    @metrics.timed("caspio_call_seconds", operation="bulkUpdate")
+    def bulkUpdate(self, endpoint: str, records: dict, maxWhereLength: int = 1800) -> list[dict]:
+        """Updates many records with as few PUT requests as possible.  Records getting the same data are grouped
+        and updated together with a 'PK_ID IN (...)' filter, chunked so the encoded q.where stays under maxWhereLength.
+
+        Args:
+            endpoint (str): url endpoint of the table you want to affect
+            records (dict): PK_ID:data pairs ex: {12: {"Status": "canceled"}, 15: {"Status": "canceled"}}
+            maxWhereLength (int, optional): Longest url encoded q.where sent in one request.
+
+        Returns:
+            list[dict]: One result per request: {"data", "PK_IDs", "status_code", "recordsAffected", "error"}
+        """
+        groups = {}
+        for pkID, data in records.items():
+            key = json.dumps(data, sort_keys=True)
+            groups.setdefault(key, (data, []))[1].append(int(pkID))
+
+        prefixLength = len(quote("PK_ID IN ()"))
+        results = []
+        for data, pkIDs in groups.values():
+            chunks, chunk, length = [], [], prefixLength
+            for pkID in pkIDs:
+                # Every id after the first is preceded by an encoded comma (%2C).
+                added = len(str(pkID)) + (3 if chunk else 0)
+                if chunk and length + added > maxWhereLength:
+                    chunks.append(chunk)
+                    chunk, length, added = [], prefixLength, len(str(pkID))
+                chunk.append(pkID)
+                length += added
+            if chunk:
+                chunks.append(chunk)
+
+            for chunk in chunks:
+                result = {"data": data, "PK_IDs": chunk, "status_code": None, "recordsAffected": 0, "error": None}
+                try:
+                    response = self.put(endpoint, data, f"PK_ID IN ({','.join(str(pkID) for pkID in chunk)})")
+                    result["status_code"] = response.status_code
+                    result["recordsAffected"] = self._recordsAffected(response)
+                    if response.status_code not in {200, 201}:
+                        result["error"] = response.text
+                except requests.RequestException as e:
+                    result["error"] = str(e)
+                results.append(result)
+        return results
+
+    @staticmethod
+    def _customerWhere(customerID: str) -> str:
+        """Private Function. Builds the q.where clause matching a CustomerID, escaping quotes.
+
+        Args:
+            customerID (str): Stripe CustomerID of the user.
+
+        Returns:
+            str: q.where clause ex: "CustomerID='cus_123'"
+        """
+        escapedID = customerID.replace("'", "''")
+        return f"CustomerID='{escapedID}'"
+
+    @staticmethod
+    def _recordsAffected(response: requests.Response) -> int:
+        """Private Function. Reads RecordsAffected out of a Caspio PUT/DELETE response.
+
+        Args:
+            response (requests.Response): Response of a PUT or DELETE request.
+
+        Returns:
+            int: Number of rows changed by the request, 0 if the body could not be read.
+        """
+        try:
+            return int(json.loads(response.text).get('RecordsAffected', 0))
+        except (ValueError, AttributeError, TypeError):
+            return 0
 
+    def _findUser(self, customerID: str, endpoint: str) -> tuple[requests.Response, dict]:
+        """Private Function. Looks up the record with the CustomerID using a filtered query so
+        only the matching row's PK_ID and CustomerID are sent back, no matter how big the table is.
+
+        Args:
+            customerID (str): Stripe CustomerID of the user.
+            endpoint (str): endpoint url of the table you want to search
+
+        Returns:
+            tuple[requests.Response, dict]: The response of the lookup and the matching record, or None when no record matched.
+        """
+        response = self.get(endpoint, qWhere=self._customerWhere(customerID), qSelect="PK_ID,CustomerID", qLimit=1)
+
+        if response.status_code in {200, 201}:
+            recordsDict = json.loads(response.text)
+            for record in recordsDict['Result']:
+                if customerID == record['CustomerID']:
+                    return response, record
+        return response, None
+
+    def hasUser(self, customerID: str, endpoint: str) -> bool:
+        """Whether the table has a record for the CustomerID.  Answered by the index when the PK_ID is known,
+        otherwise by the filtered lookup, whose PK_ID is indexed so the next write skips it.
+
+        Args:
+            customerID (str): Stripe CustomerID of the user.
+            endpoint (str): endpoint url of the table you want to search
+
+        Returns:
+            bool: False when no record has the CustomerID or the lookup failed.
+        """
+        if self._index.get(endpoint, customerID) is not None:
+            return True
+        _, record = self._findUser(customerID, endpoint)
+        if record is None:
+            return False
+        self._index.set(endpoint, customerID, record['PK_ID'])
+        return True
+
+    def _rememberRows(self, endpoint: str, response: requests.Response):
+        """Private Function. Adds the rows sent back by a response=rows request to the CustomerID index.
+
+        Args:
+            endpoint (str): endpoint url of the table the rows belong to.
+            response (requests.Response): Response of a PUT or POST made with returnRows=True.
+        """
+        try:
+            rows = json.loads(response.text).get('Result', [])
+        except (ValueError, AttributeError):
+            return
+        for row in rows:
+            if row.get('CustomerID') and row.get('PK_ID') is not None:
+                self._index.set(endpoint, row['CustomerID'], row['PK_ID'])
+
+    def _putUser(self, customerID: str, data: dict, endpoint: str) -> tuple[requests.Response, bool]:
+        """Private Function. Updates the record of the CustomerID.  Uses the PK_ID from the index when it is
+        known, otherwise finds the record (or updates by CustomerID directly in caspioUpsertMode).
+
+        Args:
+            customerID (str): Stripe CustomerID of the user.
+            data (dict): Key:Value information for user.
+            endpoint (str): endpoint url of the table you want to affect
+
+        Returns:
+            tuple[requests.Response, bool]: The last response and whether a record with the CustomerID was found.
+                A 404 means no record matched, the same as an empty result, in every branch.
+        """
+        pkID = self._index.get(endpoint, customerID)
+        if pkID is not None:
+            response = self.put(endpoint, data, f"PK_ID={pkID} AND {self._customerWhere(customerID)}")
+            if response.status_code in {200, 201} and self._recordsAffected(response) > 0:
+                return response, True
+            if response.status_code not in {200, 201, 404}:
+                return response, False
+            # The record was deleted or changed since it was indexed.
+            self._index.invalidate(endpoint, customerID)
+
+        if self._upsertMode:
+            response = self.put(endpoint, data, self._customerWhere(customerID), returnRows=True)
+            found = response.status_code in {200, 201} and self._recordsAffected(response) > 0
+            if found:
+                self._rememberRows(endpoint, response)
+            return response, found
+
+        response, record = self._findUser(customerID, endpoint)
+        if record is None:
+            return response, False
+        self._index.set(endpoint, customerID, record['PK_ID'])
+        return self.put(endpoint, data, f"PK_ID={record['PK_ID']}"), True
+
+    @metrics.timed("caspio_call_seconds", operation="mergeUser")
     def mergeUser(self, data: dict, endpoint: str) -> requests.Response:
         """Attempts to find user for the new data being submitted via CustomerID.
         If CustomerID is found the row is updated with information in the dict.
         If no CustomerID exists in Caspio Table then create a new record in that table with data.
 
+        When caspioUpsertMode=True is set in the .env the lookup is skipped and the row is updated
+        by CustomerID directly, so an existing customer only costs one call.
+
         Args:
             data (dict): Key:Value information for user.
             endpoint (str): endpoint url of the table you want to affect
@@ -202,20 +520,19 @@ class Caspio_API:
             requests.Response
 
         """
-        response = self.get(endpoint)
+        response, found = self._putUser(data['CustomerID'], data, endpoint)
         
-        # Check that I got the response correctly
+        # Check that I got the response correctly, a 404 means no record matched
+        if found or response.status_code not in {200, 201, 404}:
+            return response
+
+        # If CustomerID does not exists on Caspio, post a new user.
+        response = self.post(endpoint, data, returnRows=True)
         if response.status_code in {200, 201}:
-            recordsDict = json.loads(response.text)
-            # Checks if the CustomerID Exists in the Table
-            for record in recordsDict['Result']:
-                if data['CustomerID'] == record['CustomerID']:
-                    response = self.put(endpoint, data, f"PK_ID={record['PK_ID']}")
-                    return response
-            # If CustomerID does not exists on Caspio, post a new user.
-            response = self.post(endpoint, data)
+            self._rememberRows(endpoint, response)
         return response
 
+    @metrics.timed("caspio_call_seconds", operation="updateUser")
     def updateUser(self, customerID: str, data: dict, endpoint: str) -> requests.Response:
         """Attempts to find user for the new data being submitted via CustomerID.
         If customerID is found the row is updated with information in the dict.
@@ -229,13 +546,8 @@ class Caspio_API:
         Returns:
             requests.Response
         """
-        response = self.get(endpoint)
+        response, found = self._putUser(customerID, data, endpoint)
 
-        if response.status_code in {200, 201}:
-            recordsDict = json.loads(response.text)
-            for record in recordsDict['Result']:
-                if customerID == record['CustomerID']:
-                    response = self.put(endpoint, data, f"PK_ID={record['PK_ID']}")
-                    return response
-            raise NoUsersToUpdate
-        return response
+        if found or response.status_code not in {200, 201, 404}:
+            return response
+        raise NoUsersToUpdate
@@ -0,0 +1,90 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+class Caspio_Index:
+    """Local CustomerID -> PK_ID index for the Caspio tables.  Stored in a SQLite file so every
+    gunicorn worker reads and fills the same index.  Entries expire after 'ttl' seconds and are
+    invalidated when Caspio reports the cached PK_ID no longer matches the customer.
+    """
+
+    def __init__(self, path: str, ttl: int = 86400):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Private Function. One connection per thread, reopened after a fork so workers never share a handle.
+
+        Returns:
+            sqlite3.Connection: Connection to the index file.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS customer_index ("
+                "tableEndpoint TEXT NOT NULL, customerID TEXT NOT NULL, pkID INTEGER NOT NULL, "
+                "updatedAt REAL NOT NULL, PRIMARY KEY (tableEndpoint, customerID))"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, endpoint: str, customerID: str):
+        """Returns the cached PK_ID of the customer in the table, None when missing or expired.
+
+        Args:
+            endpoint (str): endpoint url of the Caspio table.
+            customerID (str): Stripe CustomerID of the user.
+
+        Returns:
+            int: PK_ID of the record or None.
+        """
+        if self.ttl <= 0:
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT pkID FROM customer_index WHERE tableEndpoint=? AND customerID=? AND updatedAt>=?",
+                (endpoint, customerID, time.time() - self.ttl)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def set(self, endpoint: str, customerID: str, pkID: int):
+        """Stores the PK_ID of the customer in the table.
+
+        Args:
+            endpoint (str): endpoint url of the Caspio table.
+            customerID (str): Stripe CustomerID of the user.
+            pkID (int): PK_ID of the Caspio record.
+        """
+        if self.ttl <= 0:
+            return
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO customer_index (tableEndpoint, customerID, pkID, updatedAt) VALUES (?, ?, ?, ?)",
+                (endpoint, customerID, int(pkID), time.time())
+            )
+        except (sqlite3.Error, ValueError, TypeError):
+            pass
+
+    def invalidate(self, endpoint: str, customerID: str):
+        """Removes the customer from the index.
+
+        Args:
+            endpoint (str): endpoint url of the Caspio table.
+            customerID (str): Stripe CustomerID of the user.
+        """
+        try:
+            self._connection().execute(
+                "DELETE FROM customer_index WHERE tableEndpoint=? AND customerID=?",
+                (endpoint, customerID)
+            )
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+
+class Caspio_Spool:
+    """Append-only JSON lines file of Caspio writes deferred while Caspio is unavailable, shared by every
+    gunicorn worker.
+
+    Writes are appended under an exclusive file lock and fsynced.  A background thread in each process
+    drains the file in order while 'canDrain' allows it (ex: the circuit breaker is not open), at most
+    'drainRate' writes per second.  Only one process drains at a time, the position reached is kept in
+    a '.offset' file so a restart resumes where it stopped, and the file is emptied once fully drained.
+    """
+
+    def __init__(self, path: str, drainRate: float = 5.0, pollInterval: float = 5.0, logger: logging.Logger = None):
+        """
+        Args:
+            path (str): JSON lines file holding the spooled writes.
+            drainRate (float): Most writes replayed per second.
+            pollInterval (float): Seconds between checks for spooled writes.
+            logger (logging.Logger, optional): Logger for drain progress and failures.
+        """
+        self.path = path
+        self.drainRate = drainRate
+        self.pollInterval = pollInterval
+        self.logger = logger or logging.getLogger(__name__)
+        self._startLock = threading.Lock()
+        self._startedPid = None
+
+    @contextmanager
+    def _fileLock(self, suffix: str, blocking: bool = True):
+        """Private Function. Exclusive lock shared by every process, yields False when not blocking and taken."""
+        with open(self.path + suffix, "a") as lockFile:
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def append(self, write: dict):
+        """Durably adds a write at the end of the spool.
+
+        Args:
+            write (dict): JSON serializable write ex: {"operation": "update", "endpoint": ..., "customerID": ..., "data": {...}}
+        """
+        line = json.dumps({**write, "spooledAt": time.time()}) + "\n"
+        with self._fileLock(".lock"):
+            with open(self.path, "a") as spoolFile:
+                spoolFile.write(line)
+                spoolFile.flush()
+                os.fsync(spoolFile.fileno())
+
+    def _offset(self) -> int:
+        """Private Function. Bytes of the spool already drained, never past the end of the spool."""
+        try:
+            with open(self.path + ".offset", "r") as offsetFile:
+                offset = int(offsetFile.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+        try:
+            # An offset past the end belongs to a spool emptied before the offset was reset.
+            return offset if offset <= os.path.getsize(self.path) else 0
+        except FileNotFoundError:
+            return 0
+
+    def _setOffset(self, offset: int):
+        """Private Function. Atomically records the drained position."""
+        with open(self.path + ".offset.tmp", "w") as offsetFile:
+            offsetFile.write(str(offset))
+        os.replace(self.path + ".offset.tmp", self.path + ".offset")
+
+    def pending(self) -> bool:
+        """Whether writes are waiting in the spool.  New writes should be spooled behind them, to keep their order.
+
+        Returns:
+            bool
+        """
+        try:
+            return os.path.getsize(self.path) > self._offset()
+        except FileNotFoundError:
+            return False
+
+    def depth(self) -> int:
+        """Number of writes waiting in the spool.
+
+        Returns:
+            int
+        """
+        try:
+            with open(self.path, "rb") as spoolFile:
+                spoolFile.seek(self._offset())
+                return sum(1 for line in spoolFile if line.strip())
+        except FileNotFoundError:
+            return 0
+
+    def drain(self, apply: Callable[[dict], bool]) -> int:
+        """Replays the spooled writes in order, unless another process is already draining.
+
+        Args:
+            apply (Callable[[dict], bool]): Called with each write.  Returns True when the write is done with
+                (applied, or rejected for good and logged), False to stop and retry it later.
+
+        Returns:
+            int: Number of writes done with.
+        """
+        done = 0
+        with self._fileLock(".drain", blocking=False) as locked:
+            if not locked:
+                return 0
+            offset = self._offset()
+            try:
+                spoolFile = open(self.path, "rb")
+            except FileNotFoundError:
+                return 0
+            with spoolFile:
+                spoolFile.seek(offset)
+                while True:
+                    line = spoolFile.readline()
+                    if not line.endswith(b"\n"):
+                        # End of the spool, or a line still being written.
+                        break
+                    if line.strip():
+                        try:
+                            write = json.loads(line)
+                        except ValueError:
+                            self.logger.error(f"Unreadable spooled Caspio write skipped: {line[:200]!r}")
+                            write = None
+                        if write is not None and not apply(write):
+                            break
+                        done += 1
+                        time.sleep(1 / self.drainRate if self.drainRate > 0 else 0)
+                    offset += len(line)
+                    self._setOffset(offset)
+
+            with self._fileLock(".lock"):
+                if self._offset() >= os.path.getsize(self.path):
+                    # Fully drained: start the file over so it does not grow forever.  The offset is reset first, a
+                    # crash in between replays writes already applied rather than skipping new ones.
+                    self._setOffset(0)
+                    open(self.path, "w").close()
+        if done:
+            self.logger.info(f"Drained {done} spooled Caspio writes, {self.depth()} left")
+        return done
+
+    def _drainLoop(self, apply: Callable[[dict], bool], canDrain: Callable[[], bool]):
+        """Private Function. Drains the spool whenever it holds writes and canDrain() allows it."""
+        while True:
+            time.sleep(self.pollInterval)
+            try:
+                if self.pending() and canDrain():
+                    self.drain(apply)
+            except Exception as e:
+                self.logger.error(f"Caspio spool drain failed: {e}")
+
+    def start(self, apply: Callable[[dict], bool], canDrain: Callable[[], bool] = lambda: True):
+        """Starts the drain thread of this process.  Safe to call repeatedly and after a fork.
+
+        Args:
+            apply (Callable[[dict], bool]): See drain.
+            canDrain (Callable[[], bool], optional): Checked before every drain ex: the circuit breaker is not open.
+        """
+        if self._startedPid == os.getpid():
+            return
+        with self._startLock:
+            if self._startedPid == os.getpid():
+                return
+            threading.Thread(target=self._drainLoop, args=(apply, canDrain), name="caspio-spool", daemon=True).start()
+            self._startedPid = os.getpid()
@@ -0,0 +1,114 @@
+import time
+import logging
+import threading
+import requests
+from utils.Metrics import metrics
+
+
+class CircuitOpen(requests.ConnectionError):
+    """Raised instead of sending a request while the circuit breaker is open.  A requests.ConnectionError,
+    so callers handle it like Caspio being unreachable, only without waiting for a timeout."""
+
+
+class Circuit_Breaker:
+    """Stops calling a service that keeps failing.
+
+    'failureThreshold' consecutive failed calls (transport errors, 5xx, or calls slower than
+    'slowCallSeconds') open the breaker: every call fails fast with CircuitOpen for 'openSeconds'.
+    Then the breaker is half-open and lets one trial call through.  Its success closes the breaker,
+    its failure opens it again.  The state is kept per process.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failureThreshold: int = 5, slowCallSeconds: float = 5.0, openSeconds: float = 30.0,
+                 enabled: bool = True, logger: logging.Logger = None):
+        """
+        Args:
+            name (str): Service name, for logs and metrics ex: "caspio"
+            failureThreshold (int): Consecutive failed or slow calls that open the breaker.
+            slowCallSeconds (float): A call taking at least this long counts as failed.
+            openSeconds (float): Seconds calls fail fast before a trial call is let through.
+            enabled (bool): False lets every call through.
+            logger (logging.Logger, optional): Logger for state changes.
+        """
+        self.name = name
+        self.failureThreshold = failureThreshold
+        self.slowCallSeconds = slowCallSeconds
+        self.openSeconds = openSeconds
+        self.enabled = enabled
+        self.logger = logger or logging.getLogger(__name__)
+        self.failures = 0
+        self._state = self.CLOSED
+        self._openedAt = 0.0
+        self._trialRunning = False
+        self._trialStarted = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """"closed", "open" or "half_open" (open for longer than openSeconds)."""
+        if self._state == self.OPEN and time.monotonic() - self._openedAt >= self.openSeconds:
+            return self.HALF_OPEN
+        return self._state
+
+    def _transition(self, state: str):
+        """Private Function. Changes the state, must hold the lock."""
+        if state == self._state:
+            return
+        self._state = state
+        if state == self.OPEN:
+            self._openedAt = time.monotonic()
+            self.logger.error(f"{self.name} circuit breaker opened after {self.failures} failed calls, failing fast for {self.openSeconds}s")
+        else:
+            self.logger.warning(f"{self.name} circuit breaker {state}")
+        metrics.inc("circuit_breaker_transitions_total", service=self.name, state=state)
+
+    def before(self) -> bool:
+        """Call before every request.
+
+        Raises:
+            CircuitOpen: The breaker is open, or half-open with its trial call still running.
+
+        Returns:
+            bool: True when the request is the trial call of a half-open breaker, pass it on to record().
+        """
+        if not self.enabled or self._state == self.CLOSED:
+            return False
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return False
+            # A trial that never reported back (ex: it raised something else) is replaced after openSeconds.
+            if state == self.HALF_OPEN and (not self._trialRunning or time.monotonic() - self._trialStarted >= self.openSeconds):
+                self._trialRunning = True
+                self._trialStarted = time.monotonic()
+                return True
+        metrics.inc("circuit_breaker_rejected_total", service=self.name)
+        raise CircuitOpen(f"{self.name} circuit breaker is open")
+
+    def record(self, success: bool, seconds: float = 0.0, trial: bool = False):
+        """Call after every request that was let through.
+
+        Args:
+            success (bool): False for a transport error or a response meaning the service is unhealthy ex: 5xx
+            seconds (float): Duration of the call.
+            trial (bool): What before() returned for the request.
+        """
+        if not self.enabled:
+            return
+        failed = not success or seconds >= self.slowCallSeconds
+        with self._lock:
+            if trial:
+                self._trialRunning = False
+            if trial and not failed:
+                self.failures = 0
+                self._transition(self.CLOSED)
+            elif trial:
+                self._openedAt = time.monotonic()
+                self.logger.error(f"{self.name} circuit breaker trial call failed, failing fast for another {self.openSeconds}s")
+            elif self._state == self.CLOSED:
+                # Calls let through before the breaker opened do not change an open breaker.
+                self.failures = self.failures + 1 if failed else 0
+                if self.failures >= self.failureThreshold:
+                    self._transition(self.OPEN)
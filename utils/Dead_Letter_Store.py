@@ -0,0 +1,393 @@
+import os
+import json
+import time
+import random
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+class Dead_Letter_Store:
+    """Caspio writes that failed, kept with their payload, table and last error in a SQLite (WAL) file
+    shared by every gunicorn worker.
+
+    A background thread in each process retries the letters that are due with exponential backoff.  After
+    'maxAttempts' a letter is parked with status 'failed' until it is drained by hand.  A newer failed write
+    for the same table and CustomerID is merged into the waiting letter, and a successful write removes the
+    fields it wrote from the waiting letters (see supersede), so a retry never puts an older value back.  A letter
+    being retried keeps the fields written meanwhile in 'superseded': they are left out of the retry, or written
+    again after it when the retry was already on its way.
+    """
+
+    def __init__(self, path: str, maxAttempts: int = 8, baseDelay: float = 60.0, maxDelay: float = 3600.0,
+                 leaseSeconds: int = 120, pollInterval: float = 30.0, logger: logging.Logger = None):
+        """
+        Args:
+            path (str): SQLite file holding the letters.
+            maxAttempts (int): Automatic retries before a letter is left as 'failed'.
+            baseDelay (float): Seconds before the first retry, doubled after every failed retry.
+            maxDelay (float): Longest wait between retries, in seconds.
+            leaseSeconds (int): Seconds a letter being retried is owned before another process may take it.
+            pollInterval (float): Seconds between checks for due letters.
+            logger (logging.Logger, optional): Logger for retry failures.
+        """
+        self.path = path
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.leaseSeconds = leaseSeconds
+        self.pollInterval = pollInterval
+        self.logger = logger or logging.getLogger(__name__)
+        self._local = threading.local()
+        self._startLock = threading.Lock()
+        self._startedPid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """Private Function. One connection per thread, reopened after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS letters ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, operation TEXT NOT NULL, endpoint TEXT NOT NULL, "
+                "customerID TEXT, payload TEXT NOT NULL, error TEXT, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, createdAt REAL NOT NULL, updatedAt REAL NOT NULL, "
+                "nextAttemptAt REAL NOT NULL, leasedUntil REAL, superseded TEXT)"
+            )
+            if "superseded" not in {column[1] for column in conn.execute("PRAGMA table_info(letters)")}:
+                # Stores created before letters being retried could be superseded.
+                conn.execute("ALTER TABLE letters ADD COLUMN superseded TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS letters_status ON letters (status, nextAttemptAt)")
+            conn.execute("CREATE INDEX IF NOT EXISTS letters_customer ON letters (endpoint, customerID)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _letter(row: tuple) -> dict:
+        """Private Function. Letter of a letters row."""
+        keys = ("id", "operation", "endpoint", "customerID", "data", "error", "status", "attempts", "createdAt", "updatedAt", "nextAttemptAt")
+        letter = dict(zip(keys, row))
+        letter["data"] = json.loads(letter["data"])
+        return letter
+
+    def add(self, operation: str, endpoint: str, data: dict, error: str, customerID: str = None) -> int:
+        """Stores a failed write, or merges it into the letter already waiting for the table and customer.
+
+        Args:
+            operation (str): "merge" (Caspio_API.mergeUser) or "update" (Caspio_API.updateUser)
+            endpoint (str): endpoint url of the Caspio table
+            data (dict): Key:Value information for user.
+            error (str): Why the write failed.
+            customerID (str, optional): CustomerID of the update, data['CustomerID'] for a merge.
+
+        Returns:
+            int: id of the letter.
+        """
+        customerID = customerID or data.get('CustomerID')
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, operation, payload, superseded FROM letters WHERE endpoint=? AND customerID=? AND status IN ('pending', 'failed') "
+                "ORDER BY id DESC LIMIT 1",
+                (endpoint, customerID)
+            ).fetchone()
+            if row is None:
+                letterID = conn.execute(
+                    "INSERT INTO letters (operation, endpoint, customerID, payload, error, status, createdAt, updatedAt, nextAttemptAt) "
+                    "VALUES (?, ?, ?, ?, ?, 'pending', ?, ?, ?)",
+                    (operation, endpoint, customerID, json.dumps(data), error, now, now, now + self.baseDelay)
+                ).lastrowid
+            else:
+                # The newer write wins field by field, and a merge still creates the record when it is missing.
+                letterID = row[0]
+                superseded = json.loads(row[3] or "{}")
+                waiting = {key: value for key, value in json.loads(row[2]).items() if key == 'CustomerID' or key not in superseded}
+                conn.execute(
+                    "UPDATE letters SET operation=?, payload=?, error=?, status='pending', attempts=0, superseded=NULL, updatedAt=?, "
+                    "nextAttemptAt=? WHERE id=?",
+                    ("merge" if "merge" in (row[1], operation) else "update", json.dumps({**waiting, **data}),
+                     error, now, now + self.baseDelay, letterID)
+                )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return letterID
+
+    def supersede(self, endpoint: str, customerID: str, data: dict) -> int:
+        """Removes the fields of a successful write from the letters waiting for the table and customer.
+        Letters left with nothing to write are deleted.  Letters being retried get the fields in 'superseded'
+        instead, see retry.
+
+        Args:
+            endpoint (str): endpoint url of the Caspio table
+            customerID (str): CustomerID of the write.
+            data (dict): Key:Value information written to Caspio.
+
+        Returns:
+            int: Number of letters changed or deleted.
+        """
+        conn = self._connection()
+        query = "SELECT id, payload, status, superseded FROM letters WHERE endpoint=? AND customerID=?"
+        # Read first, so the usual case of no letters for the customer never takes the write lock.
+        if conn.execute(query, (endpoint, customerID)).fetchone() is None:
+            return 0
+        changed = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for letterID, payload, status, superseded in conn.execute(query, (endpoint, customerID)).fetchall():
+                if status == 'running':
+                    # The retry holds its payload already, it reads these fields before and after its write.
+                    superseded = {**json.loads(superseded or "{}"), **data}
+                    conn.execute("UPDATE letters SET superseded=?, updatedAt=? WHERE id=?", (json.dumps(superseded), time.time(), letterID))
+                    changed += 1
+                    continue
+                remaining = {key: value for key, value in json.loads(payload).items() if key == 'CustomerID' or key not in data}
+                if set(remaining) <= {'CustomerID'}:
+                    conn.execute("DELETE FROM letters WHERE id=?", (letterID,))
+                else:
+                    conn.execute("UPDATE letters SET payload=?, updatedAt=? WHERE id=?", (json.dumps(remaining), time.time(), letterID))
+                changed += 1
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return changed
+
+    def letters(self, status: str = None, limit: int = 100) -> list[dict]:
+        """Letters in the order they were first stored.
+
+        Args:
+            status (str, optional): "pending", "running" or "failed", every letter when None.
+            limit (int, optional): Most letters returned.
+
+        Returns:
+            list[dict]: ex: [{"id": 1, "operation": "update", "endpoint": ..., "customerID": "cus_123", "data": {...},
+                "error": "400 ...", "status": "pending", "attempts": 1, ...}]
+        """
+        columns = "id, operation, endpoint, customerID, payload, error, status, attempts, createdAt, updatedAt, nextAttemptAt"
+        if status is None:
+            rows = self._connection().execute(f"SELECT {columns} FROM letters ORDER BY id LIMIT ?", (limit,))
+        else:
+            rows = self._connection().execute(f"SELECT {columns} FROM letters WHERE status=? ORDER BY id LIMIT ?", (status, limit))
+        return [self._letter(row) for row in rows]
+
+    def depth(self) -> dict:
+        """Number of letters per status.
+
+        Returns:
+            dict: ex: {"pending": 3, "running": 0, "failed": 1}
+        """
+        counts = {"pending": 0, "running": 0, "failed": 0}
+        for status, count in self._connection().execute("SELECT status, COUNT(*) FROM letters GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def delete(self, letterIDs: list[int]) -> int:
+        """Drops letters that should not be written, ex: after fixing the record by hand.
+
+        Args:
+            letterIDs (list[int]): ids of the letters.
+
+        Returns:
+            int: Number of letters deleted.
+        """
+        cursor = self._connection().executemany("DELETE FROM letters WHERE id=?", [(letterID,) for letterID in letterIDs])
+        return cursor.rowcount
+
+    def _claim(self, limit: int = 1, letterIDs: list[int] = None, statuses: tuple = None) -> list[dict]:
+        """Private Function. Leases letters.  By default the next letter that is due, including letters whose
+        lease ran out.  With letterIDs or statuses, the matching letters whether they are due or not.
+
+        Returns:
+            list[dict]: The leased letters, with their attempts counted.
+        """
+        conn = self._connection()
+        now = time.time()
+        if letterIDs is None and statuses is None:
+            where, params = "(status='pending' AND nextAttemptAt<=?)", [now]
+        else:
+            statuses = statuses or ("pending", "failed")
+            where, params = f"status IN ({','.join('?' * len(statuses))})", list(statuses)
+        where, params = f"({where} OR (status='running' AND leasedUntil<?))", params + [now]
+        if letterIDs is not None:
+            where += f" AND id IN ({','.join('?' * len(letterIDs))})"
+            params += list(letterIDs)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, operation, endpoint, customerID, payload, error, status, attempts, createdAt, updatedAt, nextAttemptAt "
+                f"FROM letters WHERE {where} ORDER BY id LIMIT ?",
+                (*params, -1 if limit is None else limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE letters SET status='running', leasedUntil=?, attempts=attempts+1 WHERE id=?",
+                [(now + self.leaseSeconds, row[0]) for row in rows]
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        letters = [self._letter(row) for row in rows]
+        for letter in letters:
+            letter["attempts"] += 1
+        return letters
+
+    def _fail(self, letter: dict, error: str):
+        """Private Function. Schedules the next retry with exponential backoff, or parks the letter as 'failed'."""
+        if letter["attempts"] >= self.maxAttempts:
+            self._connection().execute(
+                "UPDATE letters SET status='failed', leasedUntil=NULL, error=?, updatedAt=? WHERE id=?",
+                (error, time.time(), letter["id"])
+            )
+            return
+        delay = min(self.maxDelay, self.baseDelay * 2 ** (letter["attempts"] - 1)) * random.uniform(0.5, 1.0)
+        self._connection().execute(
+            "UPDATE letters SET status='pending', leasedUntil=NULL, error=?, updatedAt=?, nextAttemptAt=? WHERE id=?",
+            (error, time.time(), time.time() + delay, letter["id"])
+        )
+
+    def _dropSuperseded(self, letter: dict) -> bool:
+        """Private Function. Removes the fields written since the letter was claimed from the letter.
+
+        Returns:
+            bool: False when nothing is left to write and the letter was deleted.
+        """
+        conn = self._connection()
+        query = "SELECT superseded FROM letters WHERE id=? AND superseded IS NOT NULL"
+        if conn.execute(query, (letter["id"],)).fetchone() is None:
+            return True
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(query, (letter["id"],)).fetchone()
+            if row is not None:
+                superseded = json.loads(row[0])
+                letter["data"] = {key: value for key, value in letter["data"].items() if key == 'CustomerID' or key not in superseded}
+                if set(letter["data"]) <= {'CustomerID'}:
+                    conn.execute("DELETE FROM letters WHERE id=?", (letter["id"],))
+                else:
+                    conn.execute("UPDATE letters SET payload=?, superseded=NULL WHERE id=?", (json.dumps(letter["data"]), letter["id"]))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return not set(letter["data"]) <= {'CustomerID'}
+
+    def _resolve(self, letter: dict):
+        """Private Function. Deletes a written letter.  When fields of it were written by a newer write during the
+        retry, those newer values are written again, the retry may have put the older ones back in Caspio."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT superseded FROM letters WHERE id=?", (letter["id"],)).fetchone()
+            superseded = json.loads(row[0]) if row is not None and row[0] else {}
+            rewrite = {key: value for key, value in superseded.items() if key in letter["data"] and key != 'CustomerID'}
+            if rewrite:
+                conn.execute(
+                    "UPDATE letters SET operation='update', payload=?, error=?, status='pending', attempts=0, leasedUntil=NULL, "
+                    "superseded=NULL, updatedAt=?, nextAttemptAt=? WHERE id=?",
+                    (json.dumps(rewrite), "Superseded while it was retried", now, now, letter["id"])
+                )
+            else:
+                conn.execute("DELETE FROM letters WHERE id=?", (letter["id"],))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def retry(self, letter: dict, apply: Callable[[dict], None]) -> bool:
+        """Writes a leased letter again and removes it, or records the failure.  Fields written by a newer write
+        since the letter was claimed are left out, and written again when the newer write lands during the retry.
+
+        Args:
+            letter (dict): Letter returned by _claim.
+            apply (Callable[[dict], None]): Writes the letter to Caspio.  Raising marks the retry as failed.
+
+        Returns:
+            bool: True when the letter was written or nothing was left to write.
+        """
+        if not self._dropSuperseded(letter):
+            return True
+        try:
+            apply(letter)
+        except Exception as e:
+            self.logger.error(f"Dead letter #{letter['id']} retry {letter['attempts']} failed: {e}")
+            self._fail(letter, str(e))
+            return False
+        self._resolve(letter)
+        return True
+
+    def runOnce(self, apply: Callable[[dict], None]) -> bool:
+        """Retries the next letter that is due.
+
+        Args:
+            apply (Callable[[dict], None]): Writes the letter to Caspio.  Raising marks the retry as failed.
+
+        Returns:
+            bool: True when a letter was retried.
+        """
+        claimed = self._claim()
+        if not claimed:
+            return False
+        self.retry(claimed[0], apply)
+        return True
+
+    def drain(self, apply: Callable[[dict], None], workers: int = 8, letterIDs: list[int] = None,
+              statuses: tuple = ("pending", "failed")) -> dict:
+        """Retries the matching letters right away, including parked ones.  The letters of one table and customer
+        run in order, different customers run in parallel.
+
+        Args:
+            apply (Callable[[dict], None]): Writes the letter to Caspio.  Raising marks the retry as failed.
+            workers (int, optional): Customers retried at the same time.
+            letterIDs (list[int], optional): Only these letters.
+            statuses (tuple, optional): Only letters with these statuses.
+
+        Returns:
+            dict: ex: {"letters": 120, "resolved": 118, "failed": 2, "seconds": 1.4}
+        """
+        started = time.monotonic()
+        partitions = {}
+        for letter in self._claim(limit=None, letterIDs=letterIDs, statuses=statuses):
+            partitions.setdefault((letter["endpoint"], letter["customerID"]), []).append(letter)
+
+        def retryPartition(letters: list[dict]) -> int:
+            return sum(self.retry(letter, apply) for letter in letters)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            resolved = sum(executor.map(retryPartition, partitions.values()))
+        letters = sum(len(letters) for letters in partitions.values())
+        return {"letters": letters, "resolved": resolved, "failed": letters - resolved, "seconds": round(time.monotonic() - started, 3)}
+
+    def _retryLoop(self, apply: Callable[[dict], None], canRun: Callable[[], bool]):
+        """Private Function. Scheduler thread loop."""
+        while True:
+            try:
+                while canRun() and self.runOnce(apply):
+                    pass
+            except Exception as e:
+                self.logger.error(f"Dead letter scheduler error: {e}")
+            time.sleep(self.pollInterval)
+
+    def start(self, apply: Callable[[dict], None], canRun: Callable[[], bool] = None):
+        """Starts the retry scheduler thread of this process.  Safe to call repeatedly and after a fork.
+
+        Args:
+            apply (Callable[[dict], None]): Writes the letter to Caspio.  Raising marks the retry as failed.
+            canRun (Callable[[], bool], optional): Retries only run while it returns True, ex: Caspio is reachable.
+        """
+        if self._startedPid == os.getpid():
+            return
+        with self._startLock:
+            if self._startedPid == os.getpid():
+                return
+            threading.Thread(target=self._retryLoop, args=(apply, canRun or (lambda: True)), name="dead-letter-retry", daemon=True).start()
+            self._startedPid = os.getpid()
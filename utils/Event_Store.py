@@ -0,0 +1,131 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class Event_Store:
+    """Remembers which Stripe events were already applied so redeliveries are dropped before any
+    Stripe or Caspio call.  An in-memory LRU answers repeats seen by this worker, a SQLite (WAL)
+    file shared by every gunicorn worker is the source of truth.  Rows older than 'retentionDays'
+    are pruned.
+    """
+
+    PROCESSING = "processing"
+    PROCESSED = "processed"
+    FAILED = "failed"
+
+    def __init__(self, path: str, retentionDays: int = 30, lruSize: int = 10000, processingTimeout: int = 300):
+        """
+        Args:
+            path (str): SQLite file holding the event states.
+            retentionDays (int): Days an event id is remembered.
+            lruSize (int): Number of processed event ids kept in memory.
+            processingTimeout (int): Seconds after which an event stuck in 'processing' may be taken again.
+        """
+        self.path = path
+        self.retentionDays = retentionDays
+        self.lruSize = lruSize
+        self.processingTimeout = processingTimeout
+        self._processed = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._lastPrune = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """Private Function. One connection per thread, reopened after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "eventID TEXT PRIMARY KEY, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "updatedAt REAL NOT NULL, error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS events_updated ON events (updatedAt)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _remember(self, eventID: str):
+        """Private Function. Adds a processed event id to the in-memory LRU."""
+        with self._lock:
+            self._processed[eventID] = True
+            self._processed.move_to_end(eventID)
+            while len(self._processed) > self.lruSize:
+                self._processed.popitem(last=False)
+
+    def isProcessed(self, eventID: str) -> bool:
+        """Returns True when the event was already applied successfully.
+
+        Args:
+            eventID (str): Stripe event id ex: evt_123
+
+        Returns:
+            bool
+        """
+        if eventID in self._processed:
+            return True
+        row = self._connection().execute("SELECT state FROM events WHERE eventID=?", (eventID,)).fetchone()
+        if row and row[0] == self.PROCESSED:
+            self._remember(eventID)
+            return True
+        return False
+
+    def begin(self, eventID: str) -> bool:
+        """Claims the event for processing.
+
+        Args:
+            eventID (str): Stripe event id ex: evt_123
+
+        Returns:
+            bool: False when the event was already processed or another worker is processing it right now.
+        """
+        if eventID in self._processed:
+            return False
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state, updatedAt FROM events WHERE eventID=?", (eventID,)).fetchone()
+            if row and (row[0] == self.PROCESSED or (row[0] == self.PROCESSING and row[1] > now - self.processingTimeout)):
+                conn.execute("COMMIT")
+                if row[0] == self.PROCESSED:
+                    self._remember(eventID)
+                return False
+            conn.execute(
+                "INSERT INTO events (eventID, state, attempts, updatedAt) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(eventID) DO UPDATE SET state=excluded.state, attempts=attempts+1, updatedAt=excluded.updatedAt",
+                (eventID, self.PROCESSING, now)
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self._prune(now)
+        return True
+
+    def finish(self, eventID: str, success: bool, error: str = None):
+        """Records the outcome of processing the event.
+
+        Args:
+            eventID (str): Stripe event id ex: evt_123
+            success (bool): True marks the event processed, False marks it failed so a redelivery is processed again.
+            error (str, optional): Reason of the failure.
+        """
+        state = self.PROCESSED if success else self.FAILED
+        self._connection().execute(
+            "UPDATE events SET state=?, updatedAt=?, error=? WHERE eventID=?", (state, time.time(), error, eventID)
+        )
+        if success:
+            self._remember(eventID)
+
+    def _prune(self, now: float):
+        """Private Function. Deletes expired event ids, at most once an hour per worker."""
+        if now - self._lastPrune < 3600:
+            return
+        self._lastPrune = now
+        self._connection().execute("DELETE FROM events WHERE updatedAt<?", (now - self.retentionDays * 86400,))
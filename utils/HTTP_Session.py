@@ -0,0 +1,37 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HTTP_Session:
+    """Pooled keep-alive requests.Session shared by every request a worker handles.
+    The session is created lazily and rebuilt when the process id changes, so a session
+    opened before gunicorn forks is never shared between workers.
+    """
+
+    def __init__(self, poolConnections: int = 4, poolMaxsize: int = 10):
+        """
+        Args:
+            poolConnections (int): Number of hosts a connection pool is kept for.
+            poolMaxsize (int): Maximum number of kept-alive connections per host.
+        """
+        self.poolConnections = poolConnections
+        self.poolMaxsize = poolMaxsize
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """requests.Session for the current process."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.poolConnections, pool_maxsize=self.poolMaxsize)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import datetime
+import threading
+import logging.handlers
+from dotenv import dotenv_values
+from utils.Metrics import metrics
+
+
+def fields(category: str, **values) -> dict:
+    """extra= of a structured log call.  The values are serialized by the logging thread, so the caller must not
+    change them afterwards ex: app.logger.info("MERGE SUCCESS", extra=fields("caspio", customerID="cus_123"))
+
+    Args:
+        category (str): Sampling and level category ex: "webhook", "caspio", "scanner"
+        **values: JSON serializable fields added to the line.  Other objects are written with str().
+
+    Returns:
+        dict
+    """
+    return {"category": category, "fields": values}
+
+
+class JSON_Formatter(logging.Formatter):
+    """One JSON object per record: time, level, category, message, pid, the record's fields and the traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "category": getattr(record, "category", Log_Pipeline.DEFAULT_CATEGORY),
+            "message": record.getMessage(),
+            "pid": record.process
+        }
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            line.setdefault(key, value)
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+class _Bounded_Queue_Handler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves the formatting to the logging thread and drops records when the queue is full."""
+
+    def __init__(self, pipeline):
+        super().__init__(None)
+        self.pipeline = pipeline
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock QueueHandler formats the message and traceback here, on the calling thread.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self.pipeline.put(record)
+
+
+class _Listener(logging.handlers.QueueListener):
+    """QueueListener that reports the records dropped since its last line before writing the next one."""
+
+    def __init__(self, pipeline, *handlers):
+        super().__init__(pipeline.queue, *handlers, respect_handler_level=True)
+        self.pipeline = pipeline
+        self.reported = 0
+
+    def handle(self, record: logging.LogRecord):
+        dropped = self.pipeline.dropped
+        if dropped > self.reported:
+            report = logging.LogRecord(record.name, logging.WARNING, __file__, 0, "%d log records dropped, the log queue was full",
+                                       (dropped - self.reported,), None)
+            report.category = "logging"
+            report.fields = {"dropped": dropped - self.reported, "droppedTotal": dropped}
+            self.reported = dropped
+            super().handle(report)
+        super().handle(record)
+
+
+class Log_Pipeline:
+    """Non-blocking JSON lines logging.
+
+    The logger's handlers are replaced by a QueueHandler, so the request thread only filters the record and
+    puts it on a bounded queue.  A listener thread in each process formats the record (message, fields and
+    traceback) as one JSON line and writes it.  Records below WARNING can be sampled per category, every
+    category can have its own level, and when the queue is full records are dropped and counted instead of
+    blocking the request.  When disabled the same lines are written synchronously.
+    """
+
+    DEFAULT_CATEGORY = "app"
+
+    def __init__(self, path: str = None, maxQueue: int = 10000, sampleRates: dict = None, levels: dict = None,
+                 enabled: bool = True):
+        """
+        Args:
+            path (str, optional): File the lines are appended to, stderr when None.
+            maxQueue (int): Records waiting for the logging thread before new ones are dropped.
+            sampleRates (dict, optional): Share (0 to 1) of the records below WARNING kept per category ex: {"scanner": 0.01}
+            levels (dict, optional): Lowest level written per category ex: {"scanner": logging.WARNING}
+            enabled (bool): False writes every record synchronously on the calling thread.
+        """
+        self.path = path
+        self.maxQueue = maxQueue
+        self.sampleRates = sampleRates or {}
+        self.levels = levels or {}
+        self.enabled = enabled
+        self.queue = None
+        self.dropped = 0
+        self.sampledOut = 0
+        self._handler = None
+        self._listener = None
+        self._lock = threading.Lock()
+        self._startedPid = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Level gating and sampling of the record's category, called on the thread that logs.
+
+        Args:
+            record (logging.LogRecord): Record to write.
+
+        Returns:
+            bool: True when the record is kept.
+        """
+        category = getattr(record, "category", self.DEFAULT_CATEGORY)
+        if record.levelno < self.levels.get(category, logging.NOTSET):
+            return False
+        rate = self.sampleRates.get(category)
+        if rate is not None and record.levelno < logging.WARNING and random.random() >= rate:
+            with self._lock:
+                self.sampledOut += 1
+            metrics.inc("log_records_sampled_out_total", category=category)
+            return False
+        return True
+
+    def put(self, record: logging.LogRecord):
+        """Queues the record for the logging thread, or drops and counts it when the queue is full.
+
+        Args:
+            record (logging.LogRecord): Record to write.
+        """
+        self.start()
+        # SimpleQueue is lock-free in C, the bound is checked by hand and may be overshot by a few records.
+        if self.queue.qsize() < self.maxQueue:
+            self.queue.put_nowait(record)
+            return
+        with self._lock:
+            self.dropped += 1
+        metrics.inc("log_records_dropped_total", category=getattr(record, "category", self.DEFAULT_CATEGORY))
+
+    def _output(self) -> logging.Handler:
+        """Private Function. Handler writing the JSON lines."""
+        if self.path:
+            output = logging.handlers.WatchedFileHandler(self.path)
+        else:
+            output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JSON_Formatter())
+        return output
+
+    def install(self, logger: logging.Logger):
+        """Replaces the logger's handlers with the pipeline.
+
+        Args:
+            logger (logging.Logger): ex: app.logger
+        """
+        if self._handler is None:
+            self._handler = _Bounded_Queue_Handler(self) if self.enabled else self._output()
+            self._handler.addFilter(self)
+        logger.handlers = [self._handler]
+
+    def stats(self) -> dict:
+        """Records waiting, dropped because the queue was full and sampled out, in this process.
+
+        Returns:
+            dict: ex: {"queued": 0, "dropped": 12, "sampledOut": 340}
+        """
+        return {"queued": self.queue.qsize() if self.queue is not None else 0, "dropped": self.dropped, "sampledOut": self.sampledOut}
+
+    def stop(self):
+        """Writes the queued records and stops the logging thread of this process."""
+        with self._lock:
+            if self._listener is not None and self._startedPid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+                self._startedPid = None
+
+    def start(self):
+        """Starts the logging thread of this process.  Safe to call repeatedly and after a fork."""
+        if self._startedPid == os.getpid():
+            return
+        with self._lock:
+            if self._startedPid == os.getpid():
+                return
+            # A queue inherited through a fork may hold records and locks of the parent's threads.
+            self.queue = queue.SimpleQueue()
+            if self._startedPid is not None:
+                self.dropped = self.sampledOut = 0
+            self._listener = _Listener(self, self._output())
+            self._listener.start()
+            self._startedPid = os.getpid()
+        atexit.register(self.stop)
+
+
+def _level(name: str) -> int:
+    """Private Function. Level number of a level name ex: "WARNING" """
+    level = logging.getLevelName(name.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level {name}")
+    return level
+
+def _categoryMap(setting: str, parse) -> dict:
+    """Private Function. "scanner:0.01,webhook:0.5" as {"scanner": parse("0.01"), "webhook": parse("0.5")}"""
+    pairs = (item.split(":", 1) for item in (setting or "").split(",") if ":" in item)
+    return {category.strip(): parse(value.strip()) for category, value in pairs}
+
+
+_config = dict(dotenv_values('.env'))
+# Shared by every module of the process.
+logPipeline = Log_Pipeline(
+    path=_config.get('logPath') or None,
+    maxQueue=int(_config.get('logQueueSize', 10000)),
+    sampleRates=_categoryMap(_config.get('logSampleRates'), float),
+    levels=_categoryMap(_config.get('logLevels'), _level),
+    enabled=_config.get('logPipelineEnabled', 'True').lower() == 'true'
+)
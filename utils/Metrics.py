@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import fcntl
+import bisect
+import inspect
+import logging
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from dotenv import dotenv_values
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """Counters and latency histograms in the Prometheus text format, aggregated across gunicorn workers.
+
+    Recording only updates a dict in memory under a lock.  Every 'flushInterval' seconds a background
+    thread writes the process's totals to its own JSON file in 'path', and render() sums the files of
+    every worker.  The files of exited workers are folded into one cumulative file and deleted, which
+    keeps the counters monotonic across worker restarts without a file per restart.
+    """
+
+    EXITED_FILE = "exited.json"
+
+    def __init__(self, path: str, flushInterval: float = 5.0, buckets: tuple = DEFAULT_BUCKETS, enabled: bool = True,
+                 logger: logging.Logger = None):
+        """
+        Args:
+            path (str): Directory holding one file per worker process.
+            flushInterval (float): Seconds between writes of this process's file.
+            buckets (tuple): Upper bounds of the histogram buckets, in seconds.
+            enabled (bool): False turns recording into a no-op.
+            logger (logging.Logger, optional): Logger for flush failures.
+        """
+        self.path = path
+        self.flushInterval = flushInterval
+        self.buckets = tuple(buckets)
+        self.enabled = enabled
+        self.logger = logger or logging.getLogger(__name__)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._startedPid = None
+        self._fileName = None
+        self._filePid = None
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        """Private Function. Hashable key of a series."""
+        return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Adds to a counter.
+
+        Args:
+            name (str): Metric name ex: "caspio_writes_total"
+            amount (float): Amount added.
+            **labels: Label values ex: operation="merge", outcome="success"
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self.start()
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Records a duration in a histogram.
+
+        Args:
+            name (str): Metric name ex: "stripe_get_seconds"
+            seconds (float): Observed duration.
+            **labels: Label values ex: resource="v1/subscriptions"
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+        self.start()
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observes the duration of the with block, also when it raises.
+
+        Args:
+            name (str): Histogram name.
+            **labels: Label values.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator observing the duration of every call of the function, or of every await of a coroutine function.
+
+        Args:
+            name (str): Histogram name.
+            **labels: Label values.
+        """
+        def decorator(function):
+            if inspect.iscoroutinefunction(function):
+                @wraps(function)
+                async def asyncWrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return await function(*args, **kwargs)
+                return asyncWrapper
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _snapshot(self) -> dict:
+        """Private Function. Copy of this process's series."""
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "counters": [[name, labels, value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, labels, list(histogram[0]), histogram[1], histogram[2]] for (name, labels), histogram in self._histograms.items()]
+            }
+
+    def flush(self):
+        """Atomically writes this process's totals to its file."""
+        if not self.enabled:
+            return
+        self.start()
+        if self._filePid != os.getpid():
+            # pid plus start time, so a recycled pid never overwrites the file of an exited worker.
+            self._fileName = f"{os.getpid()}-{int(time.time() * 1000)}.json"
+            self._filePid = os.getpid()
+        os.makedirs(self.path, exist_ok=True)
+        filePath = os.path.join(self.path, self._fileName)
+        with open(filePath + ".tmp", "w") as metricsFile:
+            json.dump(self._snapshot(), metricsFile)
+        os.replace(filePath + ".tmp", filePath)
+
+    def _flushLoop(self):
+        """Private Function. Writes the process's file every flushInterval seconds."""
+        while True:
+            time.sleep(self.flushInterval)
+            try:
+                self.flush()
+            except OSError as e:
+                self.logger.warning(f"Metrics flush failed: {e}")
+
+    def start(self):
+        """Starts the flush thread of this process.  Safe to call repeatedly and after a fork."""
+        if self._startedPid == os.getpid():
+            return
+        with self._lock:
+            if self._startedPid == os.getpid():
+                return
+            if self._startedPid is not None:
+                # Forked from a process that already recorded: the parent's totals stay in the parent's file.
+                self._counters.clear()
+                self._histograms.clear()
+            self._startedPid = os.getpid()
+        threading.Thread(target=self._flushLoop, name="metrics-flush", daemon=True).start()
+
+    @staticmethod
+    def _running(fileName: str) -> bool:
+        """Private Function. True when the worker that writes the file ex: "1234-1700000000000.json" is alive."""
+        try:
+            pid = int(fileName.split("-", 1)[0])
+        except ValueError:
+            return False
+        if pid <= 0:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _read(self, fileName: str) -> dict:
+        """Private Function. Snapshot in the file, None when it is unreadable or has other buckets."""
+        try:
+            with open(os.path.join(self.path, fileName), "r") as metricsFile:
+                snapshot = json.load(metricsFile)
+        except (OSError, ValueError):
+            return None
+        return snapshot if snapshot.get("buckets") == list(self.buckets) else None
+
+    @staticmethod
+    def _add(counters: dict, histograms: dict, snapshot: dict):
+        """Private Function. Adds the series of a snapshot to the totals."""
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, bucketCounts, total, count in snapshot["histograms"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            merged = histograms.setdefault(key, [[0] * len(bucketCounts), 0.0, 0])
+            merged[0] = [left + right for left, right in zip(merged[0], bucketCounts)]
+            merged[1] += total
+            merged[2] += count
+
+    def _foldExited(self, fileNames: list) -> list:
+        """Private Function. Adds the files of exited workers to the exited file and deletes them.  Called under the
+        directory lock.  The exited file lists the files it holds until they are gone, so a crash before the delete
+        does not count them twice.
+
+        Args:
+            fileNames (list): Worker files in the directory.
+
+        Returns:
+            list: Worker files still to be summed.
+        """
+        exited = self._read(self.EXITED_FILE) or {"buckets": list(self.buckets), "counters": [], "histograms": [], "files": []}
+        folded = set(exited.get("files", []))
+        fileNames = [fileName for fileName in fileNames if fileName not in folded]
+        dead = [fileName for fileName in fileNames if not self._running(fileName)]
+        if dead:
+            counters, histograms = {}, {}
+            self._add(counters, histograms, exited)
+            for fileName in dead:
+                snapshot = self._read(fileName)
+                if snapshot is not None:
+                    self._add(counters, histograms, snapshot)
+            exited = {
+                "buckets": list(self.buckets),
+                "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+                "histograms": [[name, labels, *histogram] for (name, labels), histogram in histograms.items()],
+                "files": dead + [fileName for fileName in folded if os.path.exists(os.path.join(self.path, fileName))]
+            }
+            filePath = os.path.join(self.path, self.EXITED_FILE)
+            with open(filePath + ".tmp", "w") as metricsFile:
+                json.dump(exited, metricsFile)
+            os.replace(filePath + ".tmp", filePath)
+        for fileName in dead + list(folded):
+            try:
+                os.remove(os.path.join(self.path, fileName))
+            except FileNotFoundError:
+                pass
+        return [fileName for fileName in fileNames if fileName not in dead]
+
+    def aggregate(self) -> tuple:
+        """Sums the files of every worker, folding the files of exited workers into the exited file first.
+
+        Returns:
+            tuple: (counters, histograms) keyed by (name, labels).
+        """
+        counters, histograms = {}, {}
+        if not os.path.isdir(self.path):
+            return counters, histograms
+        with open(os.path.join(self.path, ".lock"), "a") as lockFile:
+            # One scrape at a time folds the files, another one could count a file and the exited file holding it.
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                fileNames = [
+                    fileName for fileName in os.listdir(self.path)
+                    if fileName.endswith(".json") and fileName != self.EXITED_FILE
+                ]
+                for fileName in self._foldExited(fileNames) + [self.EXITED_FILE]:
+                    snapshot = self._read(fileName)
+                    if snapshot is not None:
+                        self._add(counters, histograms, snapshot)
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+        return counters, histograms
+
+    @staticmethod
+    def _labels(labels: tuple, extra: tuple = ()) -> str:
+        """Private Function. Prometheus label set ex: {route="/queue",status="200"}"""
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            for key, value in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    @staticmethod
+    def _number(value: float) -> str:
+        """Private Function. Exact sample value ex: 1234567 or 0.25"""
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+
+    def render(self) -> str:
+        """Flushes this process and renders the totals of every worker.
+
+        Returns:
+            str: Prometheus text exposition format.
+        """
+        self.flush()
+        counters, histograms = self.aggregate()
+        lines = []
+        for name in sorted({key[0] for key in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (seriesName, labels), value in sorted(counters.items()):
+                if seriesName == name:
+                    lines.append(f"{name}{self._labels(labels)} {self._number(value)}")
+        for name in sorted({key[0] for key in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (seriesName, labels), (bucketCounts, total, count) in sorted(histograms.items()):
+                if seriesName != name:
+                    continue
+                cumulative = 0
+                for bound, bucketCount in zip(list(self.buckets) + ["+Inf"], bucketCounts):
+                    cumulative += bucketCount
+                    lines.append(f"{name}_bucket{self._labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {self._number(total)}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+_config = dict(dotenv_values('.env'))
+# Shared by every module of the process.
+metrics = Metrics(
+    path=_config.get('metricsPath', 'metrics'),
+    flushInterval=float(_config.get('metricsFlushInterval', 5)),
+    enabled=_config.get('metricsEnabled', 'True').lower() == 'true'
+)
@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import cProfile
+import logging
+import threading
+from collections import Counter
+from dotenv import dotenv_values
+
+
+class _NoPhase:
+    """Shared no-op context manager returned when nothing is traced."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class _Phase:
+    """Adds the duration of the with block to a phase of the current trace."""
+
+    def __init__(self, trace: dict, name: str):
+        self.trace = trace
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds, count = self.trace["phases"].get(self.name, (0.0, 0))
+        self.trace["phases"][self.name] = (seconds + time.perf_counter() - self.started, count + 1)
+        return False
+
+
+class _Trace:
+    """Traces the with block, see Profiler.trace."""
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.begin(self.name)
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        self.profiler.end(error=repr(exc) if exc else None)
+        return False
+
+
+class Profiler:
+    """Opt-in profiling of slow webhook requests.
+
+    Every traced request collects the time spent per phase (signature verification, Stripe, Caspio,
+    token refresh, ...).  A background thread samples the stack of requests running longer than half
+    the threshold, and a 'sampleRate' share of requests also runs under cProfile.  Requests slower
+    than 'threshold' and sampled requests are written to 'path' as JSON (plus a .prof file for
+    cProfile), keeping the newest 'maxFiles'.  When disabled every hook returns right away.
+    """
+
+    def __init__(self, path: str, threshold: float = 2.0, sampleRate: float = 0.0, maxFiles: int = 200,
+                 stackInterval: float = 0.01, enabled: bool = False, logger: logging.Logger = None):
+        """
+        Args:
+            path (str): Directory of the profile dumps.
+            threshold (float): Seconds above which a request is dumped.
+            sampleRate (float): Share of requests profiled with cProfile and dumped, 0 to 1.
+            maxFiles (int): Dumps kept, the oldest are deleted.
+            stackInterval (float): Seconds between stack samples of a slow request.
+            enabled (bool): False turns every hook into a no-op.
+            logger (logging.Logger, optional): Logger for dump failures.
+        """
+        self.path = path
+        self.threshold = threshold
+        self.sampleRate = sampleRate
+        self.maxFiles = maxFiles
+        self.stackInterval = stackInterval
+        self.enabled = enabled
+        self.logger = logger or logging.getLogger(__name__)
+        self._local = threading.local()
+        self._active = {}
+        self._profiling = False
+        self._lock = threading.Lock()
+        self._startedPid = None
+        self._sequence = itertools.count()
+
+    def phase(self, name: str):
+        """Context manager timing a phase of the current request ex: with profiler.phase("stripe.get"):
+
+        Args:
+            name (str): Phase name.
+        """
+        trace = getattr(self._local, "trace", None) if self.enabled else None
+        if trace is None:
+            return _NO_PHASE
+        return _Phase(trace, name)
+
+    def begin(self, name: str):
+        """Starts tracing the current thread's request.
+
+        Args:
+            name (str): What is traced ex: "POST /live/titlePro/subscriptions"
+        """
+        if not self.enabled:
+            return
+        self.start()
+        trace = {"name": name, "started": time.perf_counter(), "startedAt": time.time(), "phases": {},
+                 "stacks": Counter(), "profile": None}
+        with self._lock:
+            # One cProfile at a time per process, newer Pythons only allow a single active profiler.
+            if self.sampleRate and not self._profiling and random.random() < self.sampleRate:
+                trace["profile"] = cProfile.Profile()
+                self._profiling = True
+            self._active[threading.get_ident()] = trace
+        if trace["profile"] is not None:
+            try:
+                trace["profile"].enable()
+            except ValueError:
+                trace["profile"] = None
+                self._profiling = False
+        self._local.trace = trace
+
+    def end(self, **details):
+        """Stops tracing the current thread and dumps the trace when it was slow or sampled.
+
+        Args:
+            **details: Added to the dump ex: status=200
+        """
+        trace = getattr(self._local, "trace", None) if self.enabled else None
+        if trace is None:
+            return
+        self._local.trace = None
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+        if trace["profile"] is not None:
+            trace["profile"].disable()
+            self._profiling = False
+        elapsed = time.perf_counter() - trace["started"]
+        if elapsed >= self.threshold or trace["profile"] is not None:
+            try:
+                self._dump(trace, elapsed, details)
+            except OSError as e:
+                self.logger.warning(f"Profile dump failed: {e}")
+
+    def trace(self, name: str):
+        """Context manager tracing the with block like a request ex: a queued job.
+
+        Args:
+            name (str): What is traced.
+        """
+        return _Trace(self, name)
+
+    def _dump(self, trace: dict, elapsed: float, details: dict):
+        """Private Function. Writes the trace and prunes the oldest dumps."""
+        os.makedirs(self.path, exist_ok=True)
+        startedAt = time.strftime('%Y%m%d-%H%M%S', time.localtime(trace['startedAt'])) + f"{trace['startedAt'] % 1:.3f}"[1:]
+        baseName = f"{startedAt}-{os.getpid()}-{next(self._sequence)}-{int(elapsed * 1000)}ms"
+        phases = {name: {"seconds": round(seconds, 6), "count": count} for name, (seconds, count) in trace["phases"].items()}
+        report = {
+            "name": trace["name"],
+            "startedAt": trace["startedAt"],
+            "seconds": round(elapsed, 6),
+            "untracedSeconds": round(elapsed - sum(seconds for seconds, _ in trace["phases"].values()), 6),
+            "phases": phases,
+            "stacks": dict(trace["stacks"].most_common(50)),
+            "cProfile": f"{baseName}.prof" if trace["profile"] is not None else None,
+            **details
+        }
+        if trace["profile"] is not None:
+            trace["profile"].dump_stats(os.path.join(self.path, f"{baseName}.prof"))
+        with open(os.path.join(self.path, f"{baseName}.json"), "w") as dumpFile:
+            json.dump(report, dumpFile, indent=2)
+        self._prune()
+
+    def _prune(self):
+        """Private Function. Deletes the oldest dumps beyond maxFiles."""
+        dumps = sorted(fileName for fileName in os.listdir(self.path) if fileName.endswith(".json"))
+        for fileName in dumps[:max(0, len(dumps) - self.maxFiles)]:
+            for extension in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.path, fileName[:-len(".json")] + extension))
+                except FileNotFoundError:
+                    pass
+
+    def _sampleStacks(self):
+        """Private Function. Records the stacks of requests running longer than half the threshold."""
+        while True:
+            time.sleep(self.stackInterval)
+            with self._lock:
+                if not self._active:
+                    continue
+                now = time.perf_counter()
+                slow = {ident: trace for ident, trace in self._active.items() if now - trace["started"] >= self.threshold / 2}
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for ident, trace in slow.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    trace["stacks"][";".join(reversed(stack))] += 1
+
+    def start(self):
+        """Starts the stack sampling thread of this process.  Safe to call repeatedly and after a fork."""
+        if self._startedPid == os.getpid():
+            return
+        with self._lock:
+            if self._startedPid == os.getpid():
+                return
+            self._active.clear()
+            self._profiling = False
+            threading.Thread(target=self._sampleStacks, name="profiler-stacks", daemon=True).start()
+            self._startedPid = os.getpid()
+
+
+_config = dict(dotenv_values('.env'))
+# Shared by every module of the process.
+profiler = Profiler(
+    path=_config.get('profilerPath', 'profiles'),
+    threshold=float(_config.get('profilerThreshold', 2)),
+    sampleRate=float(_config.get('profilerSampleRate', 0)),
+    maxFiles=int(_config.get('profilerMaxFiles', 200)),
+    enabled=_config.get('profilerEnabled', 'False').lower() == 'true'
+)
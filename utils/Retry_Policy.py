@@ -0,0 +1,150 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+import httpx
+import urllib3
+import requests
+
+
+class Retry_Policy:
+    """Decides if and when a failed HTTP request is sent again.
+
+    Attempts are bounded by 'maxAttempts' and 'maxElapsed'.  Waits grow exponentially with full
+    jitter, or follow the server's Retry-After header.  Per-status rules keep POST (not idempotent)
+    from being retried when the server may already have applied it.  Counters of every retry are
+    kept for monitoring.
+    """
+
+    IDEMPOTENT_METHODS = {"GET", "PUT", "DELETE", "HEAD", "OPTIONS"}
+
+    def __init__(self, maxAttempts: int = 4, baseDelay: float = 0.5, maxDelay: float = 8.0, maxElapsed: float = 30.0,
+                 retryStatuses: set = None, unsafeRetryStatuses: set = None):
+        """
+        Args:
+            maxAttempts (int): Total attempts of a request, including the first one.
+            baseDelay (float): Wait in seconds before the first retry, doubled on every attempt.
+            maxDelay (float): Upper bound of a single wait, also applied to Retry-After.
+            maxElapsed (float): No retry is started once this many seconds passed since the first attempt.
+            retryStatuses (set, optional): Status codes retried for idempotent methods.
+            unsafeRetryStatuses (set, optional): Status codes retried for POST, where the server did not apply the request.
+        """
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.maxElapsed = maxElapsed
+        self.retryStatuses = retryStatuses or {429, 500, 502, 503, 504}
+        self.unsafeRetryStatuses = unsafeRetryStatuses or {429, 503}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, amount: int = 1):
+        """Adds to a counter.
+
+        Args:
+            name (str): Counter name ex: "retry_503"
+            amount (int): Amount added.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def stats(self) -> dict:
+        """Copy of the counters ex: {"requests": 120, "retries": 4, "retry_429": 3, "retry_ReadTimeout": 1, "gaveUp": 0}
+
+        Returns:
+            dict
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def shouldRetry(self, method: str, attempt: int, started: float, response: requests.Response = None, error: Exception = None) -> bool:
+        """Whether the request that just failed is sent again.
+
+        Args:
+            method (str): HTTP method of the request.
+            attempt (int): Number of the attempt that failed, starting at 1.
+            started (float): time.monotonic() of the first attempt.
+            response (requests.Response, optional): Response of the failed attempt.
+            error (Exception, optional): Error raised by the failed attempt.
+
+        Returns:
+            bool
+        """
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        if error is not None:
+            # A reset or read error may come after the server applied the POST, only a failed connect never sent it.
+            retryable = isinstance(error, (requests.ConnectionError, requests.Timeout)) and (
+                idempotent or isinstance(error, requests.ConnectTimeout) or self._notSent(error)
+            )
+            reason = type(error).__name__
+        else:
+            statuses = self.retryStatuses if idempotent else self.unsafeRetryStatuses
+            retryable = response.status_code in statuses
+            reason = str(response.status_code)
+
+        if not retryable:
+            return False
+        if attempt >= self.maxAttempts or time.monotonic() - started >= self.maxElapsed:
+            self.count("gaveUp")
+            return False
+        self.count("retries")
+        self.count(f"retry_{reason}")
+        return True
+
+    @staticmethod
+    def _notSent(error: Exception) -> bool:
+        """Private Function. True when the error, or one it was raised from, is a failure to open the connection
+        ex: requests.ConnectionError(MaxRetryError(reason=NewConnectionError)), or httpx.ConnectError mapped by Async_HTTP_Session"""
+        seen = set()
+        while error is not None and id(error) not in seen:
+            seen.add(id(error))
+            if isinstance(error, (urllib3.exceptions.NewConnectionError, httpx.ConnectError)):
+                return True
+            if isinstance(error, urllib3.exceptions.MaxRetryError):
+                error = error.reason
+            elif error.args and isinstance(error.args[0], BaseException):
+                error = error.args[0]
+            else:
+                error = error.__cause__
+        return False
+
+    def delay(self, attempt: int, response: requests.Response = None) -> float:
+        """Seconds to wait before the next attempt.
+
+        Args:
+            attempt (int): Number of the attempt that failed, starting at 1.
+            response (requests.Response, optional): Response of the failed attempt, for its Retry-After header.
+
+        Returns:
+            float
+        """
+        retryAfter = self._retryAfter(response)
+        if retryAfter is not None:
+            return min(retryAfter, self.maxDelay)
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** (attempt - 1)))
+
+    @staticmethod
+    def _retryAfter(response: requests.Response):
+        """Private Function. Retry-After header in seconds, given either as seconds or as an HTTP date."""
+        if response is None or not getattr(response, "headers", None):
+            return None
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def wait(self, attempt: int, response: requests.Response = None):
+        """Sleeps for delay(attempt, response).
+
+        Args:
+            attempt (int): Number of the attempt that failed, starting at 1.
+            response (requests.Response, optional): Response of the failed attempt.
+        """
+        time.sleep(self.delay(attempt, response))
@@ -1,5 +1,11 @@
 import json
-import requests
+from typing import Iterator
+from urllib.parse import urlencode
+from dotenv import dotenv_values
+from utils.HTTP_Session import HTTP_Session
+from utils.Subscription_Cache import Subscription_Cache
+from utils.Metrics import metrics
+from utils.Profiler import profiler
 # The library needs to be configured with your account's secret key.
 # Ensure the key is kept out of any version control system you might be using.
 class FailedGetRequest(Exception):
@@ -9,8 +15,13 @@ class FailedGetRequest(Exception):
 
 class Stripe_API:
 
-    def __init__(self, secretKey: str):
+    _config = dict(dotenv_values('.env'))
+    _apiURL = _config.get('stripeAPIURL', 'https://api.stripe.com')
+    _http = HTTP_Session(poolConnections=int(_config.get('stripePoolConnections', 2)), poolMaxsize=int(_config.get('stripePoolMaxsize', 10)))
+
+    def __init__(self, secretKey: str, subscriptionCache: Subscription_Cache = None):
         self.headers = { "Authorization": f"Bearer {secretKey}"}
+        self.subscriptionCache = subscriptionCache
 
     def get(self, endpoint: str) -> dict:
         """Perform a get request to endpoint
@@ -18,8 +29,11 @@ class Stripe_API:
         Args: endpoint (str): url endpoint of api get request
         Returns: dict: Json response data turned into a dict.
         """
-        
-        response = requests.get(f"https://api.stripe.com/{endpoint}", headers=self.headers, timeout=10)
+        # Label by resource ex: "v1/subscriptions", not by object id.
+        resource = "/".join(endpoint.split("?")[0].split("/")[:2])
+        with metrics.timer("stripe_get_seconds", resource=resource), profiler.phase("stripe.get"):
+            response = self._http.session.get(f"{self._apiURL}/{endpoint}", headers=self.headers, timeout=10)
+        metrics.inc("stripe_responses_total", resource=resource, status=response.status_code)
         if response.status_code == 200:
             return dict(json.loads(response.text))
         raise FailedGetRequest(f"{response.status_code} : {response.text}")
@@ -27,12 +41,45 @@ class Stripe_API:
     def getSubscriptionObject(self, subscriptionID: str) -> dict:
         """Perform a Get request to /v1/subscriptions/id
         https://stripe.com/docs/api/subscriptions/object
+        When a subscriptionCache is set the cached subscription is returned instead when it is recent enough.
+
+        Args: subscriptionID (str): ID of the Stripe Subscription Object
+        Returns: dict: Json response data turned into a dict.
+        """
+        if self.subscriptionCache is not None:
+            return self.subscriptionCache.get(subscriptionID, loader=self.fetchSubscriptionObject)
+        return self.fetchSubscriptionObject(subscriptionID)
+
+    def fetchSubscriptionObject(self, subscriptionID: str) -> dict:
+        """Perform a Get request to /v1/subscriptions/id, bypassing the subscriptionCache.
 
         Args: subscriptionID (str): ID of the Stripe Subscription Object
         Returns: dict: Json response data turned into a dict.
         """
         return self.get(f"v1/subscriptions/{subscriptionID}")
     
+    def iterSubscriptions(self, status: str = "all", limit: int = 100, expandCustomer: bool = False) -> Iterator[dict]:
+        """Yields every subscription of the account, following Stripe's 'starting_after' pagination lazily.
+        https://stripe.com/docs/api/subscriptions/list
+
+        Args:
+            status (str, optional): Stripe status filter, "all" includes canceled subscriptions.
+            limit (int, optional): Subscriptions per request, at most 100.
+            expandCustomer (bool, optional): Return the customer object (with its email) instead of its ID.
+
+        Yields:
+            dict: One subscription object.
+        """
+        params = {"status": status, "limit": limit}
+        if expandCustomer:
+            params["expand[]"] = "data.customer"
+        while True:
+            page = self.get(f"v1/subscriptions?{urlencode(params)}")
+            yield from page['data']
+            if not page.get('has_more') or not page['data']:
+                return
+            params["starting_after"] = page['data'][-1]['id']
+
     def getInvoiceObject(self, invoiceID: str)  -> dict:
         """Perform a Get request to /v1/invoices/id 
         Currently used to retreive: email, billing reason
@@ -42,3 +89,28 @@ class Stripe_API:
         """
         return self.get(f"v1/invoices/{invoiceID}")
 
+    @staticmethod
+    def subscriptionFromInvoice(invoiceObject: dict) -> dict:
+        """Reads the subscription quantity of a paid invoice from the invoice itself, so no request is needed.
+        Only answers when the invoice holds exactly one non-proration line for its subscription, all lines are
+        included (no 'has_more') and the invoice was paid for a subscription cycle or update.  The invoice does not
+        carry the subscription status, so it is left out, and a subscription create (a new Caspio row that needs a
+        status) is left to the Stripe API.
+
+        Args: invoiceObject (dict): https://stripe.com/docs/api/invoices/object
+        Returns: dict: {"id", "quantity"} or None when the invoice is missing fields or is ambiguous.
+        """
+        subscriptionID = invoiceObject.get('subscription')
+        lines = invoiceObject.get('lines') or {}
+        if not subscriptionID or lines.get('has_more') or not invoiceObject.get('paid'):
+            return None
+        if invoiceObject.get('billing_reason') not in {'subscription_cycle', 'subscription_update'}:
+            return None
+
+        subscriptionLines = [
+            line for line in lines.get('data') or []
+            if line.get('type') == 'subscription' and not line.get('proration') and line.get('subscription', subscriptionID) == subscriptionID
+        ]
+        if len(subscriptionLines) != 1 or subscriptionLines[0].get('quantity') is None:
+            return None
+        return {"id": subscriptionID, "quantity": subscriptionLines[0]['quantity']}
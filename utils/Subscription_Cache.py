@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from typing import Callable
+
+
+class Subscription_Cache:
+    """Stripe subscription cache keyed by subscription ID, stored in a SQLite (WAL) file shared by every
+    gunicorn worker.  customer.subscription.updated/.deleted events write through to it, so invoice.paid
+    can read quantity and status without calling Stripe.
+
+    Entries younger than 'ttl' seconds are served as is.  Entries up to 'staleWhileRevalidate' seconds
+    past the ttl are served while a background thread fetches a fresh copy.  Older or missing entries
+    are fetched synchronously.
+    """
+
+    FIELDS = ("id", "customer", "status", "quantity", "cancel_at", "current_period_end")
+
+    def __init__(self, path: str, ttl: int = 3600, staleWhileRevalidate: int = 86400, logger: logging.Logger = None):
+        """
+        Args:
+            path (str): SQLite file holding the cache.
+            ttl (int): Seconds an entry is fresh.  0 disables the cache.
+            staleWhileRevalidate (int): Seconds past the ttl a stale entry is still served while it is refreshed.
+            logger (logging.Logger, optional): Logger for background refresh failures.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.staleWhileRevalidate = staleWhileRevalidate
+        self.logger = logger or logging.getLogger(__name__)
+        self._local = threading.local()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Private Function. One connection per thread, reopened after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS subscriptions ("
+                "subscriptionID TEXT PRIMARY KEY, data TEXT NOT NULL, eventCreated INTEGER NOT NULL, cachedAt REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def put(self, subscriptionObject: dict, created: int = None):
+        """Stores the subscription.  An entry written from a newer event is never replaced by an older one.
+
+        Args:
+            subscriptionObject (dict): https://stripe.com/docs/api/subscriptions/object
+            created (int, optional): 'created' of the event carrying the object.  None for objects fetched from the API.
+        """
+        if self.ttl <= 0:
+            return
+        data = json.dumps({field: subscriptionObject.get(field) for field in self.FIELDS})
+        created = int(created) if created is not None else int(time.time())
+        try:
+            self._connection().execute(
+                "INSERT INTO subscriptions (subscriptionID, data, eventCreated, cachedAt) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(subscriptionID) DO UPDATE SET data=excluded.data, eventCreated=excluded.eventCreated, "
+                "cachedAt=excluded.cachedAt WHERE excluded.eventCreated>=subscriptions.eventCreated",
+                (subscriptionObject["id"], data, created, time.time())
+            )
+        except sqlite3.Error as e:
+            self.logger.warning(f"Subscription cache write failed: {e}")
+
+    def _read(self, subscriptionID: str):
+        """Private Function. Cached subscription and its age in seconds, or (None, None)."""
+        try:
+            row = self._connection().execute(
+                "SELECT data, cachedAt FROM subscriptions WHERE subscriptionID=?", (subscriptionID,)
+            ).fetchone()
+        except sqlite3.Error:
+            return None, None
+        if row is None:
+            return None, None
+        return json.loads(row[0]), time.time() - row[1]
+
+    def get(self, subscriptionID: str, loader: Callable[[str], dict]) -> dict:
+        """Returns the subscription from the cache, or from 'loader' when it is missing or too old.
+
+        Args:
+            subscriptionID (str): ID of the Stripe Subscription Object
+            loader (Callable[[str], dict]): Fetches the subscription from Stripe.
+
+        Returns:
+            dict: The subscription (cached entries only hold the fields in FIELDS).
+        """
+        subscription = self.peek(subscriptionID, loader)
+        if subscription is not None:
+            return subscription
+
+        subscription = loader(subscriptionID)
+        self.put(subscription)
+        return subscription
+
+    def peek(self, subscriptionID: str, loader: Callable[[str], dict]) -> dict:
+        """Returns the subscription when the cache can serve it, refreshing stale entries in the background.
+        Lets async callers fetch missing entries themselves, then put() them.
+
+        Args:
+            subscriptionID (str): ID of the Stripe Subscription Object
+            loader (Callable[[str], dict]): Fetches the subscription from Stripe, called from a background thread.
+
+        Returns:
+            dict: The cached subscription, or None when it is missing or too old.
+        """
+        if self.ttl <= 0:
+            return None
+
+        subscription, age = self._read(subscriptionID)
+        if subscription is not None:
+            if age <= self.ttl:
+                return subscription
+            if age <= self.ttl + self.staleWhileRevalidate:
+                self._revalidate(subscriptionID, loader)
+                return subscription
+        return None
+
+    def _revalidate(self, subscriptionID: str, loader: Callable[[str], dict]):
+        """Private Function. Refreshes the entry in a background thread, once at a time per subscription."""
+        with self._lock:
+            if subscriptionID in self._refreshing:
+                return
+            self._refreshing.add(subscriptionID)
+
+        def refresh():
+            try:
+                self.put(loader(subscriptionID))
+            except Exception as e:
+                self.logger.warning(f"Subscription cache refresh of {subscriptionID} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(subscriptionID)
+
+        threading.Thread(target=refresh, daemon=True).start()
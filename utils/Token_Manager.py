@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+
+class Token_Manager:
+    """Keeps the Caspio bearer access token for every gunicorn worker.
+
+    The current tokens live in a small JSON file shared by the workers.  A refresh takes an
+    exclusive file lock, so only one worker at a time talks to the token endpoint.  Workers
+    waiting on the lock, or noticing the file changed, adopt the new token without another
+    refresh.  Tokens are refreshed 'refreshMargin' seconds before 'expires_in' runs out by a
+    background thread, and the .env copy is written from a background thread too.
+    """
+
+    def __init__(self, path: str, fetchTokens: Callable[[str], dict], accessToken: str, refreshToken: str,
+                 refreshMargin: int = 300, persist: Callable[[dict], None] = None, logger: logging.Logger = None):
+        """
+        Args:
+            path (str): JSON file holding the shared tokens.
+            fetchTokens (Callable[[str], dict]): Called with the refresh token, returns the token endpoint's
+                response ('access_token', optional 'refresh_token' and 'expires_in') or None on failure.
+            accessToken (str): Access token to start from when the shared file does not exist yet.
+            refreshToken (str): Refresh token to start from when the shared file does not exist yet.
+            refreshMargin (int): Seconds before expiry at which the token is refreshed.
+            persist (Callable[[dict], None], optional): Called in the background with the new tokens ex: to update the .env
+            logger (logging.Logger, optional): Logger for refresh failures.
+        """
+        self.path = path
+        self.fetchTokens = fetchTokens
+        self.refreshMargin = refreshMargin
+        self.persist = persist
+        self.logger = logger or logging.getLogger(__name__)
+        self.refreshCount = 0
+        self._accessToken = accessToken
+        self._refreshToken = refreshToken
+        self._expiresAt = 0
+        self._fileStamp = None
+        self._lock = threading.Lock()
+        self._startedPid = None
+
+    @contextmanager
+    def _fileLock(self):
+        """Private Function. Exclusive lock shared by every process using the token file."""
+        with open(self.path + ".lock", "a") as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def _load(self):
+        """Private Function. Adopts the tokens in the shared file when it changed since the last read."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._fileStamp:
+            return
+        try:
+            with open(self.path, "r") as tokenFile:
+                state = json.load(tokenFile)
+        except (OSError, ValueError):
+            return
+        self._accessToken = state.get("accessToken", self._accessToken)
+        self._refreshToken = state.get("refreshToken", self._refreshToken)
+        self._expiresAt = state.get("expiresAt", 0)
+        self._fileStamp = stamp
+
+    def _save(self):
+        """Private Function. Atomically replaces the shared token file."""
+        tempPath = f"{self.path}.{os.getpid()}.tmp"
+        with os.fdopen(os.open(tempPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as tokenFile:
+            json.dump({"accessToken": self._accessToken, "refreshToken": self._refreshToken, "expiresAt": self._expiresAt}, tokenFile)
+        os.replace(tempPath, self.path)
+        stat = os.stat(self.path)
+        self._fileStamp = (stat.st_mtime_ns, stat.st_size)
+
+    def _expiring(self) -> bool:
+        """Private Function. True when the token expires within the refresh margin.  Unknown expiry counts as valid."""
+        return bool(self._expiresAt) and time.time() >= self._expiresAt - self.refreshMargin
+
+    def accessToken(self) -> str:
+        """Current access token.  Picks up tokens refreshed by other workers.
+
+        Returns:
+            str: Bearer access token.
+        """
+        self.start()
+        self._load()
+        if self._expiring():
+            return self.refresh(staleToken=self._accessToken)
+        return self._accessToken
+
+    def refresh(self, staleToken: str = None) -> str:
+        """Refreshes the access token, unless another thread or worker already replaced 'staleToken'.
+
+        Args:
+            staleToken (str, optional): Token that was rejected or is about to expire.
+
+        Returns:
+            str: Bearer access token.
+        """
+        with self._lock:
+            with self._fileLock():
+                self._load()
+                if staleToken is not None and self._accessToken != staleToken and not self._expiring():
+                    return self._accessToken
+
+                tokens = self.fetchTokens(self._refreshToken)
+                if not tokens or "access_token" not in tokens:
+                    self.logger.error("Caspio token refresh failed")
+                    return self._accessToken
+
+                self._accessToken = tokens["access_token"]
+                self._refreshToken = tokens.get("refresh_token", self._refreshToken)
+                self._expiresAt = time.time() + int(tokens["expires_in"]) if tokens.get("expires_in") else 0
+                self.refreshCount += 1
+                self._save()
+
+        if self.persist is not None:
+            persisted = {"bearerAccessToken": self._accessToken, "refreshToken": self._refreshToken}
+            threading.Thread(target=self._persist, args=(persisted,), daemon=True).start()
+        return self._accessToken
+
+    def _persist(self, tokens: dict):
+        """Private Function. Runs the persist callback under the file lock, away from the request."""
+        try:
+            with self._fileLock():
+                self.persist(tokens)
+        except Exception as e:
+            self.logger.error(f"Could not persist Caspio tokens: {e}")
+
+    def _refreshLoop(self):
+        """Private Function. Refreshes the token shortly before it expires."""
+        while True:
+            self._load()
+            if self._expiresAt:
+                wait = self._expiresAt - self.refreshMargin - time.time()
+                if wait <= 0:
+                    try:
+                        self.refresh(staleToken=self._accessToken)
+                    except Exception as e:
+                        self.logger.error(f"Caspio token refresh failed: {e}")
+                    wait = 60
+            else:
+                wait = 60
+            time.sleep(min(max(wait, 1), 60))
+
+    def start(self):
+        """Starts the proactive refresh thread of this process.  Safe to call repeatedly and after a fork."""
+        if self._startedPid == os.getpid():
+            return
+        with self._lock:
+            if self._startedPid != os.getpid():
+                threading.Thread(target=self._refreshLoop, name="caspio-token-refresh", daemon=True).start()
+                self._startedPid = os.getpid()
@@ -0,0 +1,47 @@
+from functools import partial
+from typing import Callable
+from utils.Stripe_API import Stripe_API
+from utils.Webhook_Verifier import Webhook_Verifier
+
+
+class Webhook_Route:
+    """Everything a webhook route needs, built once per worker at startup: the product and environment,
+    the Caspio table, the Stripe client, the signature verifier and the handler of each event type.
+    Requests only look the route up, nothing is read from the .env or created per request.
+    """
+
+    __slots__ = ("product", "environment", "endpoint", "stripeAPI", "verifier", "handlers")
+
+    def __init__(self, product: str, environment: str, endpoint: str, stripeAPI: Stripe_API, verifier: Webhook_Verifier,
+                 handlers: dict):
+        """
+        Args:
+            product (str): "DispositionPro" or "TitlePro"
+            environment (str): "Prod" or "Dev"
+            endpoint (str): endpoint url of the Caspio table of the product
+            stripeAPI (Stripe_API): Client of the Stripe account of the route.
+            verifier (Webhook_Verifier): Verifier of the route's signing secret.
+            handlers (dict): Event type:handler taking the event's data.object, with every other argument
+                already bound ex: functools.partial(handler, endpoint=..., caspioAPI=...)
+        """
+        self.product = product
+        self.environment = environment
+        self.endpoint = endpoint
+        self.stripeAPI = stripeAPI
+        self.verifier = verifier
+        self.handlers = handlers
+
+    def handler(self, eventType: str, endpoint: str = None) -> Callable:
+        """Handler of the event type.
+
+        Args:
+            eventType (str): ex: "invoice.paid"
+            endpoint (str, optional): Caspio table to write to instead of the route's ex: for jobs queued before a table move.
+
+        Returns:
+            Callable: Handler taking the event's data.object, None for event types the route ignores.
+        """
+        handler = self.handlers.get(eventType)
+        if handler is not None and endpoint is not None and endpoint != self.endpoint:
+            return partial(handler, endpoint=endpoint)
+        return handler
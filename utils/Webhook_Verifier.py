@@ -0,0 +1,132 @@
+import re
+import hmac
+import json
+import time
+from hashlib import sha256
+import stripe
+
+EVENT_ID = re.compile(rb'"id"\s*:\s*"(evt_[A-Za-z0-9_]+)"')
+
+
+class Webhook_Event:
+    """Read-only view of a verified Stripe event.  The id is read from the raw bytes, the JSON is only
+    parsed (into plain dicts) the first time any other field is accessed, so redeliveries can be
+    dropped without parsing the body.
+    """
+
+    __slots__ = ("payload", "_id", "_data")
+
+    def __init__(self, payload: bytes):
+        """
+        Args:
+            payload (bytes): Verified raw body of the webhook request.
+        """
+        self.payload = payload
+        match = EVENT_ID.search(payload)
+        self._id = match.group(1).decode("ascii") if match else None
+        self._data = None
+
+    def _parsed(self) -> dict:
+        """Private Function. The event parsed on first use."""
+        if self._data is None:
+            self._data = json.loads(self.payload)
+            self._id = self._data.get("id", self._id)
+        return self._data
+
+    @property
+    def id(self) -> str:
+        """Event id ex: evt_123, without parsing the payload."""
+        return self._id if self._id is not None else self._parsed()["id"]
+
+    def __getitem__(self, key: str):
+        if key == "id":
+            return self.id
+        return self._parsed()[key]
+
+    def get(self, key: str, default=None):
+        if key == "id":
+            return self.id
+        return self._parsed().get(key, default)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._parsed()
+
+    def toDict(self) -> dict:
+        """The parsed event.
+
+        Returns:
+            dict: https://stripe.com/docs/api/events/object
+        """
+        return self._parsed()
+
+
+class Webhook_Verifier:
+    """Verifies Stripe webhook signatures on the raw request bytes.
+
+    The HMAC key schedule is computed once per signing secret and copied for every request.  Payloads
+    that are too large, badly signed or too old are rejected before any JSON parsing.  Raises the same
+    exceptions as stripe.Webhook.construct_event, so the routes' error handling is unchanged.
+    """
+
+    SCHEME = "v1"
+
+    def __init__(self, secret: str, tolerance: int = 300, maxPayloadBytes: int = 524288):
+        """
+        Args:
+            secret (str): Webhook signing secret ex: whsec_...
+            tolerance (int): Seconds a signature timestamp stays valid.
+            maxPayloadBytes (int): Largest accepted body.
+        """
+        self.secret = secret
+        self.tolerance = tolerance
+        self.maxPayloadBytes = maxPayloadBytes
+        self._mac = hmac.new(secret.encode("utf-8"), digestmod=sha256)
+
+    def _signatures(self, header: str) -> tuple:
+        """Private Function. Timestamp and v1 signatures of the Stripe-Signature header."""
+        timestamp, signatures = None, []
+        for item in header.split(","):
+            key, _, value = item.strip().partition("=")
+            if key == "t":
+                timestamp = int(value)
+            elif key == self.SCHEME:
+                signatures.append(value.encode("ascii"))
+        if timestamp is None:
+            raise ValueError("no timestamp")
+        return timestamp, signatures
+
+    def verify(self, payload: bytes, header: str) -> Webhook_Event:
+        """Checks the Stripe-Signature header of the payload.
+
+        Args:
+            payload (bytes): Raw body of the webhook request.
+            header (str): Stripe-Signature header ex: "t=1700000000,v1=5257a8..."
+
+        Raises:
+            ValueError: The payload is empty or larger than maxPayloadBytes.
+            stripe.error.SignatureVerificationError: The header is malformed, no signature matches or the timestamp is too old.
+
+        Returns:
+            Webhook_Event: Lazy view of the event.
+        """
+        if not payload or len(payload) > self.maxPayloadBytes:
+            raise ValueError(f"Payload of {len(payload or b'')} bytes rejected")
+        try:
+            timestamp, signatures = self._signatures(header or "")
+        except (ValueError, UnicodeEncodeError):
+            raise stripe.error.SignatureVerificationError("Unable to extract timestamp and signatures from header", header, payload)
+        if not signatures:
+            raise stripe.error.SignatureVerificationError(f"No signatures found with expected scheme {self.SCHEME}", header, payload)
+
+        mac = self._mac.copy()
+        mac.update(b"%d." % timestamp)
+        mac.update(payload)
+        expected = mac.hexdigest().encode("ascii")
+        if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+            raise stripe.error.SignatureVerificationError("No signatures found matching the expected signature for payload", header, payload)
+        if self.tolerance and timestamp < time.time() - self.tolerance:
+            raise stripe.error.SignatureVerificationError(f"Timestamp outside the tolerance zone ({timestamp})", header, payload)
+        event = Webhook_Event(payload)
+        if event.get("id") is None:
+            raise ValueError("Event without an id")
+        return event
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import random
+import logging
+import sqlite3
+import threading
+from typing import Callable
+
+
+class Work_Queue:
+    """Durable local job queue stored in a SQLite (WAL) file shared by every gunicorn worker.
+    Jobs are leased while they run, so a job whose worker dies is picked up again once the lease
+    expires (at-least-once).  Failed jobs are retried with backoff until 'maxAttempts' is reached,
+    then kept with status 'failed'.
+
+    Jobs enqueued with the same 'key' are claimed together and handed to 'batchHandler' as one list,
+    so a delay on enqueue works as a coalescing window.
+    """
+
+    def __init__(self, path: str, handler: Callable[[dict], None], workers: int = 2, leaseSeconds: int = 120,
+                 maxAttempts: int = 5, pollInterval: float = 1.0, logger: logging.Logger = None,
+                 batchHandler: Callable[[list], None] = None, maxBatch: int = 50):
+        """
+        Args:
+            path (str): SQLite file holding the queue.
+            handler (Callable[[dict], None]): Called with each job.  Raising marks the attempt as failed.
+            workers (int): Number of background threads consuming jobs in each process.
+            leaseSeconds (int): Seconds a running job is owned by its worker before another worker may take it.
+            maxAttempts (int): Attempts before a job is left as 'failed'.
+            pollInterval (float): Seconds an idle worker waits before checking the queue again.
+            logger (logging.Logger): Logger for job failures.
+            batchHandler (Callable[[list], None], optional): Called instead of 'handler' with every job claimed
+                together under one key.  Raising marks the attempt of all of them as failed.
+            maxBatch (int): Most jobs claimed together under one key.
+        """
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.leaseSeconds = leaseSeconds
+        self.maxAttempts = maxAttempts
+        self.pollInterval = pollInterval
+        self.logger = logger or logging.getLogger(__name__)
+        self.batchHandler = batchHandler
+        self.maxBatch = maxBatch
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._startLock = threading.Lock()
+        self._startedPid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """Private Function. One connection per thread, reopened after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, availableAt REAL NOT NULL, leasedUntil REAL, "
+                "createdAt REAL NOT NULL, lastError TEXT, coalesceKey TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, availableAt)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (coalesceKey, status)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, job: dict, key: str = None, delay: float = 0) -> int:
+        """Durably stores the job and wakes a worker.
+
+        Args:
+            job (dict): JSON serializable job passed to the handler.
+            key (str, optional): Jobs with the same key are claimed together by the batchHandler.
+            delay (float, optional): Seconds before the job is due.
+
+        Returns:
+            int: id of the job.
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO jobs (payload, status, availableAt, createdAt, coalesceKey) VALUES (?, 'pending', ?, ?, ?)",
+            (json.dumps(job), now + delay, now, key)
+        )
+        self.start()
+        if not delay:
+            self._wake.set()
+        return cursor.lastrowid
+
+    def depth(self) -> dict:
+        """Number of jobs per status, plus the age in seconds of the oldest pending job.
+
+        Returns:
+            dict: ex: {"pending": 3, "running": 1, "failed": 0, "oldestPendingSeconds": 2.5}
+        """
+        conn = self._connection()
+        counts = {"pending": 0, "running": 0, "failed": 0}
+        for status, count in conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        oldest = conn.execute("SELECT MIN(createdAt) FROM jobs WHERE status='pending'").fetchone()[0]
+        counts["oldestPendingSeconds"] = round(time.time() - oldest, 3) if oldest else 0
+        return counts
+
+    def _claim(self) -> list:
+        """Private Function. Leases the next job that is due, including jobs whose lease ran out.
+        With a batchHandler, the pending jobs sharing its key are leased with it.
+
+        Returns:
+            list: (id, payload, attempts) of the leased jobs, empty when nothing is due.
+        """
+        conn = self._connection()
+        now = time.time()
+        leaseUntil = now + self.leaseSeconds
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, payload, attempts, coalesceKey FROM jobs WHERE (status='pending' AND availableAt<=?) "
+                "OR (status='running' AND leasedUntil<?) ORDER BY id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            rows = [row] if row else []
+            if row and row[3] is not None and self.batchHandler is not None:
+                # Jobs still in their coalescing window join the batch, jobs backing off after a failure wait.
+                rows += conn.execute(
+                    "SELECT id, payload, attempts, coalesceKey FROM jobs WHERE coalesceKey=? AND status='pending' "
+                    "AND (availableAt<=? OR attempts=0) AND id!=? ORDER BY id LIMIT ?",
+                    (row[3], now, row[0], self.maxBatch - 1)
+                ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status='running', leasedUntil=?, attempts=attempts+1 WHERE id=?",
+                [(leaseUntil, claimed[0]) for claimed in rows]
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return [(claimed[0], claimed[1], claimed[2] + 1) for claimed in rows]
+
+    def _complete(self, jobIDs: list):
+        """Private Function. Removes finished jobs."""
+        self._connection().executemany("DELETE FROM jobs WHERE id=?", [(jobID,) for jobID in jobIDs])
+
+    def _fail(self, jobID: int, attempts: int, error: str):
+        """Private Function. Schedules a retry with exponential backoff, or parks the job as 'failed'."""
+        if attempts >= self.maxAttempts:
+            self._connection().execute(
+                "UPDATE jobs SET status='failed', leasedUntil=NULL, lastError=? WHERE id=?", (error, jobID)
+            )
+            return
+        delay = min(300, 2 ** attempts) * random.uniform(0.5, 1.0)
+        self._connection().execute(
+            "UPDATE jobs SET status='pending', leasedUntil=NULL, availableAt=?, lastError=? WHERE id=?",
+            (time.time() + delay, error, jobID)
+        )
+
+    def runOnce(self) -> bool:
+        """Claims and runs the next job, or the next batch of jobs sharing a key.
+
+        Returns:
+            bool: True when a job was run.
+        """
+        claimed = self._claim()
+        if not claimed:
+            return False
+        jobIDs = [jobID for jobID, _, _ in claimed]
+        try:
+            jobs = [json.loads(payload) for _, payload, _ in claimed]
+            if self.batchHandler is not None:
+                self.batchHandler(jobs)
+            else:
+                self.handler(jobs[0])
+        except Exception as e:
+            self.logger.error(f"Queued job(s) {jobIDs} failed: {e}")
+            for jobID, _, attempts in claimed:
+                self._fail(jobID, attempts, str(e))
+        else:
+            self._complete(jobIDs)
+        return True
+
+    def _work(self):
+        """Private Function. Worker thread loop."""
+        while True:
+            try:
+                if self.runOnce():
+                    continue
+            except Exception as e:
+                self.logger.error(f"Work queue error: {e}")
+            self._wake.wait(self.pollInterval)
+            self._wake.clear()
+
+    def start(self):
+        """Starts the worker threads of this process.  Safe to call repeatedly and after a fork."""
+        if self._startedPid == os.getpid():
+            return
+        with self._startLock:
+            if self._startedPid == os.getpid():
+                return
+            for number in range(self.workers):
+                threading.Thread(target=self._work, name=f"work-queue-{number}", daemon=True).start()
+            self._startedPid = os.getpid()
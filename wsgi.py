@@ -0,0 +1,11 @@
+"""WSGI entry point of the Flask app, starts the background threads of each gunicorn worker.
+
+    gunicorn --workers 3 --bind unix:main.sock -m 007 wsgi:app
+
+With --preload the workers are forked after this import, call main.start() from a post_fork hook instead.
+"""
+from main import app, start
+
+__all__ = ["app"]
+
+start()